@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+"""
+Environments for many profiles from one loaded catalog
+(setapp --batch MANIFEST [--batch-dir DIR]).
+
+The manifest has one profile per line as JSON, or is YAML (.yaml or
+.yml) holding a list of profiles or one per document:
+    {"profile": "alice", "shell": "csh", "os": "RHEL_7.8",
+     "environ": {"PATH": "/usr/bin:/bin"}, "apps": ["matlab/2022a"]}
+Only profile and apps are required.  shell defaults to bash, os (an
+OS name or a uname -r release from OS_aliases) to this host's,
+environ to an empty environment; "remove": true removes the apps
+instead.  Each profile is planned by run_command() exactly as
+"setapp APP ..." would plan it in that environment, against the
+catalog as seen from its OS, so one host can build files for every
+OS in OS_aliases.
+
+Results are streamed in manifest order: one JSON line per profile
+on stdout, or with --batch-dir a PROFILE.sh / PROFILE.csh dotfile
+per profile.  Manifests of POOL_PROFILES or more are spread over a
+process pool whose workers each load the catalog once.
+"""
+import sys
+import os
+import setapp_core as SA
+
+POOL_PROFILES = 256   # smallest manifest worth a process pool
+Record_Keys   = { 'profile', 'shell', 'os', 'environ', 'apps', 'remove' }
+
+Catalog = None        # (infile, use_cache, app_data) in this process
+Indexes = {}          # OS -> Resolved
+
+def read_manifest(path):                                    # {{{
+    """
+    [(where, record), ...] from the manifest file ("-" for stdin);
+    where is "FILE:LINE" for JSON lines and "FILE#N" for YAML.
+    Exits on a line or document that doesn't parse.
+    """
+    fh = sys.stdin if path == '-' else open(path)
+    records = []
+    with fh:
+        if path.endswith(('.yaml', '.yml')):
+            import yaml
+            try:
+                for doc in yaml.load_all(fh, Loader=SA.yaml_loader()):
+                    for R in (doc if isinstance(doc, list) else [ doc ]):
+                        records.append( (f'{path}#{len(records) + 1}', R) )
+            except yaml.YAMLError as e:
+                print(f'{path}: {e}')
+                sys.exit(1)
+            return records
+        import json
+        for n, line in enumerate(fh, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                records.append( (f'{path}:{n}', json.loads(line)) )
+            except ValueError as e:
+                print(f'{path}:{n}: {e}')
+                sys.exit(1)
+    return records
+# }}}
+def record_error(R):                                        # {{{
+    """
+    Why record R can't be used, or "".
+    """
+    if not isinstance(R, dict):
+        return 'a profile must be a dictionary'
+    unknown = set(R) - Record_Keys
+    if unknown:
+        return f'unrecognized key "{sorted(unknown)[0]}"; allowed are ' + \
+               ', '.join(sorted(Record_Keys))
+    if not isinstance(R.get('profile'), str) or not R['profile'] or \
+       '/' in R['profile'] or R['profile'].startswith('.'):
+        return 'profile must be a file name'
+    if not isinstance(R.get('apps'), list) or \
+       not all(isinstance(A, str) for A in R['apps']):
+        return 'apps must be a list of applications'
+    if R.get('shell', 'bash') not in ('bash', 'csh'):
+        return 'shell must be "bash" or "csh"'
+    environ = R.get('environ', {})
+    if not isinstance(environ, dict) or \
+       not all(isinstance(V, str) for V in environ.values()):
+        return 'environ must map variables to strings'
+    return ''
+# }}}
+def target_os(name):                                        # {{{
+    """
+    The OS a profile's "os" entry names: an OS, or a release that
+    OS_aliases maps to one; this host's OS if name is None.
+    """
+    if name is None:
+        name = os.uname().release
+    if name in SA.OS_alias:
+        return SA.OS_alias[name]
+    return name if name in SA.OS_alias.values() else None
+# }}}
+def use_catalog(infile, use_cache=True):                    # {{{
+    """
+    Load the catalog into this process (a pool worker's initializer).
+    """
+    global Catalog
+    import io
+    import contextlib
+    with contextlib.redirect_stdout(io.StringIO()):
+        Catalog = (infile, use_cache,
+                   SA.load_app_data(infile=infile, use_cache=use_cache))
+    Indexes.clear()
+# }}}
+def plan(item):                                             # {{{
+    """
+    Plan one (where, record) from the manifest; returns its result,
+        { 'profile', 'shell', 'os', 'status' : 'ok' | 'error',
+          'delta', 'output' }
+    where output is what "setapp" would have printed.
+    """
+    import io
+    import contextlib
+    where, R = item
+    err = record_error(R)
+    if err:
+        return { 'profile' : R.get('profile') if isinstance(R, dict) else None,
+                 'shell' : None, 'os' : None, 'status' : 'error',
+                 'delta' : None, 'output' : f'{where}: {err}' }
+    OS = target_os(R.get('os'))
+    result = { 'profile' : R['profile'], 'shell' : R.get('shell', 'bash'),
+               'os' : OS, 'status' : 'error', 'delta' : None, 'output' : '' }
+    if OS is None:
+        result['output'] = f'{where}: OS "{R.get("os", os.uname().release)}"' \
+                           f' is not in OS_aliases'
+        return result
+    if OS not in Indexes:
+        Indexes[OS] = SA.Resolved(Catalog[2], OS)
+
+    class Args: pass
+    args = Args()
+    args.__dict__.update(SA.Quick_Defaults)
+    args.applications = list(R['apps'])
+    args.shell        = result['shell']
+    args.remove       = bool(R.get('remove')) or None
+    args.infile       = Catalog[0]
+    out = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(out):
+            delta = SA.run_command(args, Indexes[OS],
+                                   environ=dict(R.get('environ', {})))
+    except SystemExit:
+        delta = None
+    result['output'] = out.getvalue()
+    if delta is not None or not R['apps']:
+        result['status'] = 'ok'
+        result['delta']  = delta or {}
+    return result
+# }}}
+def results(items, jobs=None):                              # {{{
+    """
+    Yield plan() of each item in order, from a process pool for
+    POOL_PROFILES or more.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(items) < POOL_PROFILES:
+        yield from map(plan, items)
+        return
+    import concurrent.futures
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs,
+             initializer=use_catalog, initargs=Catalog[:2]) as pool:
+        yield from pool.map(plan, items,
+                            chunksize=max(1, len(items) // (4*jobs)))
+# }}}
+def run(args, app_data):                                    # {{{
+    """
+    Handle --batch with the catalog main_command() loaded.  Returns
+    the exit status: 1 if a profile failed.
+    """
+    global Catalog
+    import json
+    items   = read_manifest(args.batch)
+    Catalog = (args.infile, args.use_cache, app_data)
+    if args.batch_dir:
+        os.makedirs(args.batch_dir, exist_ok=True)
+    n_bad = 0
+    for result in results(items):
+        if result['status'] != 'ok':
+            n_bad += 1
+        if not args.batch_dir:
+            sys.stdout.write(json.dumps(result) + '\n')
+            continue
+        if result['status'] != 'ok':
+            print(f"{result['profile']}: {result['output'].strip()}")
+            continue
+        suffix = 'csh' if result['shell'] == 'csh' else 'sh'
+        with open(os.path.join(args.batch_dir,
+                               f"{result['profile']}.{suffix}"), 'w') as fh:
+            fh.write(SA.dotfile_text(result['delta'], result['shell']))
+    if args.batch_dir:
+        print(f'{len(items) - n_bad} dotfiles written to {args.batch_dir}, '
+              f'{n_bad} profiles failed')
+    return 1 if n_bad else 0
+# }}}
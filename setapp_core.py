@@ -0,0 +1,2807 @@
+#!/usr/bin/env python
+# Only modules that are already loaded by the interpreter at startup
+# are imported here.  argparse, yaml, rich, pprint, pickle, etc. are
+# imported by the functions that need them so that the common commands
+# (-g, --explain, --dump-env, setting apps from a warm cache) start fast.
+import sys
+import os
+import builtins
+
+SETAPP_CONFIG_FILE = '/home/al/git.repos/setapp/Setapp_inputs.yaml'
+SETAPP_DOTFILE     = os.environ.get('SETAPP_DOTFILE',
+                         os.path.join(os.environ.get('HOME', '/tmp'), '.my_env'))
+SETAPP_CACHE_DIR   = os.path.join(os.environ.get('XDG_CACHE_HOME',
+                         os.path.join(os.environ.get('HOME', '/tmp'), '.cache')),
+                         'setapp')
+SETAPP_RENDER_DIR  = os.environ.get('SETAPP_RENDER_DIR',
+                         os.path.join(SETAPP_CACHE_DIR, 'render'))
+SETAPP_USAGE_LOG   = os.environ.get('SETAPP_USAGE_LOG')  # opt-in, see log_usage()
+CACHE_FORMAT = 7   # bump when the layout of the compiled catalog changes
+LEDGER_FORMAT = 1  # bump when the layout of SETAPP_LEDGER changes
+STATE_FORMAT  = 1  # bump when the layout of SETAPP_STATE changes
+STATE_REQUESTS = 8 # requests SETAPP_STATE remembers as already satisfied
+USAGE_LOG_MAX  = 1 << 22  # bytes in the usage log before it is rotated
+USAGE_LOG_KEEP = 3        # rotated usage logs kept (usage.jsonl.1, ...)
+OS_alias = { '3.13.0-37-generic' : 'Ubuntu_16.04' } # updated in load_app_file()
+List_vars = {}     # VAR -> separator, None if not a list; updated likewise
+This_OS  = None
+Cache_Status = None # 'hit', 'rebuilt', or 'disabled' after load_app_data()
+Loaded_Infile = None # the infile given to load_app_data()
+Rich_Print   = None # rich.print once something is written to a terminal
+Timings      = None # [[name, depth, ms], ...] while --timings or
+                    # SETAPP_PROFILE is on, see Span
+Usage        = None # this command's usage record while SETAPP_USAGE_LOG
+                    # is set, see log_usage()
+
+# top level catalog keys that aren't applications, see take_settings()
+Setting_Keys = ( 'OS_aliases', 'List_vars' )
+
+# keys relating an entry to others, see setapp_requires
+Requirement_Keys = ( 'requires', 'conflicts', 'bundle' )
+
+# Arguments recognized by quick_args() and their values when absent.
+# These must agree with the defaults given to argparse in parse_args().
+Quick_Defaults = {
+    'applications'  : [],    'apps_by_cat'   : None,  'debug'    : False,
+    'dump_env'      : False, 'getapp'        : False, 'explain'  : None,
+    'infile'        : None,  'use_cache'     : True,  'rebuild_cache' : False,
+    'remove'        : None,  'shell'         : 'bash','show'     : None,
+    'show_bin'      : None,  'show_man'      : None,  'validate' : None,
+    'verbose'       : 0,     'serve'         : False, 'use_daemon' : True,
+    'render'        : None,  'json'          : False,
+    'provides'      : None,  'refresh_index' : False,
+    'timings'       : False, 'cprofile'      : None,
+    'check_paths'   : None,  'search'        : None,
+    'probe'         : None,  'batch'         : None,  'batch_dir' : None,
+    'import_modules': None,  'import_dir'    : 'setapp.d',
+    'import_os'     : None,  'save'          : None,  'restore'   : None,
+    'stats'         : False,
+}
+
+def print(*args, **kwargs):                                 # {{{
+    """
+    Print with rich when writing to a terminal, plain print
+    otherwise, so that redirected output and login scripts
+    don't pay for importing rich.
+    """
+    global Rich_Print
+    if not color_output(kwargs.get('file')):
+        builtins.print(*args, **kwargs)
+        return
+    if Rich_Print is None:
+        try:
+            with Span('import rich'):
+                from rich import print as Rich_Print
+        except ImportError:
+            Rich_Print = builtins.print
+    Rich_Print(*args, **kwargs)
+# }}}
+def color_output(fh=None):                                  # {{{
+    """
+    True if rich markup should be used on fh (default sys.stdout).
+    """
+    fh = fh or sys.stdout
+    try:
+        return fh.isatty()
+    except (AttributeError, ValueError):
+        return False
+# }}}
+class Span:                                                  # {{{
+    """
+    Time the enclosed block as one named phase of the command,
+        with Span('load catalog'): ...
+    when timing is on (start_timings()).  When it's off a Span
+    costs an object and two method calls.
+    """
+    __slots__ = ('name', 'slot', 't0')
+    Depth = 0
+    Clock = None
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        if Timings is not None:
+            self.slot = [self.name, Span.Depth, None]
+            Timings.append(self.slot)
+            Span.Depth += 1
+            self.t0 = Span.Clock()
+        return self
+
+    def __exit__(self, *exc):
+        if Timings is not None:
+            self.slot[2] = 1000*(Span.Clock() - self.t0)
+            Span.Depth -= 1
+# }}}
+def start_timings():                                        # {{{
+    """
+    Turn on Span timing.  The CPU time used before this point,
+    interpreter start up and importing setapp_core, is recorded as
+    the first phase.
+    """
+    global Timings
+    import time
+    Span.Clock = time.perf_counter
+    Timings = [ ['start up (cpu)', 0, 1000*time.process_time()] ]
+    Span.T0 = Span.Clock()
+# }}}
+def report_timings(args):                                   # {{{
+    """
+    Print the phase table to stderr for --timings and append a JSON
+    line to $SETAPP_PROFILE if it is set.
+    """
+    total = 1000*(Span.Clock() - Span.T0)
+    if args is not None and args.timings:
+        builtins.print(f'{"phase":34s} {"ms":>9s}', file=sys.stderr)
+        for name, depth, ms in Timings:
+            label = '  '*depth + name
+            ms    = f'{ms:9.2f}' if ms is not None else f'{"-":>9s}'
+            builtins.print(f'{label:34s} {ms}', file=sys.stderr)
+        builtins.print(f'{"total after start up":34s} {total:9.2f}',
+                       file=sys.stderr)
+        builtins.print(f'catalog cache : {Cache_Status}', file=sys.stderr)
+    Log = os.environ.get('SETAPP_PROFILE')
+    if not Log:
+        return
+    import json
+    import time
+    phases = {}
+    for name, depth, ms in Timings:
+        if ms is not None:
+            phases[name] = round(phases.get(name, 0) + ms, 3)
+    apps = []
+    if args is not None:
+        apps = list(args.applications) + \
+               [ A for A in (args.explain, args.show) if A ]
+    record = { 'time'     : time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+               'pid'      : os.getpid(),
+               'command'  : sys.argv[1:],
+               'apps'     : apps,
+               'cache'    : Cache_Status,
+               'total_ms' : round(total, 3),
+               'phases'   : phases, }
+    try:
+        with open(Log, 'a') as fh:
+            fh.write(json.dumps(record) + '\n')
+    except OSError as e:
+        builtins.print(f'SETAPP_PROFILE={Log}: {e}', file=sys.stderr)
+# }}}
+def usage_log():                                            # {{{
+    """
+    The usage log: $SETAPP_USAGE_LOG if it is a path, else (eg
+    SETAPP_USAGE_LOG=1) usage.jsonl in SETAPP_CACHE_DIR.
+    """
+    if SETAPP_USAGE_LOG and os.sep in SETAPP_USAGE_LOG:
+        return SETAPP_USAGE_LOG
+    return os.path.join(SETAPP_CACHE_DIR, 'usage.jsonl')
+# }}}
+def usage_command(args):                                    # {{{
+    """
+    The kind of command args asks for, as the usage log names it.
+    """
+    for kind in ('getapp', 'remove', 'explain', 'show', 'dump_env',
+                 'restore', 'save', 'batch', 'probe', 'search',
+                 'apps_by_cat', 'validate', 'render', 'provides',
+                 'import_modules', 'serve', 'stats'):
+        if getattr(args, kind, None):
+            return kind
+    return 'add' if args.applications else 'other'
+# }}}
+def log_usage(args, status):                                # {{{
+    """
+    Append this command's record to the usage log as one JSON line,
+        {"t": epoch, "cmd": "add", "apps": ["matlab/2022a"],
+         "os": "Ubuntu_20.04", "shell": "bash", "cache": "hit",
+         "ms": 12.5, "status": 0}
+    with a single O_APPEND write, so concurrent commands don't
+    interleave, rotating the log past USAGE_LOG_MAX bytes.  apps
+    are resolved to versions where the command looked them up.
+    Problems are ignored; the log never holds up the shell.
+    """
+    import time
+    import json
+    Log = usage_log()
+    if args is not None:
+        Usage.setdefault('apps', list(args.applications))
+        Usage['cmd']   = usage_command(args)
+        Usage['shell'] = args.shell
+    Usage['os']     = This_OS
+    Usage['cache']  = Cache_Status
+    Usage['ms']     = round(1000*(time.perf_counter() - Usage.pop('t0')), 2)
+    Usage['status'] = status if isinstance(status, int) else 1
+    line = (json.dumps(Usage, separators=(',', ':')) + '\n').encode()
+    flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_NONBLOCK
+    try:
+        try:
+            fd = os.open(Log, flags, 0o600)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(Log), exist_ok=True)
+            fd = os.open(Log, flags, 0o600)
+        try:
+            os.write(fd, line)
+            full = os.fstat(fd).st_size > USAGE_LOG_MAX
+        finally:
+            os.close(fd)
+        if full:
+            for i in range(USAGE_LOG_KEEP - 1, 0, -1):
+                if os.path.exists(f'{Log}.{i}'):
+                    os.replace(f'{Log}.{i}', f'{Log}.{i + 1}')
+            os.replace(Log, f'{Log}.1')
+    except OSError:
+        pass
+# }}}
+def die(msg):                                               # {{{
+    import pprint
+    pp = pprint.PrettyPrinter(indent=4)
+    pp.pprint(msg)
+    print("died")
+    sys.exit(1)
+# }}}
+def quick_args(argv):                                       # {{{
+    """
+    Recognize the handful of command lines that login scripts and
+    interactive shells run most often,
+        -g | --getapp | --dump-env | -e APP | --explain APP |
+        --restore NAME | [-s SHELL] APP [APP ...]
+    optionally with -d, -v, --timings, or -i FILE.
+    without importing argparse.  Returns None for anything else
+    so that parse_args() falls back to the full parser.
+    """
+    class Args: pass
+    args = Args()
+    args.__dict__.update(Quick_Defaults)
+    args.applications = []
+    if not argv:
+        return None
+    i = 0
+    while i < len(argv):
+        a = argv[i]
+        if a in ('-g', '--getapp'):
+            args.getapp = True
+        elif a == '--dump-env':
+            args.dump_env = True
+        elif a in ('-d', '--debug'):
+            args.debug = True
+        elif a in ('-v', '--verbose'):
+            args.verbose += 1
+        elif a == '--timings':
+            args.timings = True
+        elif a in ('-e', '--explain', '-s', '--shell', '-i', '--infile',
+                   '--restore') and i + 1 < len(argv):
+            i += 1
+            if a in ('-s', '--shell'):
+                if argv[i] not in ('bash', 'csh'):
+                    return None
+                args.shell = argv[i]
+            elif a in ('-i', '--infile'):
+                args.infile = argv[i]
+            elif a == '--restore':
+                args.restore = argv[i]
+            else:
+                args.explain = argv[i]
+        elif a.startswith('-') or a == '--':
+            return None
+        else:
+            args.applications.append(a)
+        i += 1
+    return args
+# }}}
+def parse_args():                                           # {{{
+    args = quick_args(sys.argv[1:])
+    if args is not None:
+        return args
+    parser = arg_parser()
+    args   = parser.parse_args()
+    if args.validate is not None and args.applications:
+        # eg "--validate --json FILE": --validate only takes the
+        # paths right after it
+        parser.error(f'--validate checks catalog paths, not '
+                     f'applications; put {" ".join(args.applications)} '
+                     f'right after --validate')
+    return args
+# }}}
+def arg_parser():                                           # {{{
+    import argparse
+    parser = argparse.ArgumentParser(description=
+    """Add, modify, show, remove environment variables,
+    aliases, and shell functions associated with applications.
+    """)
+
+    parser.add_argument('applications', metavar='APP', type=str, nargs='*',
+        help='Application to configure: APP, APP/VERSION, or '
+             'APP/SPEC for the newest version SPEC matches, where SPEC '
+             'is "latest", ">=2021a" (also >, <=, <, ==), "~=3.0" or '
+             'a glob like "2021.*".  Quote specifiers in the shell.')
+
+    parser.add_argument('--by-cat', metavar='CAT',
+        dest='apps_by_cat', action='store', type=str, default=None,
+        help='List the applications in category CAT with their '
+             'versions for this OS.  "CAT1,CAT2" lists those in both, '
+             '"all" every category and its applications.  With '
+             '--search, limits the search to CAT.')
+
+    parser.add_argument('--batch', dest='batch', metavar='MANIFEST',
+        action='store', type=str, default=None,
+        help='Plan the environment of every profile in MANIFEST ("-" '
+             'for stdin; JSON lines, or YAML if named .yaml/.yml) '
+             'of {profile, apps, shell, os, environ, remove} from '
+             'one loaded catalog, and write one JSON result per line '
+             'to stdout.  os may be any OS in OS_aliases.')
+
+    parser.add_argument('--batch-dir', dest='batch_dir', metavar='DIR',
+        action='store', type=str, default=None,
+        help='With --batch, write each profile\'s dotfile to '
+             'DIR/PROFILE.sh or DIR/PROFILE.csh instead.')
+
+    parser.add_argument('--import-modules', dest='import_modules',
+        metavar='TREE', action='store', type=str, default=None,
+        help='Convert the Environment Modules / Lmod modulefiles '
+             'under TREE (TREE/APP/VERSION[.lua]) into one APP.yaml '
+             'per application in --import-dir, reporting what can\'t '
+             'be converted.  Re-runs parse only changed modulefiles.')
+
+    parser.add_argument('--import-dir', dest='import_dir', metavar='DIR',
+        action='store', type=str, default='setapp.d',
+        help='Catalog directory --import-modules writes [setapp.d].')
+
+    parser.add_argument('--import-os', dest='import_os', metavar='OS',
+        action='store', type=str, default=None,
+        help='OS the imported modulefiles are for [this host\'s].')
+
+    parser.add_argument('--save', dest='save', metavar='NAME',
+        action='store', type=str, default=None,
+        help='Save the loaded applications and the values they give '
+             'the environment as snapshot NAME.')
+
+    parser.add_argument('--restore', dest='restore', metavar='NAME',
+        action='store', type=str, default=None,
+        help='Replace the loaded applications with snapshot NAME '
+             '(see --save); NAME is resolved again only if the '
+             'catalog changed since it was saved.')
+
+    parser.add_argument('--stats', dest='stats',
+        action='store_true', default=False,
+        help='Summarize the usage log that setapp appends to when '
+             'SETAPP_USAGE_LOG is set (a file, or 1 for '
+             '~/.cache/setapp/usage.jsonl): runs and latency '
+             'percentiles per command and day, and loads per '
+             'application and version.  See also --json.')
+
+    parser.add_argument('-d', '--debug', dest='debug',
+        action='store_true', default=False,
+        help='Print some internal variables.')
+
+    parser.add_argument('--check-paths', dest='check_paths', metavar='MODE',
+        action='store', default=None, choices=['warn', 'drop', 'fail'],
+        help='Check that the directories and files the given '
+             'applications add to the environment exist, then report '
+             'the missing or slow ones ("warn"), leave them out '
+             '("drop"), or change nothing ("fail").  With --validate, '
+             'check every path of this OS in the catalog.  Defaults '
+             'to $SETAPP_CHECK_PATHS.')
+
+    parser.add_argument('--dump-env', dest='dump_env',
+        action='store_true', default=False,
+        help='Print a sorted list of environment variables with separate '
+             'with colon separated values on separate lines.')
+
+    parser.add_argument('-g', '--getapp', dest='getapp',
+        action='store_true', default=False,
+        help='Print currently configured applications.')
+
+    parser.add_argument('-e', '--explain', metavar='APP',
+        dest='explain', action='store', type=str, default=None,
+        help='Print changes that would be made to the environment '
+             'when adding or removing the given application.')
+
+    parser.add_argument('-i', '--infile', dest='infile',
+        action='store', type=str, default=None,
+        help='Read application definitions from the given file, or '
+             'from the APP.yaml files in the given directory, '
+             'instead of searching paths.')
+
+    parser.add_argument('--no-cache', dest='use_cache',
+        action='store_false', default=True,
+        help='Parse and validate the YAML catalog files directly '
+             'instead of reading the compiled catalog cache.')
+
+    parser.add_argument('--rebuild-cache', dest='rebuild_cache',
+        action='store_true', default=False,
+        help='Recompile the catalog cache even if it is current.')
+
+    parser.add_argument('--no-daemon', dest='use_daemon',
+        action='store_false', default=True,
+        help='Do the work in this process even if a setapp daemon '
+             '(see --serve) is running.')
+
+    parser.add_argument('--render', dest='render', metavar='DIR',
+        nargs='?', const=SETAPP_RENDER_DIR, default=None,
+        help='Write ready-to-source bash and csh snippets for every '
+             'application, version, and OS to DIR [default '
+             '$SETAPP_RENDER_DIR or ~/.cache/setapp/render] then exit.  '
+             'Source DIR/setapp.sh (or setapp.csh) and use '
+             '"setapp_load APP" to load applications without Python.')
+
+    parser.add_argument('-r', '--remove',
+        dest='remove', action='store_true', default=None,
+        help='Remove entries for the given application from '
+             'the environment.  Version specifiers are ignored. '
+             'A value of "all" removes every '
+             'configured application.  See also --explain.')
+
+    parser.add_argument('--serve', dest='serve',
+        action='store_true', default=False,
+        help='Run a per-user daemon that keeps the catalog in memory '
+             'and answers requests from other setapp invocations '
+             'over a Unix domain socket.')
+
+    parser.add_argument('-s', '--shell', dest='shell', action='store',
+        choices=['bash', 'csh'], type=str, default='bash',
+        help='Write changes for the given shell.  Use "bash" for '
+             'sh/ksh/bash/zsh and "csh" for csh/tcsh [default "bash"].')
+
+    parser.add_argument('--show', dest='show', metavar='APP',
+        action='store', type=str, default=None,
+        help='Show information about the given application.  "all" '
+             'prints information about every application; APP/SPEC '
+             'shows only the versions SPEC matches.')
+
+    parser.add_argument('--search', dest='search', metavar='TEXT',
+        action='store', type=str, default=None,
+        help='List the applications whose name, help, categories or '
+             'doc entries contain every word of TEXT, best matches '
+             'first.')
+
+    parser.add_argument('--show-bin', dest='show_bin', metavar='APP',
+        action='store', type=str, default=None,
+        help='Show executables provided by the given application '
+             '(every version unless one is given; "all" for every '
+             'application).  Answered from an index of the PATH '
+             'directories in the catalog, see --refresh-index.')
+
+    parser.add_argument('--show-man', dest='show_man', metavar='APP',
+        action='store', type=str, default=None,
+        help='Show man pages provided by the given application, '
+             'as for --show-bin.')
+
+    parser.add_argument('--probe', dest='probe', metavar='APP',
+        action='store', type=str, default=None,
+        help='Run the probe commands of the given application (every '
+             'version unless one is given; "all" for every '
+             'application) in the environment setapp would give it, '
+             'several at once, and report which pass.  Nothing is '
+             'written to the dotfile.')
+
+    parser.add_argument('--provides', dest='provides', metavar='NAME',
+        action='store', type=str, default=None,
+        help='List the applications and versions that provide the '
+             'executable or man page NAME.')
+
+    parser.add_argument('--refresh-index', dest='refresh_index',
+        action='store_true', default=False,
+        help='Re-list the PATH and MANPATH directories of every '
+             'application whose modification time changed since '
+             'they were indexed for --show-bin, --show-man and '
+             '--provides.')
+
+    parser.add_argument('--validate', dest='validate', metavar='PATH',
+        nargs='*', type=str, default=None,
+        help='Check the given catalog files and directories (default '
+             'the catalog files setapp would load), listing every '
+             'problem with its file and line, then exit; the exit '
+             'status is 1 if there were errors.  Each PATH is a '
+             'layer that may override applications of earlier ones.')
+
+    parser.add_argument('--json', dest='json',
+        action='store_true', default=False,
+        help='Write the --validate, --probe or --stats report as JSON.')
+
+    parser.add_argument('--timings', dest='timings',
+        action='store_true', default=False,
+        help='Print how long each phase of the command took to stderr.  '
+             'Set SETAPP_PROFILE=FILE to append the same numbers, as '
+             'one JSON line per command, to FILE instead.')
+
+    parser.add_argument('--cprofile', dest='cprofile', metavar='FILE',
+        action='store', type=str, default=None,
+        help='Run the command under cProfile and write the '
+             'statistics to FILE (see python -m pstats).')
+
+    parser.add_argument('-v', '--verbose', dest='verbose',
+        action='count', default=0,
+        help='Verbose mode (may be specified '
+             'multiple times for more output).')
+
+#   # an integer
+#   parser.add_argument('--num-cases', dest='n_cases',
+#                       action='store', type=int, default=10,
+#                       help='Number of data lines to create '
+#                       '[10].')
+
+    return parser
+# }}}
+def set_this_os():                                          # {{{
+    """
+    Set This_OS from uname -r; needs OS_alias, so call after
+    load_app_data().  Exits if the OS is not in OS_aliases.
+    """
+    global This_OS
+    release = os.uname().release
+    if release not in OS_alias:
+        print(f'This OS, uname -r = {release}, is unrecognized')
+        sys.exit(0)
+    This_OS = OS_alias[release]
+# }}}
+def dump_env():                                             # {{{
+    for var in sorted(os.environ):
+        if ':' in os.environ[var]:
+            print(f'{var}')
+            for i,item in enumerate(os.environ[var].split(':')):
+                print(f'  {i+1:3d}.  {item}')
+        else:
+            print(f'{var:30s} {os.environ[var]}')
+# }}}
+def load_app_file(File, verbose=0):                         # {{{
+    y_data = read_app_file(File, verbose=verbose)
+    take_settings(y_data)
+    return check_app_data(y_data, File)
+# }}}
+def yaml_loader():                                          # {{{
+    """
+    The LibYAML based safe loader if PyYAML was built with it, the
+    pure Python one otherwise.
+    """
+    with Span('import yaml'):
+        import yaml
+    return getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+# }}}
+def read_app_file(File, verbose=0):                         # {{{
+    """
+    Parse one YAML catalog file; nothing is validated yet.
+    """
+    Loader = yaml_loader()
+    import yaml
+    y_data = None
+    try:
+        with open(File) as fh, \
+             Span(f'yaml.load {os.path.basename(File)}'):
+            y_data = yaml.load(fh, Loader=Loader)
+    except FileNotFoundError as e:
+        print(f'setapp.load_app_file({File}) {e}')
+        sys.exit(1)
+    except yaml.scanner.ScannerError as e:
+        print(f'setapp.load_app_file({File}) {e}')
+        sys.exit(1)
+
+    if verbose:
+        print(f'loaded {File}')
+    return y_data or {}   # an empty file is an empty catalog
+# }}}
+def take_settings(y_data, File=None):                       # {{{
+    """
+    Move the OS_aliases and List_vars sections of a parsed catalog
+    file into OS_alias and List_vars and return them,
+        { 'OS_aliases' : {...}, 'List_vars' : {...} }
+    Exits if List_vars is malformed.
+    """
+    settings = {}
+    for key in Setting_Keys:
+        if key in y_data:
+            settings[key] = y_data.pop(key)
+    errors = list(list_vars_errors(settings.get('List_vars', {})))
+    for path, msg in errors:
+        print(f'{"/".join(map(str, path))} : {msg}')
+    if errors:
+        print(f'setapp.load_app_file({File}) failure')
+        sys.exit(1)
+    use_settings(settings)
+    return settings
+# }}}
+def merge_settings(into, settings):                         # {{{
+    """
+    Merge the settings from take_settings() into the dictionary
+    into, unless it is None.
+    """
+    if into is None:
+        return
+    for key, values in settings.items():
+        into[key] = {**into.get(key, {}), **values}
+# }}}
+def use_settings(settings):                                 # {{{
+    """
+    Merge settings from take_settings() over OS_alias and List_vars.
+    """
+    global OS_alias, List_vars
+    OS_alias  = {**OS_alias,  **settings.get('OS_aliases', {})}
+    List_vars = {**List_vars, **settings.get('List_vars', {})}
+# }}}
+def list_vars_errors(list_vars):                            # {{{
+    """
+    Yield (path, message) for every problem in a List_vars
+    section: a map of variable names to the string separating
+    their entries, or to null for a variable that holds one value.
+    """
+    if not isinstance(list_vars, dict):
+        yield ('List_vars',), 'List_vars must define a dictionary'
+        return
+    for var, sep in list_vars.items():
+        if not isinstance(var, str):
+            yield ('List_vars', var), 'variable names must be strings'
+        elif not (sep is None or (isinstance(sep, str) and sep)):
+            yield ('List_vars', var), \
+                  'the separator must be a non-empty string, or null'
+# }}}
+def check_app_data(y_data, File):                           # {{{
+    """
+    Validate the applications parsed from File, one catalog layer or
+    part of one, against OS_alias, normalize version keys to strings
+    and record File as each entry's 'from'.  Exits on errors.  What
+    only the merged application has to have is left to
+    check_merged_app().
+    """
+    for app in y_data:
+        app_data = y_data[app]
+        # YAML reads versions like 2021.05 as floats; keep them as the
+        # strings users type, eg "python/2021.05"
+        if isinstance(app_data, dict):
+            if 'default' in app_data:
+                app_data['default'] = str(app_data['default'])
+            if isinstance(app_data.get('ver'), dict):
+                app_data['ver'] = { str(v) : d for v, d in
+                                    app_data['ver'].items() }
+
+    is_bad = False
+    with Span(f'validate {os.path.basename(File)}'):
+        errors = list(app_data_errors(y_data, set(OS_alias.values())))
+    for path, msg in errors:
+        print(f'{"/".join(map(str, path))} : {msg}')
+        is_bad = True
+    if is_bad:
+        print(f'setapp.load_app_file({File}) failure')
+        sys.exit(1)
+
+    for app_data in y_data.values():
+        for entries in app_data.get('ver', {}).values():
+            for entry in entries.values():
+                entry['from'] = File
+    return y_data
+# }}}
+def app_data_errors(y_data, OS_names=None):                 # {{{
+    """
+    Yield (path, message) for every problem in the shape and types
+    of the applications parsed from one catalog file; path is the
+    tuple of keys leading to the offending item, eg (app, 'ver',
+    version, OS, 'env', 0).  OS keys are checked against OS_names
+    unless it is None.  A layer may define only part of an
+    application, see merged_app_errors().
+    """
+    recognized_k2_keys = {'env', 'alias_sh', 'alias_csh', 'function_def',
+                          'doc', 'from', 'probe', *Requirement_Keys}
+
+    def probe_errors(path, probe):
+        if not isinstance(probe, (str, list)) or \
+           not all(isinstance(C, str) for C in
+                   ([probe] if isinstance(probe, str) else probe)):
+            yield path, 'must be a command or a list of commands'
+
+    def requirement_errors(path, where):
+        for K in Requirement_Keys:
+            if K not in where:
+                continue
+            names = where[K]
+            if isinstance(names, str):
+                names = [ names ]
+            if not isinstance(names, list) or \
+               not all(isinstance(N, str) and N and N[0] not in '+/' and
+                       ' ' not in N.partition('/')[0] for N in names):
+                yield path + (K,), 'must be an app, app/VERSION or a list ' \
+                                   'of them'
+            elif path[0] in [ N.partition('/')[0] for N in names ]:
+                yield path + (K,), f'{path[0]} can\'t name itself'
+        if 'bundle' in where and 'env' in where:
+            yield path + ('bundle',), 'a bundle has no env of its own'
+
+    for app, app_data in y_data.items():
+        if not isinstance(app_data, dict):
+            yield (app,), 'must define a dictionary'
+            continue
+        if 'probe' in app_data:
+            yield from probe_errors((app, 'probe'), app_data['probe'])
+        yield from requirement_errors((app,), app_data)
+        versions = app_data.get('ver')
+        if versions is None:
+            continue
+        if not isinstance(versions, dict):
+            yield (app, 'ver'), 'must define a dictionary'
+            continue
+        for version, entries in versions.items():
+            if not isinstance(entries, dict):
+                yield (app, 'ver', version), 'must define a dictionary'
+                continue
+            for OS, entry in entries.items():
+                if OS_names is not None and OS not in OS_names:
+                    yield (app, 'ver', version, OS), (f'OS "{OS}" is not '
+                          f'defined in the OS_aliases map')
+                    continue
+                if not isinstance(entry, dict):
+                    yield (app, 'ver', version, OS), 'must define a dictionary'
+                    continue
+                for k in entry:
+                    if k not in recognized_k2_keys:
+                        yield (app, 'ver', version, OS, k), (f'unrecognized '
+                              f'key "{k}"; allowed are '
+                              f'{", ".join(sorted(recognized_k2_keys))}')
+                if 'probe' in entry:
+                    yield from probe_errors((app, 'ver', version, OS, 'probe'),
+                                            entry['probe'])
+                yield from requirement_errors((app, 'ver', version, OS), entry)
+                for k in ['env', 'alias_sh', 'alias_csh', 'function_def']:
+                    if k not in entry: continue
+                    if not isinstance(entry[k], list):
+                        yield (app, 'ver', version, OS, k), 'must define a list'
+                        continue
+                    for i, name_val in enumerate(entry[k]):
+                        if not isinstance(name_val, dict) or \
+                           len(name_val) != 1:
+                            yield (app, 'ver', version, OS, k, i), (f'entries '
+                                  f'must be key : value pairs, not {name_val!r}')
+# }}}
+def merged_app_errors(app, app_data):                       # {{{
+    """
+    Yield (path, message) for what an application merged from every
+    layer (see merge_layers()) lacks: its name, default or ver, or a
+    version for the default to name.
+    """
+    for required_k1 in ['name', 'default', 'ver']:
+        if required_k1 not in app_data:
+            yield (app,), f'key "{required_k1}" missing'
+    if 'default' in app_data and \
+        str(app_data['default']) not in map(str, app_data.get('ver', {})):
+        yield (app, 'default'), (f'default version '
+              f'"{app_data["default"]}" is not defined under ver')
+# }}}
+def check_merged_app(app, app_data):                        # {{{
+    """
+    Exit if merged_app_errors() finds problems in app_data.
+    """
+    errors = list(merged_app_errors(app, app_data))
+    for path, msg in errors:
+        print(f'{"/".join(map(str, path))} : {msg}')
+    if errors:
+        print(f'setapp: the catalog defines {app} incompletely')
+        sys.exit(1)
+    return app_data
+# }}}
+def catalog_files(infile=None):                             # {{{
+    """
+    Return the catalog layers, YAML files or directories of them,
+    in load order: the site catalog, each entry of the ':' separated
+    $SETAPP_PATH that exists (group or project catalogs), and the
+    user's ~/.config/setapp/inputs.yaml if it exists.
+    """
+    files = [ infile or SETAPP_CONFIG_FILE ]
+    for F in os.environ.get('SETAPP_PATH', '').split(':'):
+        if F and F not in files and os.path.exists(F):
+            files.append(F)
+    if 'HOME' in os.environ:
+        user_yaml = f"{os.environ['HOME']}/.config/setapp/inputs.yaml"
+        if os.path.exists(user_yaml):
+            files.append(user_yaml)
+    return files
+# }}}
+def cache_file(infile=None):                                # {{{
+    """
+    Path to the compiled catalog for the given primary catalog file.
+    The name hashes the absolute path so that different catalogs
+    (eg via --infile) don't share a cache.
+    """
+    import zlib
+    primary = os.path.abspath(infile or SETAPP_CONFIG_FILE)
+    tag = zlib.crc32(primary.encode()) & 0xffffffff
+    return os.path.join(SETAPP_CACHE_DIR, f'catalog-{tag:08x}.marshal')
+# }}}
+def file_digest(File):                                      # {{{
+    import hashlib
+    with open(File, 'rb') as fh:
+        return hashlib.sha256(fh.read()).hexdigest()
+# }}}
+def source_signature(files):                                # {{{
+    """
+    Return [(path, mtime_ns, size, sha256), ...] for the catalog files.
+    """
+    sig = []
+    for File in files:
+        st = os.stat(File)
+        sig.append( (os.path.abspath(File), st.st_mtime_ns, st.st_size,
+                     file_digest(File)) )
+    return sig
+# }}}
+def sources_current(sig, files):                            # {{{
+    """
+    Compare the (path, mtime, size, hash) signature recorded in a
+    compiled catalog to the given files.  Returns
+        False      -> a file was added, removed, or changed
+        "touched"  -> mtime differs but the contents are the same
+        True       -> unchanged
+    The content hash is only computed when the mtime differs.
+    """
+    if [ s[0] for s in sig ] != [ os.path.abspath(F) for F in files ]:
+        return False
+    status = True
+    for path, mtime_ns, size, digest in sig:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        if st.st_size != size:
+            return False
+        if st.st_mtime_ns != mtime_ns:
+            if file_digest(path) != digest:
+                return False
+            status = "touched"
+    return status
+# }}}
+def read_cache(Cache, files):                               # {{{
+    """
+    Return the compiled catalog stored in Cache if it is usable
+    for the given source files, otherwise None.
+    """
+    import marshal
+    try:
+        with open(Cache, 'rb') as fh:
+            payload = marshal.loads(fh.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if not isinstance(payload, dict) or \
+       payload.get('format') != CACHE_FORMAT or \
+       payload.get('python') != sys.version_info[:2]:
+        return None
+    status = sources_current(payload['sources'], files)
+    if not status:
+        return None
+    if status == "touched":
+        # same contents, new mtime; record the new mtime so the
+        # next call doesn't have to hash the file again
+        payload['sources'] = source_signature(files)
+        try:
+            write_cache(Cache, payload)
+        except (OSError, ValueError):
+            pass
+    return payload
+# }}}
+def write_cache(Cache, payload):                            # {{{
+    """
+    Atomically replace Cache with the marshalled payload.  Readers
+    either see the old file or the complete new one, never a
+    partially written file.  marshal rather than pickle because
+    it is built into the interpreter; it handles everything
+    yaml.safe_load produces except timestamps (ValueError).
+    """
+    import marshal
+    import tempfile
+    payload = { **payload, 'python' : sys.version_info[:2] }
+    data = marshal.dumps(payload)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(Cache),
+                               prefix='.catalog-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(data)
+        os.replace(tmp, Cache)
+    except OSError:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+# }}}
+def shard_files(Dir):                                       # {{{
+    """
+    The per-application files (setapp.d/matlab.yaml, ...) in a
+    catalog directory, in load order.
+    """
+    return sorted( E.path for E in os.scandir(Dir)
+                   if E.name.endswith('.yaml') and
+                      not E.name.startswith('.') and E.is_file() )
+# }}}
+def expand_catalog(files):                                  # {{{
+    expanded = []
+    for File in files:
+        if os.path.isdir(File):
+            expanded += shard_files(File)
+        else:
+            expanded.append(File)
+    return expanded
+# }}}
+def compile_app_data(files, verbose=0,                      # {{{
+                     settings=None):
+    """
+    Parse and validate the catalog files (or directories of them),
+    merging later files over earlier ones.  Every file's OS_aliases
+    and List_vars are read before any file is validated, and also
+    merged into settings if it's given.  Returns the merged
+    application data.
+    """
+    parsed = []
+    for File in expand_catalog(files):
+        y_data = read_app_file(File, verbose=verbose)
+        merge_settings(settings, take_settings(y_data, File))
+        parsed.append( (File, y_data) )
+    app_data = {}
+    for File, y_data in parsed:
+        app_data.update(check_app_data(y_data, File))
+    return app_data
+# }}}
+def load_app_data(verbose=0, infile=None,                   # {{{
+                  use_cache=True, rebuild=False):
+    """
+    Return the validated application data of the catalog layers
+    from catalog_files(), a LayeredCatalog over them.  Each layer is loaded from its own compiled catalog
+    by load_layer(), so an edit to one layer leaves the others'
+    caches alone.  Cache_Status is the least favourable of the
+    layers'.
+    """
+    global Cache_Status, Loaded_Infile
+    Loaded_Infile = infile
+    layers, status = [], set()
+    for File in catalog_files(infile):
+        layers.append(load_layer(File, verbose=verbose,
+                                 use_cache=use_cache, rebuild=rebuild))
+        status.add(Cache_Status)
+    Cache_Status = next(S for S in ('disabled', 'rebuilt', 'hit')
+                        if S in status)
+    return LayeredCatalog(layers)
+# }}}
+def load_layer(File, verbose=0,                             # {{{
+               use_cache=True, rebuild=False):
+    """
+    Return the validated application data of one catalog layer, a
+    file or directory.  Unless use_cache is False, the result comes
+    from a compiled catalog in SETAPP_CACHE_DIR which is rebuilt
+    whenever the source changes (or when rebuild is True).
+    Concurrent rebuilds are serialized with a lock file; the loser
+    of the race reuses the winner's result.  The layer's OS_aliases
+    and List_vars are merged over those of the layers below.
+    """
+    global Cache_Status
+    files = [ File ]
+    if not use_cache:
+        Cache_Status = 'disabled'
+        return compile_app_data(files, verbose=verbose)
+    if os.path.isdir(File):
+        return load_sharded(File, verbose=verbose, rebuild=rebuild)
+
+    Cache = cache_file(File)
+    if not rebuild:
+        with Span('read cache'):
+            payload = read_cache(Cache, files)
+        if payload is not None:
+            if verbose:
+                print(f'catalog cache hit {Cache}')
+            use_settings(payload['settings'])
+            Cache_Status = 'hit'
+            return cached_catalog(Cache, payload, verbose=verbose)
+
+    try:
+        os.makedirs(SETAPP_CACHE_DIR, exist_ok=True)
+        lock = open(Cache + '.lock', 'a')
+    except OSError as e:
+        if verbose:
+            print(f'catalog cache unavailable: {e}')
+        Cache_Status = 'disabled'
+        return compile_app_data(files, verbose=verbose)
+
+    import fcntl
+    with lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if not rebuild:
+            # another process may have rebuilt it while we waited
+            payload = read_cache(Cache, files)
+            if payload is not None:
+                use_settings(payload['settings'])
+                Cache_Status = 'hit'
+                return cached_catalog(Cache, payload, verbose=verbose)
+        sources = source_signature(files)
+        payload = { 'format' : CACHE_FORMAT, 'sources' : sources,
+                    'settings' : {} }
+        mapped  = map_catalog(File, verbose=verbose,
+                              settings=payload['settings'])
+        if mapped is not None:
+            payload.update(mapped)
+        else:
+            payload['app_data'] = compile_app_data(files, verbose=verbose,
+                                                   settings=payload['settings'])
+        try:
+            write_cache(Cache, payload)
+            if verbose:
+                print(f'catalog cache rebuilt {Cache}')
+        except (OSError, ValueError) as e:
+            print(f'setapp: unable to write catalog cache {Cache}: {e}')
+    Cache_Status = 'rebuilt'
+    return cached_catalog(Cache, payload, verbose=verbose)
+# }}}
+def cached_catalog(Cache, payload, verbose=0):              # {{{
+    """
+    The application data of a compiled catalog: a MappedCatalog if
+    map_catalog() indexed it, otherwise the whole catalog.
+    """
+    if 'sections' in payload:
+        return MappedCatalog(Cache, payload, verbose=verbose)
+    return payload['app_data']
+# }}}
+def scan_catalog(File):                                     # {{{
+    """
+    One pass over the memory mapped File recording where each top
+    level key's section starts and ends:
+        { key : (start, end, crc32 of the section's bytes) }
+    Returns None unless File is a plain block mapping that can be
+    parsed a section at a time: no documents markers, flow style
+    or odd syntax at the top level, and no anchors or aliases,
+    which could refer across sections, outside comments.
+    """
+    import mmap
+    import re
+    import zlib
+    with open(File, 'rb') as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            return {}
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if mm.find(b'&') >= 0 or mm.find(b'*') >= 0:
+                # leave out comments, which may well say *PATH, but not
+                # a '#' in a quoted string
+                text = re.sub(rb'"(?:[^"\\\n]|\\.)*"|\'[^\'\n]*\'|'
+                              rb'(?:^|(?<=[ \t]))#[^\n]*',
+                              lambda m: b'' if m[0][:1] == b'#' else m[0],
+                              mm, flags=re.M)
+                if re.search(rb'(?:^|[\s\[{,])[&*][^\s\]},]', text, re.M):
+                    return None
+            lines = [ m.end() for m in re.finditer(rb'\n(?=[^ \t\r\n#])', mm) ]
+            if mm[:1] not in b' \t\r\n#':
+                lines.insert(0, 0)
+            key_re = re.compile(rb'([^\'"\[{\-?:%!&*|>@`][^\n]*?|'
+                                rb'"[^"\n]*"|\'[^\'\n]*\')[ \t]*:(?:[ \t]|$)')
+            starts = []
+            for start in lines:
+                eol = mm.find(b'\n', start)
+                k = key_re.match(mm[start:eol if eol >= 0 else len(mm)])
+                if k is None:
+                    return None
+                key = k.group(1).decode()
+                if key[:1] in ('"', "'"):
+                    key = key[1:-1]
+                starts.append( (key, start) )
+            sections = {}
+            for i, (key, start) in enumerate(starts):
+                end = starts[i + 1][1] if i + 1 < len(starts) else len(mm)
+                sections[key] = (start, end,
+                                 zlib.crc32(mm[start:end]) & 0xffffffff)
+    return sections
+# }}}
+def parse_section(File, mm, start, end):                    # {{{
+    """
+    Parse bytes start:end of File (mapped at mm), one top level key
+    and its value, with the line numbers of any error relative to
+    the whole file.
+    """
+    Loader = yaml_loader()
+    import yaml
+    try:
+        with Span(f'yaml.load {os.path.basename(File)} section'):
+            return yaml.load(mm[start:end].decode(), Loader=Loader) or {}
+    except yaml.YAMLError as e:
+        error = e
+    # parse it again behind blank lines standing in for the rest of
+    # the file so the error points at the right line
+    try:
+        yaml.load('\n'*mm[:start].count(b'\n') + mm[start:end].decode(),
+                  Loader=Loader)
+    except yaml.YAMLError as e:
+        error = e
+    print(f'setapp.load_app_file({File}) {error}')
+    sys.exit(1)
+# }}}
+def map_catalog(File, verbose=0, settings=None):            # {{{
+    """
+    Index the catalog file File with scan_catalog() rather than
+    parsing it; only its OS_aliases and List_vars sections (merged
+    into settings if it's given) are parsed here.  Returns the
+    payload entries MappedCatalog needs, or None if File can't be
+    split into sections.
+    """
+    import mmap
+    File     = os.path.abspath(File)
+    sections = scan_catalog(File)
+    if sections is None:
+        if verbose:
+            print(f'{File} is not a plain mapping, parsing all of it')
+        return None
+    for key in Setting_Keys:
+        if key in sections:
+            start, end, crc = sections.pop(key)
+            with open(File, 'rb') as fh, \
+                 mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                merge_settings(settings, take_settings(
+                    parse_section(File, mm, start, end), File))
+    if verbose:
+        print(f'indexed {len(sections)} applications in {File}')
+    return { 'file' : File, 'sections' : sections }
+# }}}
+class MappedCatalog:                                        # {{{
+    """
+    Application data from one big catalog file that only parses
+    the sections of the applications that are used.  Behaves like
+    the dictionary compile_app_data() returns, as ShardedCatalog
+    does for a catalog directory.
+
+    The compiled catalog, CACHE, holds where each application's
+    section is in the file and a checksum of it (scan_catalog()),
+    and the file's OS_aliases and List_vars.  An application is
+    parsed, with the LibYAML loader when available, and validated
+    the first time it is used; the result is kept in CACHE.d/ under
+    the checksum so later commands read just that instead of the
+    YAML.
+    """
+    def __init__(self, Cache, payload, verbose=0):
+        self.Cache    = Cache
+        self.File     = payload['file']
+        self.sections = payload['sections']
+        self.verbose  = verbose
+        self.loaded   = {}      # app -> its application data
+        self.mm       = None    # the mapped file, once a section is parsed
+
+    def __contains__(self, app):
+        return app in self.sections
+
+    def __iter__(self):
+        return iter(self.sections)
+
+    def __len__(self):
+        return len(self.sections)
+
+    def __getitem__(self, app):
+        try:
+            return self.loaded[app]
+        except KeyError:
+            pass
+        start, end, crc = self.sections[app]
+        Blob = shard_cache(self.Cache, f'{self.File}#{app}')
+        data = None
+        try:
+            import marshal
+            with open(Blob, 'rb') as fh:
+                blob = marshal.loads(fh.read())
+            if blob.get('crc') == crc and blob.get('app') == app and \
+               blob.get('python') == sys.version_info[:2]:
+                data = blob['app_data']
+        except (OSError, EOFError, ValueError, TypeError, AttributeError):
+            pass
+        if data is None:
+            data = self.compile(app, start, end, crc, Blob)
+        self.loaded[app] = data
+        return data
+
+    def get(self, app, default=None):
+        return self[app] if app in self else default
+
+    def keys(self):
+        return list(self)
+
+    def items(self):
+        return ( (app, self[app]) for app in self )
+
+    def values(self):
+        return ( self[app] for app in self )
+
+    def compile(self, app, start, end, crc, Blob):
+        if self.mm is None:
+            import mmap
+            try:
+                with open(self.File, 'rb') as fh:
+                    self.mm = mmap.mmap(fh.fileno(), 0,
+                                        access=mmap.ACCESS_READ)
+            except (OSError, ValueError) as e:
+                die(f'setapp: catalog file {self.File} is unreadable: {e}')
+        import zlib
+        if end > len(self.mm) or \
+           zlib.crc32(self.mm[start:end]) & 0xffffffff != crc:
+            # changed since the catalog was compiled; the next
+            # command rescans it
+            die(f'setapp: {self.File} changed while in use, run again')
+        y_data = parse_section(self.File, self.mm, start, end)
+        if len(y_data) != 1:
+            die(f'setapp: {self.File} section for {app} holds {list(y_data)}')
+        data = check_app_data({ app : next(iter(y_data.values())) },
+                              self.File)[app]
+        try:
+            os.makedirs(os.path.dirname(Blob), exist_ok=True)
+            write_cache(Blob, { 'app' : app, 'crc' : crc, 'app_data' : data })
+        except (OSError, ValueError) as e:
+            if self.verbose:
+                print(f'setapp: unable to write {Blob}: {e}')
+        if self.verbose:
+            print(f'compiled {app} from {self.File}')
+        return data
+# }}}
+def shard_signature(File):                                  # {{{
+    st = os.stat(File)
+    return (st.st_mtime_ns, st.st_size)
+# }}}
+def shard_summary(y_data):                                  # {{{
+    """
+    What the catalog index keeps about each application in a parsed,
+    validated file: the name, categories and the OSes some version
+    is defined for.
+    """
+    apps = {}
+    for app, A in y_data.items():
+        OSes = set()
+        for ver in A.get('ver', {}):
+            OSes.update(A['ver'][ver])
+        apps[app] = { 'name'     : A.get('name', app),
+                      'category' : list(A.get('category', [])),
+                      'OS'       : sorted(OSes), }
+    return apps
+# }}}
+class ShardedCatalog:                                       # {{{
+    """
+    Application data from a catalog directory, setapp.d/APP.yaml,
+    that only reads the files of the applications that are used.
+    Behaves like the dictionary compile_app_data() returns for a
+    single file:  "app in catalog", catalog[app], iteration over
+    every application name (which loads everything).
+
+    The index, CACHE, maps application names to files and holds
+    each file's OS_aliases and List_vars; CACHE.d/ has each file
+    compiled to marshal plus summary.marshal with every
+    application's name, categories and OSes (see shard_summary()),
+    read only when asked for.  A file that changed since it was
+    compiled is parsed, validated and recompiled when it is first
+    used.
+    """
+    def __init__(self, Cache, index, verbose=0):
+        self.Cache   = Cache
+        self.index   = index   # the payload written by load_sharded()
+        self.verbose = verbose
+        self.loaded  = {}      # file -> its application data
+        self.summaries = None
+
+    def __contains__(self, app):
+        return app in self.index['apps']
+
+    def __iter__(self):
+        return iter(self.index['apps'])
+
+    def __len__(self):
+        return len(self.index['apps'])
+
+    def __getitem__(self, app):
+        return self.shard(self.index['apps'][app])[app]
+
+    def get(self, app, default=None):
+        return self[app] if app in self else default
+
+    def keys(self):
+        return self.index['apps'].keys()
+
+    def items(self):
+        return ( (app, self[app]) for app in self )
+
+    def values(self):
+        return ( self[app] for app in self )
+
+    def summary(self, app):
+        """
+        Name, categories and OSes of app without loading its file.
+        """
+        if self.summaries is None:
+            self.summaries = read_summaries(self.Cache)
+        File = self.index['apps'][app]
+        try:
+            sig = shard_signature(File)
+        except OSError as e:
+            die(f'setapp: catalog file {File} is unreadable: {e}')
+        if sig != self.index['shards'][File][0] or \
+           File not in self.summaries:
+            self.loaded[File] = self.recompile(File, sig)
+        return self.summaries[File][app]
+
+    def shard(self, File):
+        """
+        The application data in File, from its compiled copy if
+        that is current.
+        """
+        if File in self.loaded:
+            return self.loaded[File]
+        try:
+            sig = shard_signature(File)
+        except OSError as e:
+            die(f'setapp: catalog file {File} is unreadable: {e}')
+        data = None
+        try:
+            import marshal
+            with open(shard_cache(self.Cache, File), 'rb') as fh:
+                payload = marshal.loads(fh.read())
+            if payload.get('sig') == sig and \
+               payload.get('python') == sys.version_info[:2]:
+                data = payload['app_data']
+        except (OSError, EOFError, ValueError, TypeError, AttributeError):
+            pass
+        if data is None:
+            data = self.recompile(File, sig)
+        self.loaded[File] = data
+        return data
+
+    def recompile(self, File, sig):
+        y_data  = read_app_file(File, verbose=self.verbose)
+        settings = take_settings(y_data, File)
+        data     = check_app_data(y_data, File)
+        self.index['shards'][File] = (sig, settings, list(data))
+        self.index['apps'] = index_apps(self.index['shards'])
+        if self.summaries is None:
+            self.summaries = read_summaries(self.Cache)
+        self.summaries[File] = shard_summary(data)
+        try:
+            write_cache(shard_cache(self.Cache, File),
+                        { 'sig' : sig, 'app_data' : data })
+            write_cache(shard_cache(self.Cache, 'summary'), self.summaries)
+            write_cache(self.Cache, self.index)
+        except (OSError, ValueError) as e:
+            print(f'setapp: unable to write catalog cache {self.Cache}: {e}')
+        if self.verbose:
+            print(f'recompiled {File}')
+        return data
+# }}}
+def shard_cache(Cache, File):                               # {{{
+    """
+    CACHE.d/XXXXXXXX.marshal, the compiled copy of File, or
+    CACHE.d/summary.marshal.
+    """
+    if File == 'summary':
+        name = 'summary'
+    else:
+        import zlib
+        name = '%08x' % (zlib.crc32(File.encode()) & 0xffffffff)
+    return os.path.join(Cache[:-len('.marshal')] + '.d', f'{name}.marshal')
+# }}}
+def read_summaries(Cache):                                  # {{{
+    import marshal
+    try:
+        with open(shard_cache(Cache, 'summary'), 'rb') as fh:
+            summaries = marshal.loads(fh.read())
+        if isinstance(summaries, dict):
+            summaries.pop('python', None)
+            return summaries
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+    return {}
+# }}}
+def index_apps(shards):                                     # {{{
+    """
+    application -> file that defines it; later files win.
+    """
+    apps = {}
+    for File, (sig, settings, names) in shards.items():
+        for app in names:
+            apps[app] = File
+    return apps
+# }}}
+def index_current(index, Dir):                              # {{{
+    """
+    True if the catalog index still describes Dir: it has the same
+    mtime, so no file was added, removed or renamed.  Files that
+    are edited in place are caught by ShardedCatalog.shard().
+    """
+    try:
+        return index.get('dir') == Dir and \
+               index.get('dir_mtime') == os.stat(Dir).st_mtime_ns
+    except OSError:
+        return False
+# }}}
+def load_sharded(Dir, verbose=0, rebuild=False):            # {{{
+    """
+    Open the catalog directory Dir.  Returns a ShardedCatalog; only
+    the index is read here.  The index is rebuilt, reusing the
+    compiled files that haven't changed, when the directory changed.
+    """
+    global Cache_Status
+    import marshal
+    Dir   = os.path.abspath(Dir)
+    Cache = cache_file(Dir)
+    index = None
+    try:
+        with open(Cache, 'rb') as fh, Span('read index'):
+            index = marshal.loads(fh.read())
+        if not isinstance(index, dict) or \
+           index.get('format') != CACHE_FORMAT or \
+           index.get('python') != sys.version_info[:2]:
+            index = None
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+    if index is not None and not rebuild and index_current(index, Dir):
+        if verbose:
+            print(f'catalog index hit {Cache}')
+        for sig, settings, names in index['shards'].values():
+            use_settings(settings)
+        Cache_Status = 'hit'
+        return ShardedCatalog(Cache, index, verbose=verbose)
+
+    try:
+        os.makedirs(Cache[:-len('.marshal')] + '.d', exist_ok=True)
+        lock = open(Cache + '.lock', 'a')
+    except OSError as e:
+        if verbose:
+            print(f'catalog cache unavailable: {e}')
+        Cache_Status = 'disabled'
+        return compile_app_data([ Dir ], verbose=verbose)
+
+    import fcntl
+    with lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        dir_mtime = os.stat(Dir).st_mtime_ns
+        old = index['shards'] if index and not rebuild else {}
+        old_summaries = read_summaries(Cache) if old else {}
+        parsed    = {}
+        shards    = {}
+        summaries = {}
+        for File in shard_files(Dir):
+            sig = shard_signature(File)
+            if File in old and old[File][0] == sig and \
+               File in old_summaries:
+                shards[File] = old[File]
+                summaries[File] = old_summaries[File]
+                use_settings(old[File][1])
+            else:
+                parsed[File] = read_app_file(File, verbose=verbose)
+                shards[File] = (sig, take_settings(parsed[File], File), [])
+        # validate once every file's OS_aliases are known
+        for File, y_data in parsed.items():
+            data = check_app_data(y_data, File)
+            sig, settings, names = shards[File]
+            shards[File] = (sig, settings, list(data))
+            summaries[File] = shard_summary(data)
+            write_cache(shard_cache(Cache, File),
+                        { 'sig' : sig, 'app_data' : data })
+        index = { 'format'    : CACHE_FORMAT,
+                  'dir'       : Dir,
+                  'dir_mtime' : dir_mtime,
+                  'shards'    : shards,
+                  'apps'      : index_apps(shards), }
+        write_cache(shard_cache(Cache, 'summary'), summaries)
+        write_cache(Cache, index)
+    if verbose:
+        print(f'catalog index rebuilt {Cache} '
+              f'({len(parsed)} of {len(shards)} files compiled)')
+    Cache_Status = 'rebuilt'
+    return ShardedCatalog(Cache, index, verbose=verbose)
+# }}}
+class LayeredCatalog:                                       # {{{
+    """
+    The catalog layers from catalog_files(), site first, seen as
+    one catalog without copying them.  An application defined in
+    several layers is merged when first used: a later layer's
+    name, category, default, ... replace the earlier ones, and its
+    versions are merged in one OS at a time, so a user catalog can
+    add matlab/2023b, or its own RHEL_7.8 entry for matlab/2022a,
+    and keep the site's other versions.  Each OS entry keeps the
+    'from' of the file that defined it.  The merged application is
+    checked for what no single layer has to define on its own (see
+    check_merged_app()).
+    """
+    def __init__(self, layers):
+        self.layers = layers
+        self.merged = {}
+
+    def __contains__(self, app):
+        return any(app in L for L in self.layers)
+
+    def __iter__(self):
+        return iter(dict.fromkeys(app for L in self.layers for app in L))
+
+    def __len__(self):
+        return sum(1 for app in self)
+
+    def __getitem__(self, app):
+        try:
+            return self.merged[app]
+        except KeyError:
+            pass
+        defs = [ L[app] for L in self.layers if app in L ]
+        if not defs:
+            raise KeyError(app)
+        A = defs[0] if len(defs) == 1 else merge_layers(app, defs)
+        self.merged[app] = check_merged_app(app, A)
+        return A
+
+    def get(self, app, default=None):
+        return self[app] if app in self else default
+
+    def keys(self):
+        return list(self)
+
+    def items(self):
+        return ( (app, self[app]) for app in self )
+
+    def values(self):
+        return ( self[app] for app in self )
+# }}}
+def merge_layers(app, defs):                                # {{{
+    """
+    One application from the definitions of it in each layer,
+    lowest first; see LayeredCatalog.  Only the application's own
+    dictionaries are copied.
+    """
+    merged = {}
+    for A in defs:
+        merged.update( (k, v) for k, v in A.items() if k != 'ver' )
+        if 'ver' not in A:
+            continue
+        versions = merged.setdefault('ver', {})
+        for ver, entries in A['ver'].items():
+            versions[ver] = {**versions.get(ver, {}), **entries}
+    return merged
+# }}}
+def print_app(data, app,                                    # {{{
+              verbose=0):
+    """
+    app -> "matlab", "all", or "matlab/SPEC" to list only the
+    versions SPEC (2022a, latest, >=2021a, ...) matches.
+    """
+
+    def print_one(app, spec=None):
+        if app not in data:
+            print(f'{app} is not a known application')
+            return
+        print(f'{app:14s} ', end='')
+        if 'name' in data[app]:
+            print(f"{data[app]['name']:14s} ", end='')
+        print()
+        shown = data[app]['ver']
+        if spec is not None:
+            shown = VersionIndex(shown).select(spec)
+            if not shown:
+                print(f'  {app}/{spec} matches no version')
+        for ver in shown:
+            s = '*' if ver == data[app]['default'] else ' '
+            print(f'  {s}  {ver} : ', end='')
+            if not verbose:
+                print(', '.join(data[app]['ver'][ver].keys()))
+            else:
+                print()
+                for OS in data[app]['ver'][ver]:
+                    print(f"{' ' * 7}{OS} ({data[app]['ver'][ver][OS]['from']})")
+                    for var in data[app]['ver'][ver][OS]['env']:
+                        # eg var = { 'PATH+' : '/usr/local/matlab/2020b/bin' }
+                        name = list(var)[0]
+                        value = var[name]
+                        print(f'{" " * 9}{name} {value}')
+
+    if app == 'all':
+        for A in sorted(data):
+            print_one(A)
+    else:
+        app, sep, spec = app.partition('/')
+        print_one(app, spec if sep else None)
+# }}}
+def env_var_action(varname):                                # {{{
+    """
+    varname is an environment variable name with two optional
+    modifiers, "!" and "+", and so takes one of three forms:
+        "XX"    ->  verb = 'append to'
+        "XX!"   ->  verb = 'overwrite'
+        "XX+"   ->  verb = 'prefix'
+    Returns the verb, varname without "!" or "+", and
+    a following string used for printing an explanation.
+    """
+    if   varname.endswith('!'):
+        clean = varname[:-1]
+        return "overwrite", clean, "with"
+    elif varname.endswith('+'):
+        clean = varname[:-1]
+        return "prefix", clean, "with"
+    else:
+        return "append to", varname, ":"
+# }}}
+class EnvEntry(tuple):                                      # {{{
+    """
+    One decoded env setting, eg "PATH+ : /usr/local/matlab/bin" ->
+    EnvEntry('PATH', 'prefix', '/usr/local/matlab/bin').  Unpacks
+    as (var, verb, value).
+    """
+    __slots__ = ()
+    def __new__(cls, var, verb, value):
+        return tuple.__new__(cls, (var, verb, value))
+    var   = property(lambda self: self[0])
+    verb  = property(lambda self: self[1])
+    value = property(lambda self: self[2])
+# }}}
+class Tool:                                                 # {{{
+    """
+    An app/version as defined for one OS: its EnvEntry tuple plus
+    the raw OS entry (for 'from', 'doc', aliases, ...).
+    """
+    __slots__ = ('app', 'ver', 'app_ver', 'name', 'env', 'entry')
+    def __init__(self, app, ver, name, entry):
+        self.app     = app
+        self.ver     = ver
+        self.app_ver = f'{app}/{ver}'
+        self.name    = name
+        self.entry   = entry
+        env = []
+        for var_setting in entry.get('env', []):  # list of dicts
+            for var in var_setting:
+                verb, clean_var, _ = env_var_action(var)
+                env.append( EnvEntry(clean_var, verb, var_setting[var]) )
+        self.env     = tuple(env)
+
+    def __repr__(self):
+        return f'Tool({self.app_ver})'
+# }}}
+Version_Ops = ('>=', '<=', '==', '~=', '>', '<')   # longest first
+def version_key(ver):                                       # {{{
+    """
+    Natural sort key for a version string: digit runs compare as
+    numbers and letter runs as text, so 2020b < 2021a < 2022a,
+    2020.07 < 2021.05 and 3.9 < 3.10.  Separators don't count
+    (2021.05 == 2021-5).
+    """
+    import re
+    return tuple( (1, int(t)) if t.isdigit() else (0, t)
+                  for t in re.findall(r'\d+|[^\W\d_]+', str(ver)) )
+# }}}
+def is_version_spec(ver):                                   # {{{
+    """
+    True for "latest", "OP VER" (>=2020b, ~=3.0, ...) and globs
+    (2021.*); anything else names one version.
+    """
+    return ver == 'latest' or ver.startswith(Version_Ops) or '*' in ver
+# }}}
+class VersionIndex:                                         # {{{
+    """
+    Versions sorted by version_key(), for resolving specifiers with
+    bisect:
+        latest      the newest version
+        >=2020b     >, <=, < and == work the same way
+        ~=3.0       >=3.0 and 3.*, as pip reads it; ~=2021a is 2021a
+                    or later in 2021
+        2021.*      shell-style glob on the version string
+    """
+    __slots__ = ('versions', 'keys')
+    def __init__(self, versions):
+        self.versions = sorted(versions, key=version_key)
+        self.keys     = [ version_key(v) for v in self.versions ]
+
+    def select(self, spec):
+        """
+        The versions spec matches, oldest first.
+        """
+        from bisect import bisect_left, bisect_right
+        if spec == 'latest':
+            return self.versions[-1:]
+        if '*' in spec:
+            from fnmatch import fnmatchcase
+            return [ v for v in self.versions if fnmatchcase(v, spec) ]
+        for op in Version_Ops:
+            if spec.startswith(op):
+                K = version_key(spec[len(op):].strip())
+                break
+        else:
+            return [ spec ] if spec in self.versions else []
+        lo, hi = 0, len(self.keys)
+        if op == '>=':
+            lo = bisect_left(self.keys, K)
+        elif op == '>':
+            lo = bisect_right(self.keys, K)
+        elif op == '<=':
+            hi = bisect_right(self.keys, K)
+        elif op == '<':
+            hi = bisect_left(self.keys, K)
+        elif op == '==':
+            lo = bisect_left(self.keys, K)
+            hi = bisect_right(self.keys, K)
+        elif op == '~=':
+            lo = bisect_left(self.keys, K)
+            if len(K) > 1:  # (2,) sorts after every token
+                hi = bisect_left(self.keys, K[:-1] + ((2,),))
+        return self.versions[lo:max(lo, hi)]
+
+    def newest(self, spec):
+        """
+        The newest version spec matches, or None.
+        """
+        found = self.select(spec)
+        return found[-1] if found else None
+# }}}
+class Resolved:                                             # {{{
+    """
+    The catalog as seen from one OS.  Applications are resolved on
+    first use, so the cost is proportional to the applications a
+    command touches rather than the size of the catalog, and name
+    lookups ("+matlab", "matlab/2022a", "matlab/>=2021a", ...) are
+    memoized.
+        index = Resolved(app_data, This_OS)
+        app, ver, err = index.lookup('+matlab')
+        for var, verb, value in index.tool(app, ver).env: ...
+    """
+    __slots__ = ('data', 'OS', '_apps', '_order', '_lookup', '_closure')
+    def __init__(self, data, OS):
+        self.data    = data    # the merged catalog, eg from load_app_data()
+        self.OS      = OS
+        self._apps   = {}      # app -> { ver : Tool } for this OS
+        self._order  = {}      # app -> VersionIndex of those versions
+        self._lookup = {}      # app_ver as typed -> (app, ver, err)
+        self._closure = None   # app/ver -> setapp_requires.closure()
+
+    def versions(self, app):
+        """
+        { ver : Tool } for the versions of app available on this OS,
+        or None if app isn't in the catalog.
+        """
+        try:
+            return self._apps[app]
+        except KeyError:
+            pass
+        if app not in self.data:
+            return None
+        A = self.data[app]
+        tools = { ver : Tool(app, ver, A.get('name', app), A['ver'][ver][self.OS])
+                  for ver in A['ver'] if self.OS in A['ver'][ver] }
+        self._apps[app] = tools
+        return tools
+
+    def tool(self, app, ver):
+        return self.versions(app)[ver]
+
+    def relates(self, app_ver):
+        """
+        True if app_ver is usable and has requires, conflicts or
+        bundle (Requirement_Keys) in its entry or its application.
+        """
+        app, ver, err = self.lookup(app_ver)
+        if err:
+            return False
+        entry = self.tool(app, ver).entry
+        return any(K in entry or K in self.data[app] for K in Requirement_Keys)
+
+    def version_index(self, app):
+        try:
+            return self._order[app]
+        except KeyError:
+            order = self._order[app] = VersionIndex(self.versions(app))
+            return order
+
+    def lookup(self, app_ver):
+        """
+        app_ver -> "matlab", "+matlab", "matlab/2022a" or a version
+        specifier such as "matlab/latest" or "matlab/>=2021a" (see
+        VersionIndex), which picks the newest match on this OS.
+        Returns (app, ver, err); err is "" if app/ver is usable.
+        """
+        try:
+            return self._lookup[app_ver]
+        except KeyError:
+            pass
+        name = app_ver[1:] if app_ver.startswith('+') else app_ver
+        app, sep, ver = name.partition('/')
+        if app not in self.data:
+            if sep:
+                result = (app, ver, f'{app} is not a known application')
+            else:
+                result = (None, None, f'{name} is not a known application')
+        else:
+            spec = ver
+            if not sep:
+                ver = self.data[app]['default']
+            elif ver not in self.data[app]['ver'] and is_version_spec(ver):
+                ver = self.version_index(app).newest(spec)
+            if ver is None:
+                result = (app, spec, f'{app}/{spec} matches no version '
+                                     f'available for {self.OS}')
+            elif ver not in self.data[app]['ver']:
+                result = (app, ver, f'{app}/{ver} is not defined')
+            elif ver not in self.versions(app):
+                result = (app, ver, f'{app}/{ver} is not available for {self.OS}')
+            else:
+                result = (app, ver, "")
+        self._lookup[app_ver] = result
+        return result
+# }}}
+def app_exists(index, app_ver):                             # {{{
+    """
+    app_ver -> "matlab", or "matlab/2022a"
+    Return an error string if the requested app/version
+    isn't defined.  Ignore leading '+' if it exists.
+    """
+    return index.lookup(app_ver)
+# }}}
+def explain(index, app_ver,                                 # {{{
+            verbose=0):
+    """
+    app_ver -> "matlab", or "matlab/2022a"
+    """
+
+    app, ver, err = app_exists(index, app_ver)
+    if err:
+        print(err)
+        return
+    print(f'{app}/{ver}')
+    tool = index.tool(app, ver)
+    print(f"  defined in {tool.entry['from']}")
+    if index.relates(app_ver):
+        import setapp_requires
+        for line in setapp_requires.describe(index, tool):
+            print(line)
+    for var, verb, value in tool.env:
+        preposition = ':' if verb == 'append to' else 'with'
+        print(f"  -> {verb} {var} {preposition} {value}")
+
+# }}}
+def add_app(index, app_ver_list, Old_Env,                   # {{{
+            verbose=0):
+    """
+    app_ver is a list of application names with an optional version
+    number:  "matlab" or "matlab/2022a"
+
+    Return an updated Env dictionary of lists that contain
+    the environment delta needed to include app_ver.
+    """
+
+    New_Env = { 'SETAPP_TOOLS' : [] }
+    if 'SETAPP_TOOLS' in Old_Env:
+        New_Env['SETAPP_TOOLS'] = [ '${SETAPP_TOOLS}' ]
+    have_it = {}
+
+    for app_ver in app_ver_list:
+        if app_ver.startswith('+'):
+            front = True
+        else:
+            front = False
+
+        app, ver, err = app_exists(index, app_ver)
+        clean_app_ver = f'{app}/{ver}'
+        if err:
+            print(err)
+            return
+
+        if clean_app_ver in have_it:
+            continue
+
+        action = {
+            'append to' : [],
+            'prefix'    : [],
+            'overwrite' : [],
+        }
+        for clean_var, verb, value in index.tool(app, ver).env:
+            if verb == 'append to' and front:
+                verb = 'prefix'
+            action[verb].append( (clean_var, value)  )
+            if clean_var in New_Env:
+                continue
+            if clean_var in Old_Env:
+                New_Env[clean_var] = env_list(clean_var, [ f'${{{clean_var}}}' ])
+            else:
+                New_Env[clean_var] = env_list(clean_var)
+
+        # add this app/ver to the registry variable
+        New_Env['SETAPP_TOOLS'].append( clean_app_ver )
+        have_it[clean_app_ver] = True
+
+        for env_var, value in action['append to']:
+            New_Env[env_var].append(value)
+        for env_var, value in action['prefix']:
+            New_Env[env_var].insert(0, value)
+        for env_var, value in action['overwrite']:
+            New_Env[env_var] = env_list(env_var, [ value ])
+
+    return { var : list(values) for var, values in New_Env.items() }
+# }}}
+def print_joined_values(color, separator, values,           # {{{
+                        color_set, joiner=":"):
+    sep = separator
+    color = color if color_output() else None
+    for value in values:
+        if color and value in color_set:
+            print(f"{sep}[{color}]{value}", end="")
+        else:
+            print(f"{sep}{value}", end="")
+        sep = joiner
+    print()
+# }}}
+def rm_app( index, app_ver_list, Old_Env,                   # {{{
+            verbose=0, ledger=None):
+    """
+    Modify Old_Env by removing the applications in app_ver_list.
+    Retain any environment variables needed by other applications
+    in case there are overlaps.  ledger is read_ledger(index, Old_Env)
+    if the caller already has it.
+    Return dict of affected env variables.
+    """
+
+    if 'SETAPP_TOOLS' not in Old_Env:
+        print("no applications definied, nothing removed")
+        return
+
+    if any(index.relates(app_ver) for app_ver in app_ver_list):
+        import setapp_requires
+        app_ver_list = setapp_requires.bundle_members(index, app_ver_list)
+    tools_to_rm = []
+    for app_ver in app_ver_list:
+        if app_ver == 'all':
+            tools_to_rm = ['all']
+            break
+        app, ver, err = app_exists(index, app_ver)
+        if err:
+            print(err)
+            continue
+        tools_to_rm.append(app)
+    rm_app_set = set(tools_to_rm)
+
+    # make a set from basenames of existing apps
+    configured_apps = {}  # configured_apps['matlab'] = '2022a'
+    for app_ver in Old_Env['SETAPP_TOOLS'][0].split(':'):
+        app, ver, err = app_exists(index, app_ver)
+        if err:
+            print(err)
+            continue
+        configured_apps[app] = ver
+    existing_set = set(configured_apps.keys())
+    if 'all' in rm_app_set:
+        rm_app_set  = existing_set
+    else:
+        rm_app_set &= existing_set # intersection
+
+    if ledger is None:
+        ledger = read_ledger(index, Old_Env)
+
+#   print('rm_app_set   =', rm_app_set  )
+#   print('ledger       =', ledger       )
+
+    # one pass over each variable: a value goes if every tool that
+    # contributed it is being removed
+    New_Env = {}
+    for k, owners in ledger.items():
+        if k not in Old_Env:
+            continue
+        kept    = []
+        deleted = set()
+        for value in Old_Env[k]:
+            who = owners.get(value)
+            if who and all(t.split('/')[0] in rm_app_set for t in who):
+                if verbose:
+                    print(f'DELETING {value} from {k}')
+                deleted.add(value)
+            else:
+                kept.append(value)
+        if not deleted:
+            continue
+        New_Env[k] = kept
+        sep = list_separator(k) or ":"
+        print(f"Before {k}=", end="")
+        print_joined_values("red", sep, Old_Env[k], deleted, joiner=sep)
+        if kept:
+            print(f"After  {k}={join_env_var(k, kept)}\n")
+        else:
+            print(f"After  {k}=null\n")
+
+    # drop the removed tools from the registry variable
+    if rm_app_set:
+        New_Env['SETAPP_TOOLS'] = [ t for t in
+                    Old_Env['SETAPP_TOOLS'][0].split(':')
+                    if t and t.split('/')[0] not in rm_app_set ]
+
+#   pp.pprint(New_Env)
+    return New_Env
+# }}}
+def ledger_checksum(values):                                # {{{
+    import zlib
+    return '%08x' % (zlib.crc32(':'.join(values).encode()) & 0xffffffff)
+# }}}
+def read_ledger(index, Old_Env):                            # {{{
+    """
+    Which loaded tools contributed each value of each variable:
+        { 'PATH' : { '/usr/local/matlab/2022a/bin' : ['matlab/2022a'],
+                     ... }, ... }
+    Taken from SETAPP_LEDGER where it still describes Old_Env.
+    Variables it doesn't cover (no ledger, SETAPP_TOOLS or the
+    variable changed behind setapp's back) are rebuilt from the
+    catalog: every loaded tool that sets a value owns it.
+
+    SETAPP_LEDGER is
+        LEDGER_FORMAT;crc(SETAPP_TOOLS);VAR=crc(VAR)=OWNERS;...
+    where OWNERS has one comma separated item per position in VAR,
+    each a '.' separated list of indices into SETAPP_TOOLS (empty if
+    the value isn't setapp's).  Trailing empty items are dropped;
+    every variable the loaded tools set is listed, if only as
+    VAR=crc=, while it is in the environment.
+    """
+    if 'SETAPP_TOOLS' not in Old_Env:
+        return {}
+    tools  = [ t for t in Old_Env['SETAPP_TOOLS'][0].split(':') if t ]
+    ledger = {}
+    fields = Old_Env.get('SETAPP_LEDGER', [''])[0].split(';')
+    if len(fields) > 1 and fields[0] == str(LEDGER_FORMAT) and \
+       fields[1] == ledger_checksum(tools):
+        for field in fields[2:]:
+            try:
+                var, crc, items = field.split('=', 2)
+                if var not in Old_Env or \
+                   crc != ledger_checksum(Old_Env[var]):
+                    continue   # stale, rebuilt below
+                owners = {}
+                for value, item in zip(Old_Env[var], items.split(',')):
+                    if item:
+                        owners[value] = [ tools[int(i)]
+                                          for i in item.split('.') ]
+                ledger[var] = owners
+            except (ValueError, IndexError):
+                continue
+
+    # fall back to the catalog for everything else
+    configured_apps = {}
+    for app_ver in tools:
+        app, ver, err = index.lookup(app_ver)
+        if not err:
+            configured_apps[app] = ver
+    rebuilt = {}
+    for app, ver in configured_apps.items():
+        for var, verb, value in index.tool(app, ver).env:
+            if var in ledger or var not in Old_Env:
+                continue
+            rebuilt.setdefault(var, {}).setdefault(value, []) \
+                   .append(f'{app}/{ver}')
+    ledger.update(rebuilt)
+    return ledger
+# }}}
+def ledger_value(index, Old_Env, ledger, delta):            # {{{
+    """
+    The SETAPP_LEDGER setting (a delta entry) that describes the
+    environment after delta is applied to Old_Env.  ledger is
+    read_ledger(index, Old_Env).  A tool that wasn't loaded before
+    owns the values it sets, except ones that were already there
+    and not setapp's (eg /usr/bin in PATH), which removing it
+    leaves alone.  A tool that was loaded owns the values it puts
+    back, eg after its catalog entry changed.
+    """
+    def after(var):
+        values = Old_Env.get(var, [])
+        if var in delta:
+            ref    = f'${{{var}}}'
+            joined = join_env_var(var, values)
+            values = split_env_var(var, join_env_var(var,
+                         [ joined if v == ref else v for v in delta[var] ]))
+        return values
+
+    tools = [ t for t in ':'.join(after('SETAPP_TOOLS')).split(':') if t ]
+    if not tools:
+        return []
+    position = {}
+    for i, app_ver in enumerate(tools):
+        position.setdefault(app_ver, i)
+
+    old_tools = set(':'.join(Old_Env.get('SETAPP_TOOLS', [])).split(':'))
+    claims = {}  # claims['PATH']['/usr/local/matlab/2022a/bin'] = [...]
+    for app_ver in position:
+        app, ver, err = index.lookup(app_ver)
+        if err:
+            continue
+        for var, verb, value in index.tool(app, ver).env:
+            if app_ver in old_tools and value in Old_Env.get(var, ()):
+                # ledger says whether it owns the values already there
+                continue
+            claims.setdefault(var, {}).setdefault(value, []).append(app_ver)
+
+    fields = [ str(LEDGER_FORMAT), ledger_checksum(tools) ]
+    for var in sorted( (set(ledger) | set(delta) | set(claims)) -
+                       {'SETAPP_TOOLS', 'SETAPP_LEDGER'} ):
+        values = after(var)
+        owned  = ledger.get(var, {})
+        before = set(Old_Env.get(var, []))
+        items  = []
+        for value in values:
+            who = [ t for t in owned.get(value, []) if t in position ]
+            if value not in before or owned.get(value):
+                who += [ t for t in claims.get(var, {}).get(value, [])
+                         if t not in who ]
+            items.append('.'.join(str(position[t]) for t in who))
+        while items and not items[-1]:
+            items.pop()
+        if join_env_var(var, values):
+            # even with no items, so that read_ledger() doesn't hand
+            # values that were there before setapp to a loaded tool
+            fields.append(f'{var}={ledger_checksum(values)}={",".join(items)}')
+    return [ ';'.join(fields) ]
+# }}}
+def catalog_stamp(infile=None):                             # {{{
+    """
+    Checksum of the host's kernel release (which picks This_OS) and
+    the path, mtime and size of each catalog file, including each
+    file of a catalog directory; any edit to the catalog, or a new
+    ~/.config/setapp/inputs.yaml, changes it.  Only stats, so it's
+    cheap enough to run before the catalog is loaded.
+    """
+    sig = [ os.uname().release ]
+    for File in expand_catalog(catalog_files(infile)):
+        try:
+            st = os.stat(File)
+            sig.append(f'{os.path.abspath(File)}={st.st_mtime_ns}={st.st_size}')
+        except OSError:
+            sig.append(File)
+    return ledger_checksum(sig)
+# }}}
+def request_checksum(args):                                 # {{{
+    return ledger_checksum( [ args.check_paths or '' ] + args.applications )
+# }}}
+def env_checksum(environ, variables):                       # {{{
+    return ledger_checksum( f'{var}={environ[var]}' if var in environ else var
+                            for var in variables )
+# }}}
+def environ_after(environ, delta):                          # {{{
+    """
+    environ (strings) as the shell leaves it after sourcing delta.
+    """
+    after = dict(environ)
+    for var, values in delta.items():
+        if not values:
+            after.pop(var, None)
+            continue
+        ref = f'${{{var}}}'
+        after[var] = join_env_var(var, [ environ.get(var, '') if v == ref
+                                         else v for v in values ])
+    return after
+# }}}
+def state_unchanged(args, environ=None):                    # {{{
+    """
+    True if SETAPP_STATE says that the request in args was already
+    carried out, nothing it depends on has changed since, and so
+    it would change nothing.
+
+    SETAPP_STATE is
+        STATE_FORMAT;catalog_stamp();VAR,...;env_checksum();REQ,...
+    where the VARs are SETAPP_TOOLS, SETAPP_LEDGER and every
+    variable the loaded tools set, and each REQ is the
+    request_checksum() of a request known to be satisfied.
+    """
+    environ = os.environ if environ is None else environ
+    fields  = environ.get('SETAPP_STATE', '').split(';')
+    if len(fields) != 5 or fields[0] != str(STATE_FORMAT) or \
+       request_checksum(args) not in fields[4].split(','):
+        return False
+    return fields[3] == env_checksum(environ, fields[2].split(',')) and \
+           fields[1] == catalog_stamp(args.infile)
+# }}}
+def state_value(index, args, environ, delta):               # {{{
+    """
+    The SETAPP_STATE for after delta, the change args asked for, is
+    applied to environ, or None if there should be none because
+    asking again would change something (--check-paths drop, or
+    prefixes that don't settle).  Requests recorded in the current
+    SETAPP_STATE stay if it's current and delta changes nothing.
+    """
+    after = environ_after(environ, delta)
+    if delta:
+        Again = get_current_env(after)
+        if swap_app(index, args.applications, Again,
+                    read_ledger(index, Again)):
+            return None
+    tools = [ t for t in after.get('SETAPP_TOOLS', '').split(':') if t ]
+    names = { 'SETAPP_TOOLS', 'SETAPP_LEDGER' }
+    for app_ver in tools:
+        app, ver, err = index.lookup(app_ver)
+        if not err:
+            names.update(var for var, verb, value in index.tool(app, ver).env)
+    names = sorted(names)
+    fields = [ str(STATE_FORMAT), catalog_stamp(args.infile),
+               ','.join(names), env_checksum(after, names) ]
+    old  = environ.get('SETAPP_STATE', '').split(';')
+    reqs = []
+    if not delta and old[:4] == fields:
+        reqs = old[4].split(',')
+    req  = request_checksum(args)
+    reqs = [ r for r in reqs if r != req ][1 - STATE_REQUESTS:] + [ req ]
+    return ';'.join(fields + [ ','.join(reqs) ])
+# }}}
+def planned_apps(index, app_ver_list, Old_Env):             # {{{
+    """
+    app_ver_list as swap_app() loads it into Old_Env: with what the
+    tools require first and bundles replaced by their members
+    (setapp_requires.expand()), or None after printing why it
+    can't be loaded.
+    """
+    loaded = {}   # loaded['matlab'] = 'matlab/2020b'
+    for app_ver in ':'.join(Old_Env.get('SETAPP_TOOLS', [])).split(':'):
+        if not app_ver:
+            continue
+        app, ver, err = index.lookup(app_ver)
+        if not err:
+            loaded[app] = app_ver
+    if not any(index.relates(app_ver) for app_ver in
+               (*app_ver_list, *loaded.values())):
+        return app_ver_list
+    import setapp_requires
+    return setapp_requires.expand(index, app_ver_list, loaded)
+# }}}
+def swap_app(index, app_ver_list, Old_Env, ledger,          # {{{
+             verbose=0):
+    """
+    Plan the change from the tools now in SETAPP_TOOLS to those plus
+    app_ver_list (as in add_app) in one step.  An application that
+    is loaded at another version has its values replaced where they
+    stand, so switching matlab/2020b to matlab/2022a leaves the new
+    bin directory where the old one was in PATH.  "+app" moves app
+    to the front, one already loaded at the requested version stays
+    in place (only missing values are restored), and new
+    applications are added as add_app() would.
+    ledger is read_ledger(index, Old_Env); a value shared with another
+    loaded tool (or not setapp's) is kept and the new one goes next
+    to it.  What the tools require comes first and bundles stand
+    for their members (setapp_requires.expand()).
+
+    Returns the delta for just the variables whose value changes,
+    or None if an app_ver is unknown or can't be loaded with the
+    rest.
+    """
+    old_tools = [ t for t in ':'.join(Old_Env.get('SETAPP_TOOLS', [])).split(':')
+                  if t ]
+    tools  = list(old_tools)
+    live   = set(tools)
+    loaded = {}   # loaded['matlab'] = 'matlab/2020b'
+    for app_ver in tools:
+        app, ver, err = index.lookup(app_ver)
+        if not err:
+            loaded[app] = app_ver
+    app_ver_list = planned_apps(index, app_ver_list, Old_Env)
+    if app_ver_list is None:
+        return
+    Env     = {}  # working copy (PathList or list) of the variables touched
+    claimed = {}  # claimed['PATH'][value] = { app/ver set it in this plan }
+
+    def values(var):
+        if var not in Env:
+            Env[var] = env_list(var, Old_Env.get(var, []))
+        return Env[var]
+
+    def has(var, value):
+        return value in values(var)
+
+    def remove(var, value):
+        values(var).remove(value)
+
+    def only_from(var, value, app_ver):
+        # is app_ver the one loaded tool that contributed value?
+        found = False
+        for who in (ledger.get(var, {}).get(value, ()),
+                    claimed.get(var, {}).get(value, ())):
+            for t in who:
+                if t != app_ver and t in live:
+                    return False
+                found = found or t == app_ver
+        return found
+
+    def claim(var, value, app_ver):
+        claimed.setdefault(var, {}).setdefault(value, set()).add(app_ver)
+
+    def drop(app_ver):
+        # what rm_app() would do for this one tool
+        app, ver, err = index.lookup(app_ver)
+        for var, verb, value in index.tool(app, ver).env:
+            if has(var, value) and only_from(var, value, app_ver):
+                remove(var, value)
+        tools.remove(app_ver)
+        live.discard(app_ver)
+
+    def put(var, verb, value, app_ver):
+        claim(var, value, app_ver)
+        V = values(var)
+        if verb == 'overwrite':
+            V.clear()
+            V.append(value)
+        elif verb == 'prefix':
+            V.insert(0, value)  # a PathList moves an entry already there
+        else:
+            V.append(value)     # and ignores one appended again
+
+    have_it = {}
+    for app_ver in app_ver_list:
+        front = app_ver.startswith('+')
+        app, ver, err = index.lookup(app_ver)
+        if err:
+            print(err)
+            return
+        new = f'{app}/{ver}'
+        if new in have_it:
+            continue
+        have_it[new] = True
+        old = loaded.get(app)
+        new_env = index.tool(app, ver).env
+
+        if old == new and not front:
+            # already loaded; just put back anything that went missing
+            actions = [ (var, verb, value) for var, verb, value in new_env
+                        if not has(var, value) or
+                           (verb == 'overwrite' and values(var) != [value]) ]
+        elif old and not front:
+            if verbose:
+                print(f'swapping {old} -> {new}')
+            # pair the old and new values of each variable in order
+            pending = {}
+            for var, verb, value in new_env:
+                pending.setdefault(var, []).append( (verb, value) )
+            o_app, o_ver, o_err = index.lookup(old)
+            for var, verb, old_value in index.tool(o_app, o_ver).env:
+                V = values(var)
+                sole = has(var, old_value) and only_from(var, old_value, old)
+                if not pending.get(var):
+                    if sole:
+                        remove(var, old_value)
+                    continue
+                n_verb, new_value = pending[var].pop(0)
+                if not has(var, old_value) or n_verb == 'overwrite':
+                    put(var, n_verb, new_value, new)
+                    continue
+                claim(var, new_value, new)
+                if new_value == old_value:
+                    continue
+                if has(var, new_value):
+                    if sole:
+                        remove(var, old_value)
+                    continue
+                if sole:
+                    V[V.index(old_value)] = new_value
+                else:
+                    V.insert(V.index(old_value) + 1, new_value)
+            actions = [ (var, verb, value) for var in pending
+                                           for verb, value in pending[var] ]
+            tools[tools.index(old)] = new
+            live.discard(old)
+            live.add(new)
+        else:
+            if old:
+                drop(old)
+            actions = [ (var, 'prefix' if front and verb == 'append to'
+                              else verb, value)
+                        for var, verb, value in new_env ]
+            tools.append(new)
+            live.add(new)
+        loaded[app] = new
+
+        # same order of application as add_app()
+        for verb in ('append to', 'prefix', 'overwrite'):
+            for var, v, value in actions:
+                if v == verb:
+                    put(var, verb, value, new)
+
+    New_Env = {}
+    for var, V in Env.items():
+        final = split_env_var(var, join_env_var(var, V)) if V else []
+        if final != Old_Env.get(var, []):
+            New_Env[var] = final
+    if tools != old_tools:
+        New_Env['SETAPP_TOOLS'] = tools
+    return New_Env
+# }}}
+def clean_env_var(value, sep=':'):                          # {{{
+    """
+    Cleans up PATH-like environment variable by removing
+    duplicate entries, consecutive colons, leading and
+    trailing colons.
+    """
+    return list(PathList.split(value, sep))
+# }}}
+def getapp(index, environ=None):                            # {{{
+    environ = os.environ if environ is None else environ
+    if 'SETAPP_TOOLS' not in environ:
+        print('no tools configured')
+        return
+    for app_ver in environ['SETAPP_TOOLS'].split(':'):
+        app, ver, err = app_exists(index, app_ver)
+        if err:
+            print(f'unrecognized tool "{app_ver}", {err}')
+            continue
+        print(f"{app:16s} {ver:14s} {index.tool(app, ver).name}")
+# }}}
+def get_current_env(environ=None):                          # {{{
+    """
+    Return environ (default os.environ) as a dictionary of lists.
+    """
+    environ = os.environ if environ is None else environ
+    Env = {}
+    with Span('read environment'):
+        for var in environ:
+            Env[var] = split_env_var(var, environ[var])
+
+    return Env
+# }}}
+class PathList:                                              # {{{
+    """
+    The value of a PATH-like variable: an insertion ordered set of
+    entries with O(1) append, prepend, remove and "in".  An entry
+    appears once; adding one that is already there keeps the
+    occurrence nearer the front with keep='first' (the one the
+    shell finds, so append is a no-op and prepend moves it to the
+    front) or nearer the back with keep='last'.  Behaves like a
+    list otherwise, eg insert(i, x), V[i] = x and V.index(x) (these
+    are O(n)), and compares equal to the list of its entries.
+
+    Prepended entries are kept in front (newest last) and appended
+    ones in back, so iteration is reversed(front) then back.
+    """
+    __slots__ = ('front', 'back', 'sep', 'keep')
+
+    def __init__(self, values=(), sep=':', keep='first'):
+        if keep not in ('first', 'last'):
+            raise ValueError(f'keep must be "first" or "last", not {keep!r}')
+        self.sep   = sep
+        self.keep  = keep
+        self.front = {}
+        if keep == 'first':
+            self.back = dict.fromkeys(values)
+        else:
+            self.reset(values)
+
+    @classmethod
+    def split(cls, value, sep=':', keep='first'):
+        """
+        PathList of the non-empty entries of string value.
+        """
+        return cls(filter(None, value.split(sep)), sep=sep, keep=keep)
+
+    def reset(self, values):
+        values = list(values)
+        if self.keep == 'last':
+            values.reverse()
+            values = list(dict.fromkeys(values))
+            values.reverse()
+        self.front = {}
+        self.back  = dict.fromkeys(values)
+
+    def __contains__(self, value):
+        return value in self.back or value in self.front
+
+    def __iter__(self):
+        if not self.front:
+            return iter(self.back)
+        return iter(list(reversed(self.front)) + list(self.back))
+
+    def __len__(self):
+        return len(self.front) + len(self.back)
+
+    def __eq__(self, other):
+        if isinstance(other, (PathList, list)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return f'PathList({list(self)!r}, sep={self.sep!r})'
+
+    def __getitem__(self, i):
+        return list(self)[i]
+
+    def __setitem__(self, i, value):
+        values = list(self)
+        values[i] = value
+        self.reset(values)
+
+    def append(self, value):
+        if value in self.back or value in self.front:
+            if self.keep == 'first':
+                return
+            self.remove(value)
+        self.back[value] = None
+
+    def prepend(self, value):
+        if value in self.back or value in self.front:
+            if self.keep == 'last':
+                return
+            self.remove(value)
+        self.front[value] = None
+
+    def insert(self, i, value):
+        if i == 0:
+            self.prepend(value)
+        elif i >= len(self) and value not in self:
+            self.append(value)
+        else:
+            values = list(self)
+            values.insert(i, value)
+            self.reset(values)
+
+    def remove(self, value):
+        if value in self.back:
+            del self.back[value]
+        else:
+            del self.front[value]   # KeyError, as list.remove raises ValueError
+
+    def discard(self, value):
+        self.back.pop(value, None)
+        self.front.pop(value, None)
+
+    def clear(self):
+        self.front = {}
+        self.back  = {}
+
+    def index(self, value):
+        for i, v in enumerate(self):
+            if v == value:
+                return i
+        raise ValueError(f'{value!r} is not in PathList')
+
+    def join(self):
+        return self.sep.join(self)
+# }}}
+def list_separator(var):                                    # {{{
+    """
+    The separator of var's entries if it holds a list, else None.
+    A catalog's List_vars section decides; otherwise *PATH and
+    *LICENSE_FILE* variables are ':' separated lists.
+    """
+    if var in List_vars:
+        return List_vars[var]
+    if var.endswith('PATH') or 'LICENSE_FILE' in var:
+        return ':'
+    return None
+# }}}
+def is_list_var(var):                                       # {{{
+    return list_separator(var) is not None
+# }}}
+def env_list(var, values=()):                               # {{{
+    """
+    A PathList of values for list variable var, a plain list for
+    any other.
+    """
+    sep = list_separator(var)
+    if sep is None:
+        return list(values)
+    return PathList(values, sep=sep)
+# }}}
+def split_env_var(var, value):                              # {{{
+    """
+    The value of var as a list: list variables are split on their
+    separator and cleaned, others are a single item.
+    """
+    sep = list_separator(var)
+    if sep is not None:
+        return clean_env_var(value, sep)
+    return [ value ]
+# }}}
+def join_env_var(var, values):                              # {{{
+    return (list_separator(var) or ':').join(values)
+# }}}
+def merge_delta(first, second):                             # {{{
+    """
+    Combine two environment deltas where second was computed
+    as if first had not been applied yet: references such as
+    "${PATH}" in second are replaced by first's value for PATH.
+    """
+    if first is None:
+        return second
+    if second is None:
+        return first
+    merged = dict(first)
+    for var, values in second.items():
+        if var not in first:
+            merged[var] = values
+            continue
+        ref = f'${{{var}}}'
+        merged[var] = []
+        for value in values:
+            if value == ref:
+                merged[var].extend(first[var])
+            else:
+                merged[var].append(value)
+    return merged
+# }}}
+def shell_line(var, values, shell):                         # {{{
+    """
+    Shell command that sets var to the joined values, which
+    may refer to the current value as ${var}, or unsets var if
+    values is empty.
+    """
+    if shell == 'csh':
+        if not values:
+            return f'unsetenv {var}'
+        return 'setenv %s "%s"' % (var, join_env_var(var, values))
+    if not values:
+        return f'unset {var}'
+    return 'export %s="%s"' % (var, join_env_var(var, values))
+# }}}
+def dotfile_text(Env, shell):                               # {{{
+    """
+    The shell commands that apply the environment delta Env.
+    """
+    return ''.join(shell_line(var, Env[var], shell) + '\n' for var in Env)
+# }}}
+def write_dotfile(Env, shell):                              # {{{
+    if not Env:
+        print('null environment change, nothing written')
+        return
+    import pathlib
+    P = pathlib.Path(SETAPP_DOTFILE)
+    with Span('write dotfile'):
+        P.write_text(dotfile_text(Env, shell))
+# }}}
+def run_command(args, index, environ=None):                 # {{{
+    """
+    Carry out the getapp, remove, explain, or add request in args
+    against the resolved catalog (a Resolved) and the given
+    environment (default os.environ).  Shared by main() and the
+    daemon.  Returns the environment delta to write to the dotfile,
+    including the updated SETAPP_LEDGER, or None.
+    """
+    if args.getapp:
+        getapp(index, environ)
+    elif args.remove:
+        Old_Env = get_current_env(environ)
+        with Span('plan changes'):
+            ledger  = read_ledger(index, Old_Env)
+            delta_Env = rm_app(index, args.applications, Old_Env,
+                               verbose=args.verbose, ledger=ledger)
+            if delta_Env:
+                delta_Env['SETAPP_LEDGER'] = ledger_value(index, Old_Env,
+                                                          ledger, delta_Env)
+        return delta_Env
+    elif args.explain:
+        explain(index, args.explain)
+    elif args.shell and args.applications:
+        Old_Env = get_current_env(environ)
+#       pp.pprint(Old_Env)
+        with Span('plan changes'):
+            ledger = read_ledger(index, Old_Env)
+            delta_Env = swap_app(index, args.applications, Old_Env, ledger,
+                                 verbose=args.verbose)
+        if delta_Env and args.check_paths:
+            import setapp_paths
+            with Span('check paths'):
+                if not setapp_paths.check_delta(index, args.applications,
+                                                Old_Env, delta_Env,
+                                                args.check_paths):
+                    return None
+        with Span('plan changes'):
+            if delta_Env:
+                delta_Env['SETAPP_LEDGER'] = ledger_value(index, Old_Env,
+                                                          ledger, delta_Env)
+        if delta_Env is None:
+            return None
+        with Span('fingerprint'):
+            environ = os.environ if environ is None else environ
+            state   = state_value(index, args, environ, delta_Env)
+            if state != environ.get('SETAPP_STATE'):
+                delta_Env['SETAPP_STATE'] = [ state ] if state else []
+        import pprint
+        pprint.PrettyPrinter(indent=2).pprint(delta_Env)
+        return delta_Env
+    return None
+# }}}
+def main():                                                 # {{{
+    global Usage
+    if '--timings' in sys.argv or os.environ.get('SETAPP_PROFILE'):
+        start_timings()
+    if SETAPP_USAGE_LOG:
+        import time
+        Usage = { 't' : int(time.time()), 't0' : time.perf_counter() }
+    if len(sys.argv) == 1:
+        # No arguments; echo the help information and exit.
+        sys.argv.append('--help')
+    args   = None
+    status = 0
+    try:
+        with Span('parse arguments'):
+            args = parse_args()
+        if args.cprofile:
+            import cProfile
+            profiler = cProfile.Profile()
+            try:
+                profiler.runcall(main_command, args)
+            finally:
+                profiler.dump_stats(args.cprofile)
+        else:
+            main_command(args)
+    except SystemExit as e:
+        status = e.code or 0
+        raise
+    except BaseException:
+        status = 1
+        raise
+    finally:
+        if Timings is not None:
+            report_timings(args)
+        if Usage is not None:
+            log_usage(args, status)
+# }}}
+def main_command(args):                                     # {{{
+    if args.check_paths is None and \
+       os.environ.get('SETAPP_CHECK_PATHS') in ('warn', 'drop', 'fail'):
+        args.check_paths = os.environ['SETAPP_CHECK_PATHS']
+    # commands that need neither the catalog nor This_OS
+    if args.dump_env:
+        dump_env()
+        return
+    if args.getapp and 'SETAPP_TOOLS' not in os.environ:
+        getapp(None)
+        return
+    if args.validate is not None:
+        import setapp_validate
+        sys.exit(setapp_validate.run(args.validate or catalog_files(args.infile),
+                                     as_json=args.json,
+                                     check_paths=args.check_paths))
+    if args.serve:
+        import setapp_daemon
+        setapp_daemon.serve(args)
+        return
+    if args.import_modules:
+        import setapp_import
+        sys.exit(setapp_import.run(args))
+    if args.stats:
+        import setapp_stats
+        sys.exit(setapp_stats.run(args))
+    if args.save:
+        import setapp_snapshot
+        sys.exit(setapp_snapshot.save(args))
+    if args.restore:
+        import setapp_snapshot
+        delta_Env = setapp_snapshot.restore(args)
+        if delta_Env is None:
+            sys.exit(1)
+        write_dotfile(delta_Env, args.shell)
+        return
+    lists_files = args.show_bin or args.show_man or args.provides or \
+                  args.refresh_index
+    finds_apps  = args.apps_by_cat or args.search
+    if args.applications and args.shell and not (args.remove or
+       args.explain or args.getapp or args.show or args.render or
+       lists_files or finds_apps or args.probe or args.batch or
+       args.rebuild_cache) and \
+       state_unchanged(args):
+        if args.verbose:
+            print('setapp: SETAPP_STATE matches, nothing to do')
+        write_dotfile({}, args.shell)
+        return
+    if args.use_daemon and not (args.show or args.render or lists_files or
+                                finds_apps or args.probe or args.batch):
+        import setapp_daemon
+        with Span('daemon request'):
+            reply = setapp_daemon.request(args)
+        if reply is not None:
+            sys.stdout.write(reply['output'])
+            if reply['delta'] is not None:
+                write_dotfile(reply['delta'], args.shell)
+            return
+
+    with Span('load catalog'):
+        app_data = load_app_data(verbose=args.verbose, infile=args.infile,
+                                 use_cache=args.use_cache,
+                                 rebuild=args.rebuild_cache)
+    if args.debug:
+        print(f'catalog cache : {Cache_Status} ({cache_file(args.infile)})')
+    if args.batch:
+        import setapp_batch
+        sys.exit(setapp_batch.run(args, app_data))
+    if args.show:
+        print_app(app_data, args.show, verbose=args.verbose)
+        return
+    if args.render:
+        import setapp_render
+        n_new, n_same, n_gone = setapp_render.render(app_data, args.render,
+                                                     verbose=args.verbose,
+                                                     infile=args.infile)
+        print(f'{args.render}: {n_new} entries rendered, {n_same} '
+              f'unchanged, {n_gone} removed')
+        return
+
+    set_this_os()
+    if args.probe:
+        import setapp_probe
+        sys.exit(setapp_probe.run(args, Resolved(app_data, This_OS)))
+    if finds_apps:
+        import setapp_search
+        sys.exit(setapp_search.run(args, app_data))
+    if lists_files:
+        import setapp_provides
+        sys.exit(setapp_provides.run(args, Resolved(app_data, This_OS)))
+    index = Resolved(app_data, This_OS)
+    with Span('run command'):
+        delta_Env = run_command(args, index)
+    if Usage is not None:
+        Usage['apps'] = []
+        for A in args.applications:
+            app, ver, err = index.lookup(A)
+            Usage['apps'].append(A if err else f'{app}/{ver}')
+    if delta_Env is not None:
+        write_dotfile(delta_Env, args.shell)
+# }}}
+if __name__ == "__main__": main()
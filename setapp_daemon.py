@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+"""
+Resident per-user setapp daemon (setapp --serve) and its client.
+
+The daemon keeps the validated catalog, OS_alias, This_OS and the
+catalog resolved for This_OS in memory and answers
+getapp/remove/explain/add requests over a Unix domain socket.  A
+request is one line of JSON carrying the command line arguments and
+the client's environment; the reply is one line of JSON with the
+text the command printed and the environment delta (the same
+dictionary add_app() returns in process).  The client only uses a
+socket that, like its directory, is the user's own and closed to
+everyone else, see private().
+
+The catalog files are watched: a background thread polls their
+mtimes and every request re-checks them, so edits to
+Setapp_inputs.yaml or ~/.config/setapp/inputs.yaml take effect on
+the next request.
+"""
+import sys
+import os
+import setapp_core as SA
+
+PROTOCOL   = 1
+POLL_SEC   = 2.0     # how often the watcher thread stats the catalog
+TIMEOUT    = 5.0     # client gives up and runs in process after this
+# argument fields the daemon needs to reproduce a command
+Request_Fields = [ 'applications', 'getapp', 'remove', 'explain',
+                   'shell', 'verbose', 'check_paths', ]
+
+def socket_path(infile=None):                               # {{{
+    """
+    One socket per user and primary catalog file.
+    """
+    run_dir = os.environ.get('XDG_RUNTIME_DIR') or \
+              f'/tmp/setapp-{os.getuid()}'
+    tag = os.path.basename(SA.cache_file(infile))   # catalog-XXXXXXXX.marshal
+    return os.path.join(run_dir, f'setapp-{tag[8:16]}.sock')
+# }}}
+def private(path, is_dir):                                  # {{{
+    """
+    True if path (not followed if a symlink) is a directory, or a
+    socket, owned by this user that no one else may use.  Otherwise
+    another user could stand in for the daemon, read the client's
+    environment and write the dotfile its shell sources.
+    """
+    import stat
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    kind = stat.S_ISDIR if is_dir else stat.S_ISSOCK
+    return kind(st.st_mode) and st.st_uid == os.getuid() and \
+           not st.st_mode & 0o077
+# }}}
+def layers(infile=None):                                    # {{{
+    return [ os.path.abspath(F) for F in SA.catalog_files(infile) ]
+# }}}
+def request(args):                                          # {{{
+    """
+    Send the command in args to a running daemon.  Returns the
+    decoded reply, or None if there is no daemon (or it failed) in
+    which case the caller should do the work itself.
+    """
+    Sock = socket_path(args.infile)
+    if not os.path.exists(Sock):
+        return None
+    if not (private(os.path.dirname(Sock), True) and private(Sock, False)):
+        if args.verbose:
+            print(f'setapp daemon at {Sock} is not private to this user, '
+                  f'running in process', file=sys.stderr)
+        return None
+    import json
+    import socket
+    msg = { 'protocol' : PROTOCOL,
+            'infile'   : os.path.abspath(args.infile) if args.infile else None,
+            'layers'   : layers(args.infile),
+            'environ'  : dict(os.environ), }
+    for k in Request_Fields:
+        msg[k] = getattr(args, k)
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.settimeout(TIMEOUT)
+            s.connect(Sock)
+            s.sendall(json.dumps(msg).encode() + b'\n')
+            with s.makefile('rb') as fh:
+                reply = json.loads(fh.readline())
+    except (OSError, ValueError) as e:
+        if args.verbose:
+            print(f'setapp daemon at {Sock} unusable ({e}), '
+                  f'running in process', file=sys.stderr)
+        return None
+    if 'error' in reply:
+        if args.verbose:
+            print(f'setapp daemon: {reply["error"]}', file=sys.stderr)
+        return None
+    return reply
+# }}}
+class Catalog:                                              # {{{
+    """
+    The in-memory catalog plus what's needed to notice that
+    its source files changed.
+    """
+    def __init__(self, infile, verbose=0):
+        self.infile  = infile
+        self.verbose = verbose
+        self.load()
+
+    def signature(self):
+        sig = []
+        for File in SA.expand_catalog(SA.catalog_files(self.infile)):
+            try:
+                st = os.stat(File)
+                sig.append( (File, st.st_mtime_ns, st.st_size) )
+            except OSError:
+                sig.append( (File, None, None) )
+        return sig
+
+    def load(self):
+        sig           = self.signature()
+        self.app_data = SA.load_app_data(verbose=self.verbose,
+                                         infile=self.infile)
+        SA.set_this_os()
+        self.index    = SA.Resolved(self.app_data, SA.This_OS)
+        self.sig      = sig
+        if self.verbose:
+            print(f'setapp daemon: loaded catalog ({SA.Cache_Status}) '
+                  f'for {SA.This_OS}', file=sys.stderr)
+
+    def refresh(self):
+        if self.signature() != self.sig:
+            self.load()
+# }}}
+def handle(Cat, lock, msg):                                 # {{{
+    """
+    Run one decoded request; returns the reply dictionary.
+    """
+    import io
+    import contextlib
+
+    class Args: pass
+    args = Args()
+    args.__dict__.update(SA.Quick_Defaults)
+    for k in Request_Fields:
+        if k in msg:
+            setattr(args, k, msg[k])
+    args.infile = Cat.infile
+
+    if msg.get('protocol') != PROTOCOL:
+        return { 'error' : f'protocol {msg.get("protocol")} != {PROTOCOL}' }
+    if msg.get('infile') != (os.path.abspath(Cat.infile)
+                             if Cat.infile else None):
+        return { 'error' : 'daemon serves a different catalog' }
+    if msg.get('layers') != layers(Cat.infile):
+        return { 'error' : 'daemon serves different catalog layers '
+                           '($SETAPP_PATH differs)' }
+
+    out = io.StringIO()
+    with lock:  # This_OS, OS_alias and sys.stdout are process-wide
+        Cat.refresh()
+        with contextlib.redirect_stdout(out):
+            delta = SA.run_command(args, Cat.index,
+                                   environ=msg.get('environ', {}))
+    return { 'output' : out.getvalue(), 'delta' : delta }
+# }}}
+def serve(args):                                            # {{{
+    """
+    Run the daemon in the foreground until interrupted.
+    """
+    import json
+    import socket
+    import socketserver
+    import threading
+
+    Sock = socket_path(args.infile)
+    os.makedirs(os.path.dirname(Sock), mode=0o700, exist_ok=True)
+    if not private(os.path.dirname(Sock), True):
+        print(f'{os.path.dirname(Sock)} must be a directory only you '
+              f'can use (mode 700)')
+        sys.exit(1)
+    if os.path.exists(Sock):
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+                s.connect(Sock)
+            print(f'a setapp daemon is already listening on {Sock}')
+            sys.exit(1)
+        except OSError:
+            os.unlink(Sock)     # left behind by a daemon that died
+
+    lock = threading.Lock()
+    Cat  = Catalog(args.infile, verbose=args.verbose)
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            try:
+                msg   = json.loads(self.rfile.readline())
+                reply = handle(Cat, lock, msg)
+            except SystemExit:
+                reply = { 'error' : 'command exited' }
+            except Exception as e:
+                reply = { 'error' : f'{type(e).__name__}: {e}' }
+            self.wfile.write(json.dumps(reply).encode() + b'\n')
+
+    def watch():
+        import time
+        while True:
+            time.sleep(POLL_SEC)
+            with lock:
+                try:
+                    Cat.refresh()
+                except SystemExit:
+                    # a bad edit to the catalog; keep serving the last
+                    # good copy and try again on the next poll
+                    pass
+
+    class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    old_umask = os.umask(0o077)
+    server = Server(Sock, Handler)
+    os.umask(old_umask)
+    threading.Thread(target=watch, daemon=True).start()
+
+    import signal
+    signal.signal(signal.SIGTERM, lambda *a: sys.exit(0))
+    print(f'setapp daemon listening on {Sock}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(Sock):
+            os.unlink(Sock)
+# }}}
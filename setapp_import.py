@@ -0,0 +1,643 @@
+#!/usr/bin/env python
+"""
+Convert an Environment Modules / Lmod tree into a setapp catalog
+directory (setapp --import-modules TREE [--import-dir DIR]
+[--import-os OS]).
+
+TREE/APP/VERSION is a Tcl modulefile (starting "#%Module") or
+TREE/APP/VERSION.lua an Lmod one.  These directives are converted,
+in the order they appear, into the version's entry for OS:
+    prepend-path VAR DIR      prepend_path("VAR", DIR)    VAR+ : DIR
+    append-path VAR DIR       append_path("VAR", DIR)     VAR : DIR
+    setenv VAR VALUE          setenv / pushenv            VAR! : VALUE
+    set-alias NAME VALUE      set_alias(NAME, VALUE)      alias_sh, alias_csh
+    set-function NAME BODY    set_shell_function(NAME, BODY, ...)  function_def
+    module-whatis TEXT        whatis(TEXT)                the app's help
+along with Tcl "set" and Lua "local" variables, $env(VAR) and
+os.getenv("VAR") (left for the shell as ${VAR}), pathJoin(),
+myModuleName() and myModuleVersion().  Anything else (module load,
+conflict, if, ...) is reported with its file and line and skipped.
+The default version comes from .version, .modulerc(.lua) or an Lmod
+"default" symlink, else it is the newest (SA.version_key).
+
+DIR gets one APP.yaml per application, usable as a catalog layer
+(e.g. in $SETAPP_PATH), rewritten only when its text changes.  What
+was parsed is kept in DIR/.import-OS.marshal with each modulefile's
+mtime and size so a re-run parses only the files that changed; runs
+for other OSes (from their own trees) share DIR and their entries
+are merged into the same APP.yaml files.  When enough modulefiles
+changed they are parsed in a process pool, application by
+application, and each APP.yaml is written as its results arrive.
+"""
+import sys
+import os
+import setapp_core as SA
+
+IMPORT_FORMAT = 1     # bump when the state file layout changes
+POOL_FILES    = 200   # fewest changed modulefiles worth a process pool
+
+class Unconvertible(Exception):
+    pass
+
+def state_file(Dir, OS):                                    # {{{
+    return os.path.join(Dir, f'.import-{OS}.marshal')
+# }}}
+def read_state(Path):                                       # {{{
+    import marshal
+    try:
+        with open(Path, 'rb') as fh:
+            state = marshal.loads(fh.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if not isinstance(state, dict) or \
+       state.get('format') != IMPORT_FORMAT or \
+       state.get('python') != sys.version_info[:2]:
+        return None
+    return state
+# }}}
+def modulefiles(Tree):                                      # {{{
+    """
+    { app : { path : (version, kind) } } and { app : default or None }
+    for the modulefiles under Tree; kind is 'tcl' or 'lua'.  Tcl
+    files are only recognized by their "#%Module" line, so every
+    candidate is opened.
+    """
+    found, defaults = {}, {}
+    with os.scandir(Tree) as it:
+        app_dirs = sorted( (E for E in it
+                            if E.is_dir() and not E.name.startswith('.')),
+                           key=lambda E: E.name )
+    for A in app_dirs:
+        files, default = {}, None
+        for Dir, dirs, names in os.walk(A.path, followlinks=True):
+            dirs[:] = sorted(D for D in dirs if not D.startswith('.'))
+            for name in sorted(names):
+                P = os.path.join(Dir, name)
+                if Dir == A.path and name in ('.version', '.modulerc',
+                                              '.modulerc.lua'):
+                    default = default_version(P, A.name) or default
+                    continue
+                if Dir == A.path and name == 'default' and os.path.islink(P):
+                    default = os.path.basename(os.readlink(P))
+                    default = default[:-4] if default.endswith('.lua') else default
+                    continue
+                if name.startswith('.'):
+                    continue
+                ver = os.path.relpath(P, A.path)
+                if ver.endswith('.lua'):
+                    files[P] = (ver[:-4], 'lua')
+                elif is_tcl_modulefile(P):
+                    files[P] = (ver, 'tcl')
+        if files:
+            found[A.name], defaults[A.name] = files, default
+    return found, defaults
+# }}}
+def is_tcl_modulefile(P):                                   # {{{
+    try:
+        with open(P, 'rb') as fh:
+            return fh.read(8) == b'#%Module'
+    except OSError:
+        return False
+# }}}
+def default_version(P, app):                                # {{{
+    """
+    The default set by a .version or .modulerc(.lua) file, or None.
+    """
+    import re
+    try:
+        with open(P, errors='replace') as fh:
+            text = fh.read()
+    except OSError:
+        return None
+    for pattern in (r'set\s+ModulesVersion\s+"?([^\s"]+)"?',
+                    r'module-version\s+"?([^\s"]+)"?\s+.*\bdefault\b',
+                    r'module_version\s*\(\s*"([^"]+)"\s*,\s*"default"'):
+        m = re.search(pattern, text)
+        if m:
+            ver = m.group(1)
+            if ver.startswith(app + '/'):
+                ver = ver[len(app) + 1:]
+            return ver.lstrip('/')
+    return None
+# }}}
+class Entry:                                                # {{{
+    """
+    The setapp OS entry a modulefile converts to, built up one
+    directive at a time.
+    """
+    def __init__(self):
+        self.env, self.alias, self.functions = [], [], []
+        self.whatis, self.problems = [], []
+
+    def path(self, var, value, verb, sep=None):
+        """
+        prepend (verb '+') or append (verb '') each element of value.
+        """
+        if sep and sep != (SA.list_separator(var) or ':'):
+            raise Unconvertible(f'{var} is not a "{sep}" separated list '
+                                f'(see List_vars)')
+        sep   = sep or SA.list_separator(var) or ':'
+        items = [ V for V in str(value).split(sep) if V ]
+        if verb == '+':
+            items.reverse()     # setapp prefixes one at a time
+        self.env.extend( { f'{var}{verb}' : V } for V in items )
+
+    def setenv(self, var, value):
+        self.env.append( { f'{var}!' : str(value) } )
+
+    def result(self):
+        entry = {}
+        if self.env:
+            entry['env'] = self.env
+        if self.alias:
+            entry['alias_sh']  = self.alias
+            entry['alias_csh'] = [ dict(A) for A in self.alias ]
+        if self.functions:
+            entry['function_def'] = self.functions
+        return entry
+# }}}
+def tcl_commands(text):                                     # {{{
+    """
+    Yield (line, command) for each Tcl command in text, joining
+    backslash continuations and lines inside open braces.
+    """
+    buf, start = '', None
+    for n, line in enumerate(text.splitlines(), 1):
+        if not buf and (not line.strip() or line.lstrip().startswith('#')):
+            continue
+        if start is None:
+            start = n
+        buf = f'{buf}\n{line}' if buf else line
+        if buf.endswith('\\'):
+            buf = buf[:-1] + ' '
+            continue
+        if brace_depth(buf) > 0:
+            continue
+        yield start, buf.strip()
+        buf, start = '', None
+    if buf:
+        yield start, buf.strip()
+# }}}
+def brace_depth(text):                                      # {{{
+    depth, i = 0, 0
+    while i < len(text):
+        c = text[i]
+        if c == '\\':
+            i += 1
+        elif c == '{':
+            depth += 1
+        elif c == '}':
+            depth -= 1
+        i += 1
+    return depth
+# }}}
+def tcl_words(cmd):                                         # {{{
+    """
+    Split a Tcl command into [(word, braced), ...].
+    """
+    words, i, n = [], 0, len(cmd)
+    while i < n:
+        c = cmd[i]
+        if c.isspace():
+            i += 1
+        elif c == '{':
+            depth, j = 1, i + 1
+            while j < n and depth:
+                if cmd[j] == '\\':
+                    j += 1
+                elif cmd[j] == '{':
+                    depth += 1
+                elif cmd[j] == '}':
+                    depth -= 1
+                j += 1
+            if depth:
+                raise Unconvertible('missing close-brace')
+            words.append( (cmd[i+1:j-1], True) )
+            i = j
+        elif c == '"':
+            buf, j = [], i + 1
+            while j < n and cmd[j] != '"':
+                if cmd[j] == '\\' and j + 1 < n:
+                    j += 1
+                buf.append(cmd[j])
+                j += 1
+            words.append( (''.join(buf), False) )
+            i = j + 1
+        else:
+            depth, j = 0, i
+            while j < n and (depth or not cmd[j].isspace()):
+                if cmd[j] == '[':
+                    depth += 1
+                elif cmd[j] == ']':
+                    depth -= 1
+                j += 1
+            words.append( (cmd[i:j], False) )
+            i = j
+    return words
+# }}}
+def tcl_subst(word, braced, local):                         # {{{
+    """
+    word with $var, ${var} and $env(VAR) substituted; environment
+    variables are left for the shell as ${VAR}.
+    """
+    import re
+    if braced:
+        return word
+    if '[' in word:
+        raise Unconvertible(f'command substitution in "{word}"')
+
+    def value(m):
+        env, name = m.group(1), m.group(2) or m.group(3)
+        if env:
+            return f'${{{env}}}'
+        if name not in local:
+            raise Unconvertible(f'unknown variable ${name}')
+        return local[name]
+    return re.sub(r'\$(?:::)?env\((\w+)\)|\$\{(\w+)\}|\$(\w+)', value, word)
+# }}}
+def parse_tcl(text, app, ver):                              # {{{
+    E     = Entry()
+    local = { 'ModulesCurrentModulefile' : f'{app}/{ver}' }
+    for line, cmd in tcl_commands(text):
+        try:
+            words = tcl_words(cmd)
+            verb  = words[0][0]
+            if verb == 'proc' and len(words) > 1 and words[1][0] == 'ModulesHelp':
+                continue
+            args = [ tcl_subst(W, B, local) for W, B in words[1:] ]
+            opts = {}
+            while args and args[0].startswith('-') and \
+                  verb in ('prepend-path', 'append-path'):
+                flag = args.pop(0)
+                if flag in ('-d', '--delim') and args:
+                    opts['sep'] = args.pop(0)
+                elif flag != '--duplicates':
+                    raise Unconvertible(f'{verb} option {flag}')
+            if verb == 'set' and len(args) == 2:
+                local[args[0]] = args[1]
+            elif verb in ('prepend-path', 'append-path') and len(args) >= 2:
+                for V in args[1:]:
+                    E.path(args[0], V, '+' if verb == 'prepend-path' else '',
+                           opts.get('sep'))
+            elif verb == 'setenv' and len(args) == 2:
+                E.setenv(*args)
+            elif verb == 'set-alias' and len(args) == 2:
+                E.alias.append( { args[0] : args[1] } )
+            elif verb == 'set-function' and len(args) == 2:
+                E.functions.append( { args[0] : args[1].strip() } )
+            elif verb == 'module-whatis' and args:
+                E.whatis.append(' '.join(args))
+            else:
+                raise Unconvertible(f'"{verb}" is not converted')
+        except Unconvertible as e:
+            E.problems.append( (line, str(e)) )
+    return E
+# }}}
+def lua_tokens(text):                                       # {{{
+    """
+    [(kind, value, line), ...] with kind 'str', 'num', 'name' or 'op';
+    comments are dropped.
+    """
+    import re
+    token = re.compile(r'''
+        (?P<ws>\s+) |
+        (?P<comment>--\[(?P<ceq>=*)\[.*?\](?P=ceq)\] | --[^\n]*) |
+        (?P<long>\[(?P<leq>=*)\[.*?\](?P=leq)\]) |
+        (?P<str>"(?:\\.|[^"\\])*" | '(?:\\.|[^'\\])*') |
+        (?P<num>\d+(?:\.\d+)?) |
+        (?P<name>[A-Za-z_][\w.:]*) |
+        (?P<op>\.\.|==|~=|<=|>=|.)''', re.S | re.X)
+    toks, line = [], 1
+    for m in token.finditer(text):
+        kind, value = m.lastgroup, m.group()
+        if kind in ('ceq', 'leq'):
+            kind = 'comment' if value.startswith('--') else 'long'
+        if kind == 'long':
+            body = value[value.index('[', 1) + 1:value.rindex(']', 0, -1)]
+            toks.append( ('str', body.lstrip('\n'), line) )
+        elif kind == 'str':
+            toks.append( ('str', re.sub(r'\\(u\{[0-9a-fA-F]+\}|'
+                                        r'x[0-9a-fA-F]{2}|\d{1,3}|.)',
+                                        lua_escape, value[1:-1], flags=re.S),
+                          line) )
+        elif kind in ('num', 'name', 'op'):
+            toks.append( (kind, value, line) )
+        line += value.count('\n')
+    return toks
+# }}}
+def lua_escape(m):                                          # {{{
+    E = m.group(1)
+    if E[0] == 'u':
+        return chr(int(E[2:-1], 16))
+    if E[0] == 'x':
+        return chr(int(E[1:], 16))
+    if E.isdigit():
+        return chr(int(E))
+    return { 'n' : '\n', 't' : '\t', 'r' : '\r', 'a' : '\a', 'b' : '\b',
+             'f' : '\f', 'v' : '\v', '\n' : '\n' }.get(E, E)
+# }}}
+class LuaModule:                                            # {{{
+    """
+    Interpret the statements of an Lmod modulefile that convert.
+    """
+    Openers = { 'function', 'if', 'do', 'repeat' }
+    Closers = { 'end', 'until' }
+
+    def __init__(self, text, app, ver):
+        self.toks  = lua_tokens(text)
+        self.app   = app
+        self.ver   = ver
+        self.local = {}
+        self.E     = Entry()
+
+    def skip_block(self, i):
+        """
+        Index after the block statement starting at i.
+        """
+        depth = 0
+        while i < len(self.toks):
+            kind, value, line = self.toks[i]
+            if kind == 'name' and value in self.Openers:
+                depth += 1
+            elif kind == 'name' and value in self.Closers:
+                depth -= 1
+                if depth <= 0:
+                    return i + 1
+            i += 1
+        return i
+
+    def call_end(self, i):
+        """
+        Index after the parenthesized arguments starting at i.
+        """
+        depth = 0
+        while i < len(self.toks):
+            if self.toks[i][1] == '(' and self.toks[i][0] == 'op':
+                depth += 1
+            elif self.toks[i][1] == ')' and self.toks[i][0] == 'op':
+                depth -= 1
+                if depth == 0:
+                    return i + 1
+            i += 1
+        return i
+
+    def expr(self, i):
+        """
+        (value, next index) of the expression starting at i.
+        """
+        value, i = self.term(i)
+        while i < len(self.toks) and self.toks[i][:2] == ('op', '..'):
+            more, i = self.term(i + 1)
+            value += more
+        return value, i
+
+    def term(self, i):
+        if i >= len(self.toks):
+            raise Unconvertible('unexpected end of file')
+        kind, value, line = self.toks[i]
+        if kind in ('str', 'num'):
+            return str(value), i + 1
+        if kind == 'name' and i + 1 < len(self.toks) and \
+           self.toks[i + 1][:2] == ('op', '('):
+            args, j = self.args(i + 1)
+            if value == 'pathJoin':
+                return '/'.join(A.rstrip('/') for A in args if A), j
+            if value == 'os.getenv' and len(args) == 1:
+                return f'${{{args[0]}}}', j
+            if value == 'myModuleName':
+                return self.app, j
+            if value == 'myModuleVersion':
+                return self.ver, j
+            if value == 'myModuleFullName':
+                return f'{self.app}/{self.ver}', j
+            raise Unconvertible(f'call to {value}()')
+        if kind == 'name' and value in self.local:
+            return self.local[value], i + 1
+        raise Unconvertible(f'"{value}" is not converted')
+
+    def args(self, i):
+        """
+        ([values], next index) of "( expr, ... )" starting at i.
+        """
+        args, i = [], i + 1
+        if i < len(self.toks) and self.toks[i][:2] == ('op', ')'):
+            return args, i + 1
+        while True:
+            value, i = self.expr(i)
+            args.append(value)
+            if i >= len(self.toks):
+                raise Unconvertible('unexpected end of file')
+            if self.toks[i][:2] == ('op', ')'):
+                return args, i + 1
+            if self.toks[i][:2] != ('op', ','):
+                raise Unconvertible(f'"{self.toks[i][1]}" is not converted')
+            i += 1
+
+    def run(self):
+        E, toks, i = self.E, self.toks, 0
+        while i < len(toks):
+            kind, value, line = toks[i]
+            start = i
+            try:
+                if kind == 'name' and value == 'local' and \
+                   i + 1 < len(toks) and toks[i + 1][1] == 'function':
+                    i = self.skip_block(i + 1)
+                    raise Unconvertible('"local function" is not converted')
+                if kind == 'name' and value == 'local':
+                    name = toks[i + 1][1] if i + 1 < len(toks) else ''
+                    i += 2
+                    if i < len(toks) and toks[i][:2] == ('op', '='):
+                        self.local[name], i = self.expr(i + 1)
+                    continue
+                if kind == 'name' and value in self.Openers | {'for', 'while'}:
+                    i = self.skip_block(i)
+                    raise Unconvertible(f'"{value}" block is not converted')
+                if kind == 'name' and i + 1 < len(toks) and \
+                   toks[i + 1][:2] == ('op', '('):
+                    i = self.call_end(i + 1)
+                    if value != 'help':
+                        self.directive(value, self.args(start + 1)[0])
+                    continue
+                raise Unconvertible(f'"{value}" is not converted')
+            except Unconvertible as e:
+                E.problems.append( (line, str(e)) )
+                # resume at the next line
+                i = max(i, start + 1)
+                while i < len(toks) and toks[i][2] == line:
+                    i += 1
+        return E
+
+    def directive(self, name, args):
+        E = self.E
+        if name in ('prepend_path', 'append_path') and len(args) in (2, 3):
+            E.path(args[0], args[1], '+' if name == 'prepend_path' else '',
+                   args[2] if len(args) == 3 else None)
+        elif name in ('setenv', 'pushenv') and len(args) == 2:
+            E.setenv(*args)
+        elif name == 'set_alias' and len(args) == 2:
+            E.alias.append( { args[0] : args[1] } )
+        elif name == 'set_shell_function' and len(args) >= 2:
+            E.functions.append( { args[0] : args[1].strip() } )
+        elif name == 'whatis' and len(args) == 1:
+            E.whatis.append(args[0])
+        else:
+            raise Unconvertible(f'{name}() is not converted')
+# }}}
+def parse_file(task):                                       # {{{
+    """
+    task = (path, app, ver, kind) -> (path, entry, whatis, problems)
+    """
+    path, app, ver, kind = task
+    try:
+        with open(path, errors='replace') as fh:
+            text = fh.read()
+    except OSError as e:
+        return path, None, '', [ (0, f'unreadable: {e.strerror}') ]
+    E = parse_tcl(text, app, ver) if kind == 'tcl' else \
+        LuaModule(text, app, ver).run()
+    return path, E.result(), '; '.join(E.whatis), E.problems
+# }}}
+def parse_app(tasks):                                       # {{{
+    return [ parse_file(T) for T in tasks ]
+# }}}
+def app_yaml(app, states):                                  # {{{
+    """
+    The text of APP.yaml from the import states of every OS, or None
+    if no state has a version of app.
+    """
+    import yaml
+    versions, whatis, default = {}, {}, None
+    for OS, state in sorted(states.items()):
+        for path, (mtime, size, A, ver, entry, what, problems) in \
+                sorted(state['files'].items()):
+            if A != app or entry is None:
+                continue
+            versions.setdefault(ver, {})[OS] = entry
+            if what:
+                whatis[ver] = what
+        default = state['defaults'].get(app) or default
+    if not versions:
+        return None
+    if default not in versions:
+        default = max(versions, key=SA.version_key)
+    data = { 'name' : app }
+    if default in whatis or whatis:
+        data['help'] = whatis.get(default) or next(iter(whatis.values()))
+    data['default'] = default
+    data['ver'] = { V : versions[V] for V in
+                    sorted(versions, key=SA.version_key, reverse=True) }
+    header = '# converted from modulefiles by setapp --import-modules; ' \
+             'changes are overwritten\n'
+    return header + yaml.safe_dump({ app : data }, sort_keys=False,
+                                   default_flow_style=False, width=1000,
+                                   allow_unicode=True)
+# }}}
+def write_shard(Dir, app, text):                            # {{{
+    """
+    Write (or with text None remove) Dir/app.yaml unless it already
+    holds text; returns True if the file changed.
+    """
+    Path = os.path.join(Dir, f'{app}.yaml')
+    try:
+        with open(Path) as fh:
+            if fh.read() == text:
+                return False
+    except OSError:
+        if text is None:
+            return False
+    if text is None:
+        os.unlink(Path)
+        return True
+    tmp = f'{Path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as fh:
+        fh.write(text)
+    os.replace(tmp, Path)
+    return True
+# }}}
+def run(args):                                              # {{{
+    """
+    Handle --import-modules.  Returns the exit status.
+    """
+    import glob
+    Tree, Dir = args.import_modules, args.import_dir
+    if not os.path.isdir(Tree):
+        print(f'{Tree} is not a directory')
+        return 1
+    OS = args.import_os
+    if OS is None:
+        SA.load_app_data(verbose=args.verbose, infile=args.infile,
+                         use_cache=args.use_cache)
+        SA.set_this_os()
+        OS = SA.This_OS
+    os.makedirs(Dir, exist_ok=True)
+
+    found, defaults = modulefiles(Tree)
+    states = {}
+    for P in glob.glob(os.path.join(Dir, '.import-*.marshal')):
+        S = read_state(P)
+        if S is not None:
+            states[os.path.basename(P)[8:-8]] = S
+    old = states.get(OS) or { 'files' : {}, 'defaults' : {} }
+    state = { 'format' : IMPORT_FORMAT, 'python' : sys.version_info[:2],
+              'tree'   : os.path.abspath(Tree),
+              'files' : {}, 'defaults' : defaults }
+    states[OS] = state
+
+    tasks, dirty = {}, set()       # app -> [ (path, app, ver, kind) ]
+    for app, files in found.items():
+        if defaults[app] != old['defaults'].get(app):
+            dirty.add(app)
+        for path, (ver, kind) in files.items():
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            prev = old['files'].get(path)
+            if prev and prev[:4] == (st.st_mtime_ns, st.st_size, app, ver):
+                state['files'][path] = prev
+            else:
+                tasks.setdefault(app, []).append( (path, app, ver, kind) )
+                state['files'][path] = (st.st_mtime_ns, st.st_size, app, ver,
+                                        None, '', [])
+    gone = { V[2] for P, V in old['files'].items() if P not in state['files'] }
+    dirty |= gone | (set(old['defaults']) - set(found))
+
+    n_files   = sum(len(T) for T in tasks.values())
+    n_written = 0
+    jobs = os.cpu_count() or 1
+    work = list(tasks.values())
+    if n_files >= POOL_FILES and jobs > 1:
+        import concurrent.futures
+        pool    = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+        results = pool.map(parse_app, work,
+                           chunksize=max(1, len(work) // (8*jobs)))
+    else:
+        pool, results = None, map(parse_app, work)
+    try:
+        for parsed in results:
+            for path, entry, what, problems in parsed:
+                state['files'][path] = state['files'][path][:4] + \
+                                       (entry, what, problems)
+                for line, msg in problems:
+                    print(f'{path}:{line}: {msg}')
+            app = state['files'][parsed[0][0]][2]
+            dirty.discard(app)
+            n_written += write_shard(Dir, app, app_yaml(app, states))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    for app in sorted(dirty):
+        n_written += write_shard(Dir, app, app_yaml(app, states))
+
+    try:
+        SA.write_cache(state_file(Dir, OS), state)
+    except (OSError, ValueError) as e:
+        print(f'import state not saved: {e}')
+    n_total    = sum(len(F) for F in found.values())
+    n_problems = sum(len(V[6]) for V in state['files'].values())
+    print(f'{n_total} modulefiles in {len(found)} applications for {OS}: '
+          f'{n_files} parsed, {n_total - n_files} unchanged; '
+          f'{n_problems} constructs not converted; '
+          f'{n_written} files in {Dir} updated')
+    return 0
+# }}}
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+"""
+Existence checks for the directories and files applications put in
+the environment (setapp --check-paths warn|drop|fail, and
+--validate --check-paths).
+
+Each path is stat'ed in one of THREADS daemon threads.  A path that
+hasn't answered TIMEOUT seconds after its stat started is reported
+as slow; once every thread is stuck on a slow path the rest are
+given up on too, so a hung NFS mount costs at most TIMEOUT seconds
+and the threads left behind don't keep the interpreter from exiting.
+Answers, slow ones included, are kept for STAT_TTL seconds in
+SETAPP_CACHE_DIR/stat-cache.marshal which every invocation shares,
+so a login that loads twenty applications from one dead mount waits
+once.
+"""
+import sys
+import os
+import setapp_core as SA
+
+THREADS  = 8      # concurrent stats
+TIMEOUT  = 2.0    # seconds before a path counts as slow
+STAT_TTL = 300    # seconds a cached answer is reused
+
+def cache_path():                                           # {{{
+    return os.path.join(SA.SETAPP_CACHE_DIR, 'stat-cache.marshal')
+# }}}
+def read_stat_cache(now):                                   # {{{
+    """
+    { path : (checked_at, status) } for the answers still fresh.
+    """
+    import marshal
+    try:
+        with open(cache_path(), 'rb') as fh:
+            cached = marshal.loads(fh.read())
+        return { p : v for p, v in cached.items() if now - v[0] < STAT_TTL }
+    except (OSError, EOFError, ValueError, TypeError, AttributeError):
+        return {}
+# }}}
+def write_stat_cache(answers, now):                         # {{{
+    """
+    Merge answers into the shared cache; a concurrent writer's
+    entries survive unless this one has newer answers.
+    """
+    cached = read_stat_cache(now)
+    cached.update(answers)
+    try:
+        os.makedirs(SA.SETAPP_CACHE_DIR, exist_ok=True)
+        SA.write_cache(cache_path(), cached)
+    except (OSError, ValueError):
+        pass
+# }}}
+def stat_one(path):                                         # {{{
+    try:
+        os.stat(path)
+        return 'ok'
+    except FileNotFoundError:
+        return 'missing'
+    except NotADirectoryError:
+        return 'missing'
+    except OSError as e:
+        return f'unreadable ({e.strerror})'
+# }}}
+def stat_paths(paths, timeout=TIMEOUT, threads=THREADS):    # {{{
+    """
+    { path : 'ok' | 'missing' | 'slow' | 'unreadable (...)' } for
+    paths, stat'ed concurrently without the cache.
+    """
+    import queue
+    import threading
+    import time
+    todo = queue.SimpleQueue()
+    for P in paths:
+        todo.put(P)
+    started, status = {}, {}
+    cond = threading.Condition()
+
+    def worker():
+        while True:
+            try:
+                P = todo.get_nowait()
+            except queue.Empty:
+                return
+            with cond:
+                started[P] = time.monotonic()
+            answer = stat_one(P)
+            with cond:
+                status[P] = answer
+                cond.notify()
+
+    n_threads = min(threads, len(paths))
+    for i in range(n_threads):
+        threading.Thread(target=worker, daemon=True).start()
+    with cond:
+        while len(status) < len(paths):
+            now     = time.monotonic()
+            running = [ started[P] for P in started if P not in status ]
+            overdue = [ t for t in running if now - t >= timeout ]
+            if running and len(overdue) == len(running) and \
+               (todo.empty() or len(running) == n_threads):
+                break       # every thread left is stuck
+            wait = min( (t + timeout - now for t in running
+                         if now - t < timeout), default=timeout )
+            cond.wait(timeout=max(wait, 0.001))
+        for P in paths:
+            status.setdefault(P, 'slow')
+    return dict(status)
+# }}}
+def check(paths, timeout=TIMEOUT, threads=THREADS):         # {{{
+    """
+    stat_paths() through the shared cache.
+    """
+    import time
+    now    = time.time()
+    cached = read_stat_cache(now)
+    status = { P : cached[P][1] for P in paths if P in cached }
+    todo   = [ P for P in dict.fromkeys(paths) if P not in status ]
+    if todo:
+        answers = stat_paths(todo, timeout=timeout, threads=threads)
+        status.update(answers)
+        write_stat_cache({ P : (now, S) for P, S in answers.items() }, now)
+    return status
+# }}}
+def path_values(var, value):                                # {{{
+    """
+    The absolute paths in one env setting of var, with ~ and
+    $VARS expanded; values that aren't paths (27000@license,
+    glnxa64, ...) or still hold an unset $VAR are skipped.
+    """
+    if not isinstance(value, str):
+        return []
+    sep   = SA.list_separator(var)
+    items = value.split(sep) if sep else [ value ]
+    paths = []
+    for item in items:
+        P = os.path.expandvars(os.path.expanduser(item))
+        if P.startswith('/') and '$' not in P:
+            paths.append(P)
+    return paths
+# }}}
+def describe(status):                                       # {{{
+    if status == 'slow':
+        return f'did not answer within {TIMEOUT:g} s'
+    if status == 'missing':
+        return 'does not exist'
+    return status
+# }}}
+def check_delta(index, app_ver_list, Old_Env,               # {{{
+                delta, mode):
+    """
+    Check the paths the applications in app_ver_list, and what they
+    require or bundle, contribute.  Problems are reported; with mode
+    "drop" the bad paths are taken out of delta (paths already in
+    Old_Env stay), with "fail" the return value is False and delta
+    must not be applied.
+    """
+    owners = {}   # path -> [(app_ver, var), ...]
+    for app_ver in SA.planned_apps(index, app_ver_list, Old_Env) or []:
+        app, ver, err = index.lookup(app_ver)
+        if err:
+            continue
+        for var, verb, value in index.tool(app, ver).env:
+            for P in path_values(var, value):
+                owners.setdefault(P, []).append( (f'{app}/{ver}', var) )
+    if not owners:
+        return True
+    status = check(list(owners))
+    bad = { P : S for P, S in status.items() if S != 'ok' }
+    for P, S in bad.items():
+        who = ', '.join(f'{A} {V}' for A, V in owners[P])
+        print(f'setapp: {P} ({who}) {describe(S)}')
+    if not bad:
+        return True
+    if mode == 'fail':
+        print(f'setapp: environment not changed, {len(bad)} path'
+              f'{"s"[:len(bad) != 1]} failed --check-paths')
+        return False
+    if mode == 'drop':
+        for var in list(delta):
+            if var in ('SETAPP_TOOLS', 'SETAPP_LEDGER') or not delta[var]:
+                continue        # unsets (eg of a swapped out tool) stand
+            old  = set(Old_Env.get(var, []))
+            kept = [ v for v in delta[var]
+                     if v in old or not path_values(var, v) or
+                        not all(P in bad for P in path_values(var, v)) ]
+            if kept:
+                delta[var] = kept
+            else:               # leave var as it was
+                del delta[var]
+    return True
+# }}}
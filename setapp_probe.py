@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+"""
+Health probes for the catalog (setapp --probe APP[/VER]|all).
+
+Each app/version is given the environment "setapp APP/VER" would
+leave, planned in process from the current environment (nothing is
+written to the dotfile), and its probe commands are run in it by
+/bin/sh.  The commands are the 'probe' entry, one command or a list,
+of the version's OS entry or else of the application:
+    matlab :
+      probe : [ matlab --version, mex --version ]
+A probe passes if it exits 0.  Up to JOBS run at once as asyncio
+subprocesses, each in its own process group so that one still
+running TIMEOUT seconds after it started is killed with everything
+it spawned.
+"""
+import sys
+import os
+import setapp_core as SA
+
+JOBS    = 16      # probes running at once
+TIMEOUT = 30.0    # seconds before a probe is killed
+Shown_Lines = 3   # lines of a failed probe's output in the report
+
+def probe_commands(index, tool):                            # {{{
+    cmds = tool.entry.get('probe', index.data[tool.app].get('probe', []))
+    return [ cmds ] if isinstance(cmds, str) else list(cmds)
+# }}}
+def targets(index, app_ver):                                # {{{
+    """
+    The app/versions to probe: app_ver alone if a version is given,
+    every version of the application on this OS if not, and every
+    version of everything for "all".  None after printing why if
+    app_ver is unusable.
+    """
+    if app_ver == 'all':
+        return [ tool.app_ver for app in sorted(index.data)
+                 for tool in (index.versions(app) or {}).values() ]
+    app, ver, err = index.lookup(app_ver)
+    if app is None or (err and '/' in app_ver):
+        print(err)
+        return None
+    if '/' in app_ver:
+        return [ f'{app}/{ver}' ]
+    tools = [ tool.app_ver for tool in index.versions(app).values() ]
+    if not tools:
+        print(f'{app} is not available for {index.OS}')
+        return None
+    return tools
+# }}}
+def probe_environ(index, app_ver, environ):                 # {{{
+    """
+    environ as it is after sourcing what "setapp app_ver" writes;
+    $VARS in the new values are expanded from environ as the shell
+    would.
+    """
+    import string
+    Old_Env = SA.get_current_env(environ)
+    ledger  = SA.read_ledger(index, Old_Env)
+    delta   = SA.swap_app(index, [ app_ver ], Old_Env, ledger) or {}
+    after   = SA.environ_after(environ, delta)
+    for var in delta:
+        if var in after:
+            after[var] = string.Template(after[var]).safe_substitute(environ)
+    return after
+# }}}
+async def run_probe(jobs, app_ver, command, env, timeout):  # {{{
+    """
+    Run one probe once a slot in jobs (an asyncio.Semaphore) is
+    free; returns its report entry.
+    """
+    import asyncio
+    import signal
+    import subprocess
+    import time
+    result = { 'tool' : app_ver, 'command' : command, 'exit' : None }
+    async with jobs:
+        t0 = time.perf_counter()
+        try:
+            proc = await asyncio.create_subprocess_shell(command, env=env,
+                       stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                       stderr=subprocess.STDOUT, start_new_session=True)
+            out, _ = await asyncio.wait_for(proc.communicate(), timeout)
+            result['exit']   = proc.returncode
+            result['status'] = 'pass' if proc.returncode == 0 else 'fail'
+            result['output'] = out.decode(errors='replace').strip()
+        except asyncio.TimeoutError:
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except OSError:
+                pass
+            await proc.wait()
+            result['status'] = 'timeout'
+            result['output'] = f'killed after {timeout:g} s'
+        except OSError as e:
+            result['status'] = 'fail'
+            result['output'] = str(e)
+        result['ms'] = 1000*(time.perf_counter() - t0)
+    return result
+# }}}
+def print_result(R):                                        # {{{
+    print(f"{R['status']:7s} {R['ms']:8.0f} ms  {R['tool']:24s} {R['command']}")
+    if R['status'] != 'pass':
+        for line in R['output'].splitlines()[-Shown_Lines:]:
+            print(f'{" " * 10}| {line}')
+# }}}
+async def run_probes(probes, jobs=JOBS, timeout=TIMEOUT,    # {{{
+                     show=None):
+    """
+    Run probes, [(app_ver, command, env), ...], concurrently and
+    return their report entries in the same order; show, if
+    given, is called with each entry as it completes.
+    """
+    import asyncio
+    slots = asyncio.Semaphore(jobs)
+    tasks = [ asyncio.ensure_future(run_probe(slots, T, C, E, timeout))
+              for T, C, E in probes ]
+    if show:
+        for done in asyncio.as_completed(tasks):
+            show(await done)
+    return [ await T for T in tasks ]
+# }}}
+def run(args, index):                                       # {{{
+    """
+    Handle --probe.  Returns the exit status: 1 if a probe failed
+    or timed out.
+    """
+    import asyncio
+    import time
+    tools = targets(index, args.probe)
+    if tools is None:
+        return 1
+    probes, untested = [], []
+    for app_ver in tools:
+        commands = probe_commands(index, index.tool(*app_ver.split('/', 1)))
+        if not commands:
+            untested.append(app_ver)
+            continue
+        env = probe_environ(index, app_ver, os.environ)
+        probes += [ (app_ver, C, env) for C in commands ]
+
+    t0 = time.perf_counter()
+    results = asyncio.run(run_probes(probes,
+                                     show=None if args.json else print_result))
+    wall = time.perf_counter() - t0
+    counts = { S : sum(R['status'] == S for R in results)
+               for S in ('pass', 'fail', 'timeout') }
+    if args.json:
+        import json
+        print(json.dumps({ 'OS' : index.OS, 'results' : results,
+                           'no_probe' : untested, 'seconds' : wall },
+                         indent=1))
+    else:
+        if args.verbose:
+            for app_ver in untested:
+                print(f'{"none":7s} {"":11s}  {app_ver}')
+        print(f'{len(results)} probes of {len(tools) - len(untested)} tools '
+              f'in {wall:.1f} s: {counts["pass"]} passed, {counts["fail"]} '
+              f'failed, {counts["timeout"]} timed out; {len(untested)} '
+              f'tools have no probe')
+    return 1 if counts['fail'] or counts['timeout'] else 0
+# }}}
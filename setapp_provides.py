@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+"""
+Index of the executables and man pages each application provides
+(setapp --show-bin, --show-man, --provides, --refresh-index).
+
+Every directory an app/version puts on PATH, and every MANPATH
+directory's man*/ subdirectories, are listed once and the names
+recorded in SETAPP_CACHE_DIR/provides-XXXXXXXX-OS.marshal along
+with the directory's mtime.  Queries are answered from that file
+alone; directories are only read when the catalog names one the
+index hasn't seen.  --refresh-index stats every directory and lists
+again the ones whose mtime changed.  Both the stats and the listings
+run in a thread pool since /usr/local is often on NFS where each
+one is a round trip.
+"""
+import sys
+import os
+import setapp_core as SA
+
+INDEX_FORMAT = 1    # bump when the layout of the index changes
+THREADS      = 16   # concurrent stats / directory listings
+Man_Suffixes = ('.gz', '.bz2', '.xz', '.Z')
+
+def index_file(infile, OS):                                 # {{{
+    tag = os.path.basename(SA.cache_file(infile))[8:16]
+    return os.path.join(SA.SETAPP_CACHE_DIR, f'provides-{tag}-{OS}.marshal')
+# }}}
+def compiled_stamp(infile):                                 # {{{
+    """
+    mtimes of the layers' compiled catalogs; each is rewritten
+    whenever its layer is recompiled so a different stamp means the
+    catalog may name new directories.  Unlike SA.catalog_stamp(),
+    which stats the catalog sources, this needs the catalog to have
+    been loaded.
+    """
+    try:
+        return tuple( os.stat(SA.cache_file(F)).st_mtime_ns
+                      for F in SA.catalog_files(infile) )
+    except OSError:
+        return None
+# }}}
+def tool_dirs(tool):                                        # {{{
+    """
+    Return (bin_dirs, man_dirs): the PATH and MANPATH directories
+    tool contributes, in the order its env entries list them.
+    """
+    dirs = { 'PATH' : [], 'MANPATH' : [] }
+    for var, verb, value in tool.env:
+        if var not in dirs or not isinstance(value, str):
+            continue
+        for D in value.split(SA.list_separator(var) or ':'):
+            D = os.path.expanduser(os.path.expandvars(D))
+            if D and D not in dirs[var]:
+                dirs[var].append(D)
+    return dirs['PATH'], dirs['MANPATH']
+# }}}
+def man_name(F):                                            # {{{
+    """
+    matlab.1.gz -> matlab(1)
+    """
+    for s in Man_Suffixes:
+        if F.endswith(s):
+            F = F[:-len(s)]
+            break
+    page, dot, section = F.rpartition('.')
+    return f'{page}({section})' if dot and page else F
+# }}}
+def scan_bin(D):                                            # {{{
+    """
+    (mtime_ns, names) of the executables in directory D;
+    mtime is None if D can't be read.
+    """
+    try:
+        mtime = os.stat(D).st_mtime_ns
+        names = []
+        with os.scandir(D) as it:
+            for E in it:
+                try:
+                    if E.is_file() and E.stat().st_mode & 0o111:
+                        names.append(E.name)
+                except OSError:
+                    pass
+    except OSError:
+        return None, ()
+    return mtime, tuple(sorted(names))
+# }}}
+def man_subdirs(D):                                         # {{{
+    with os.scandir(D) as it:
+        return sorted( E.path for E in it
+                       if E.name.startswith('man') and E.is_dir() )
+# }}}
+def man_mtime(D):                                           # {{{
+    """
+    A man directory's stamp: the mtimes of D and of its man*/
+    subdirectories, where the pages are.
+    """
+    try:
+        return tuple( os.stat(P).st_mtime_ns for P in [D] + man_subdirs(D) )
+    except OSError:
+        return None
+# }}}
+def scan_man(D):                                            # {{{
+    """
+    (stamp, pages) of the man pages under directory D.
+    """
+    try:
+        stamp = man_mtime(D)
+        pages = set()
+        for S in man_subdirs(D):
+            with os.scandir(S) as it:
+                pages.update( man_name(E.name) for E in it
+                              if not E.name.startswith('.') )
+    except OSError:
+        return None, ()
+    return stamp, tuple(sorted(pages))
+# }}}
+def bin_mtime(D):                                           # {{{
+    try:
+        return os.stat(D).st_mtime_ns
+    except OSError:
+        return None
+# }}}
+def read_index(Index, OS):                                  # {{{
+    import marshal
+    try:
+        with open(Index, 'rb') as fh:
+            payload = marshal.loads(fh.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if not isinstance(payload, dict) or \
+       payload.get('format') != INDEX_FORMAT or \
+       payload.get('OS') != OS or \
+       payload.get('python') != sys.version_info[:2]:
+        return None
+    return payload
+# }}}
+def update(payload, index, stamp,                           # {{{
+           refresh=False, verbose=0):
+    """
+    Bring payload up to date with the catalog in index.  Tools are
+    re-read from the catalog if its stamp changed, directories not
+    yet listed are listed, and with refresh every directory is
+    stat'ed and those whose mtime changed listed again.  Returns
+    True if payload changed.
+    """
+    import concurrent.futures
+    changed = False
+    if payload['stamp'] != stamp or stamp is None or refresh:
+        tools = {}
+        for app in index.data:
+            for ver, tool in (index.versions(app) or {}).items():
+                tools[tool.app_ver] = tool_dirs(tool)
+        if tools != payload['tools']:
+            payload['tools'] = tools
+            changed = True
+        if payload['stamp'] != stamp:
+            payload['stamp'] = stamp
+            changed = True
+
+    wanted = { 'bin' : set(), 'man' : set() }
+    for bin_dirs, man_dirs in payload['tools'].values():
+        wanted['bin'].update(bin_dirs)
+        wanted['man'].update(man_dirs)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=THREADS) as pool:
+        for kind, mtime, scan in (('bin', bin_mtime, scan_bin),
+                                  ('man', man_mtime, scan_man)):
+            known = payload[kind]
+            for D in [ D for D in known if D not in wanted[kind] ]:
+                del known[D]
+                changed = True
+            todo = [ D for D in wanted[kind] if D not in known ]
+            if refresh:
+                seen = [ D for D in wanted[kind] if D in known ]
+                for D, m in zip(seen, pool.map(mtime, seen)):
+                    if m != known[D][0]:
+                        todo.append(D)
+            if verbose and todo:
+                print(f'listing {len(todo)} {kind} directories')
+            for D, listing in zip(todo, pool.map(scan, todo)):
+                if known.get(D) != listing:
+                    known[D] = listing
+                    changed = True
+    return changed
+# }}}
+def load(infile, index, refresh=False, verbose=0):          # {{{
+    """
+    Return the up to date index payload for index.OS,
+        { 'tools' : { app_ver : (bin_dirs, man_dirs) },
+          'bin'   : { dir : (mtime, executables) },
+          'man'   : { dir : (stamp, pages) }, ... }
+    writing it back if anything changed.
+    """
+    Index   = index_file(infile, index.OS)
+    stamp   = compiled_stamp(infile) if SA.Cache_Status != 'disabled' else None
+    payload = read_index(Index, index.OS) or \
+              { 'format' : INDEX_FORMAT, 'OS' : index.OS, 'stamp' : False,
+                'tools' : {}, 'bin' : {}, 'man' : {} }
+    payload.pop('python', None)
+    if update(payload, index, stamp, refresh=refresh, verbose=verbose):
+        try:
+            os.makedirs(SA.SETAPP_CACHE_DIR, exist_ok=True)
+            SA.write_cache(Index, payload)
+        except (OSError, ValueError) as e:
+            if verbose:
+                print(f'provides index not saved: {e}')
+    return payload
+# }}}
+def provided(payload, app_ver, kind):                       # {{{
+    """
+    Sorted names app_ver provides; kind is 'bin' or 'man'.
+    """
+    bin_dirs, man_dirs = payload['tools'].get(app_ver, ((), ()))
+    names = set()
+    for D in (bin_dirs if kind == 'bin' else man_dirs):
+        names.update(payload[kind].get(D, (None, ()))[1])
+    return sorted(names)
+# }}}
+def providers(payload, name):                               # {{{
+    """
+    [(app_ver, path), ...] for every app/version with an executable
+    or man page called name ("nastran", "matlab(1)" or "matlab").
+    """
+    found = []
+    for app_ver, (bin_dirs, man_dirs) in sorted(payload['tools'].items()):
+        for D in bin_dirs:
+            if name in payload['bin'].get(D, (None, ()))[1]:
+                found.append( (app_ver, os.path.join(D, name)) )
+        for D in man_dirs:
+            for page in payload['man'].get(D, (None, ()))[1]:
+                if page == name or page.partition('(')[0] == name:
+                    found.append( (app_ver, f'{page} in {D}') )
+    return found
+# }}}
+def show(payload, index, app_ver, kind):                    # {{{
+    """
+    Print what app_ver (every version if none is given, "all" for
+    every application) provides.
+    """
+    import textwrap
+    if app_ver == 'all':
+        tools = sorted(payload['tools'])
+    else:
+        app, ver, err = index.lookup(app_ver)
+        if app is None or (err and '/' in app_ver):
+            print(err)
+            return 1
+        tools = [ f'{app}/{v}' for v in index.versions(app) ] \
+                if '/' not in app_ver else [ f'{app}/{ver}' ]
+        if not tools:
+            print(f'{app} is not available for {index.OS}')
+            return 1
+    for T in tools:
+        names = provided(payload, T, kind)
+        print(f'{T} ({len(names)})')
+        if names:
+            print(textwrap.fill('  '.join(names), width=78,
+                                initial_indent='    ',
+                                subsequent_indent='    '))
+    return 0
+# }}}
+def run(args, index):                                       # {{{
+    """
+    Handle --show-bin, --show-man, --provides and --refresh-index.
+    Returns the exit status.
+    """
+    payload = load(args.infile, index, refresh=args.refresh_index,
+                   verbose=args.verbose)
+    status = 0
+    if args.refresh_index:
+        print(f'{len(payload["tools"])} tools, {len(payload["bin"])} bin '
+              f'and {len(payload["man"])} man directories indexed')
+    if args.show_bin:
+        status |= show(payload, index, args.show_bin, 'bin')
+    if args.show_man:
+        status |= show(payload, index, args.show_man, 'man')
+    if args.provides:
+        found = providers(payload, args.provides)
+        for app_ver, where in found:
+            print(f'{app_ver:24s} {where}')
+        if not found:
+            print(f'no application provides {args.provides}')
+            status = 1
+    return status
+# }}}
@@ -0,0 +1,507 @@
+#!/usr/bin/env python
+"""
+Pre-render ready-to-source shell snippets for every app/version/OS
+in the catalog (setapp --render [DIR]) so that loading an
+application needs no Python at all:
+
+    . DIR/setapp.sh                 # bash, ksh, zsh; once per login
+    setapp_load matlab/2022a python # same result as "setapp matlab/2022a python"
+    setapp_unload matlab            # same result as "setapp -r matlab"
+
+    source DIR/setapp.csh           # csh, tcsh
+
+Layout under DIR:
+    setapp.sh, setapp.csh     define setapp_load / setapp_unload and
+                              SETAPP_OS (from uname -r via OS_aliases)
+    setapp_rm.sh              POSIX sh helpers used by the snippets
+    emit_csh.sh               runs sh snippets and prints the result
+                              as csh commands
+    OS/APP/VER.add.{sh,csh}   add VER
+    OS/APP/VER.front.{sh,csh} same for "+APP/VER" (appends become prefixes)
+    OS/APP/VER.rm.{sh,csh}    remove VER if it is loaded
+    OS/APP.{add,front}.*      symbolic links to the default version
+    OS/APP.rm.{sh,csh}        remove whichever version of APP is loaded
+    manifest.json             per entry hash used for incremental renders
+
+The snippets only handle the case they can get exactly right: an
+environment that setapp itself hasn't touched (no SETAPP_LEDGER), an
+app that isn't loaded yet and values that aren't already in their
+variables.  An add snippet puts its values in the way add_app() does
+(appends, then prefixes, then overwrites; list variables lose
+duplicate and empty entries and a prefixed value moves to the front)
+and adds the tool to SETAPP_TOOLS.  So every value a loaded tool
+contributes was added by it, and the rm snippets can remove them as
+rm_app() does without a ledger: a value is kept if another loaded
+tool also contributes it.  Anything else (reloading or swapping a
+version, a value that was there first) makes the snippet fail without
+changing anything, and setapp_load / setapp_unload then run setapp
+itself, which keeps track of who owns what in SETAPP_LEDGER.
+
+Applications that have requires, conflicts or bundle on an OS (see
+setapp_requires) get no snippets there, so requirements are met and
+checked exactly as on the Python path.  The applications they name
+do get snippets; once setapp itself has run, SETAPP_LEDGER sends
+those through it as well.
+"""
+import os
+import setapp_core as SA
+
+RENDER_FORMAT = 4   # bump when the generated shell code changes
+
+Rm_Helper = r'''# generated by setapp --render; POSIX sh helpers for the snippets
+# _setapp_fresh APP [VAR KIND VALUE]...
+#   Fail if setapp itself manages the environment (SETAPP_LEDGER is
+#   set), APP is loaded or any VALUE is already in VAR.
+_setapp_fresh() {
+    [ -z "${SETAPP_LEDGER+x}" ] || return 1
+    case ":${SETAPP_TOOLS-}:" in *":$1/"*) return 1 ;; esac
+    shift
+    while [ $# -ge 3 ]; do
+        if eval "[ -n \"\${$1+x}\" ]"; then
+            eval "_sa_old=\$$1"
+            _sa_sep=${2#list}
+            _sa_sep=${_sa_sep:-:}
+            if [ "$2" = scalar ]; then
+                [ "$_sa_old" != "$3" ] || return 1
+            else
+                case "$_sa_sep$_sa_old$_sa_sep" in
+                    *"$_sa_sep$3$_sa_sep"*) return 1 ;;
+                esac
+            fi
+        fi
+        shift 3
+    done
+}
+# _setapp_put VAR KIND VERB VALUE
+#   Put VALUE in VAR as add_app does: VERB "overwrite" sets VAR,
+#   "prefix" and "append" put VALUE first or last.  KIND "list"
+#   ("listSEP") moves a prefixed VALUE to the front and drops
+#   duplicate and empty entries, rewriting VAR only if that changes
+#   it; KIND "scalar" joins with ':'.
+_setapp_put() {
+    _sa_var=$1 _sa_kind=$2 _sa_verb=$3 _sa_val=$4
+    if [ "$_sa_verb" = overwrite ] || eval "[ -z \"\${$_sa_var+x}\" ]"; then
+        _setapp_set "$_sa_var" "$_sa_val"
+        return 0
+    fi
+    eval "_sa_old=\$$_sa_var"
+    if [ "$_sa_kind" = scalar ]; then
+        if [ "$_sa_verb" = prefix ]; then
+            _setapp_set "$_sa_var" "$_sa_val:$_sa_old"
+        else
+            _setapp_set "$_sa_var" "$_sa_old:$_sa_val"
+        fi
+        return 0
+    fi
+    _sa_sep=${_sa_kind#list}
+    _sa_sep=${_sa_sep:-:}
+    _sa_nl='
+'
+    _sa_all= _sa_new= _sa_seen=$_sa_nl _sa_rest=$_sa_old$_sa_sep
+    while [ -n "$_sa_rest" ]; do
+        _sa_i=${_sa_rest%%"$_sa_sep"*}
+        _sa_rest=${_sa_rest#*"$_sa_sep"}
+        [ -n "$_sa_i" ] || continue
+        case $_sa_seen in *"$_sa_nl$_sa_i$_sa_nl"*) continue ;; esac
+        _sa_seen="$_sa_seen$_sa_i$_sa_nl"
+        _sa_all="$_sa_all${_sa_all:+$_sa_sep}$_sa_i"
+        [ "$_sa_i" != "$_sa_val" ] || continue
+        _sa_new="$_sa_new${_sa_new:+$_sa_sep}$_sa_i"
+    done
+    if [ "$_sa_verb" = prefix ]; then
+        _sa_new="$_sa_val${_sa_new:+$_sa_sep}$_sa_new"
+    elif [ "$_sa_new" = "$_sa_all" ]; then
+        _sa_new="$_sa_all${_sa_all:+$_sa_sep}$_sa_val"
+    else
+        _sa_new=$_sa_all
+    fi
+    [ "$_sa_new" = "$_sa_all" ] || _setapp_set "$_sa_var" "$_sa_new"
+}
+# _setapp_tool APP/VER : add APP/VER to SETAPP_TOOLS
+_setapp_tool() {
+    _setapp_set SETAPP_TOOLS "${SETAPP_TOOLS:+$SETAPP_TOOLS:}$1"
+}
+# _setapp_rm VAR KIND [VALUE TOOLS]...
+#   Remove each VALUE from VAR unless one of the space separated
+#   app/version TOOLS is still listed in SETAPP_TOOLS.  KIND "list"
+#   treats VAR as ':' separated ("listSEP" as SEP separated) and also
+#   drops duplicate and empty entries (as setapp.clean_env_var
+#   does); KIND "scalar" unsets VAR
+#   if it equals a removed VALUE.  VAR is only rewritten if a value
+#   was actually removed.
+_setapp_rm() {
+    _sa_var=$1 _sa_kind=$2
+    shift 2
+    eval "[ -n \"\${$_sa_var+x}\" ]" || return 0
+    eval "_sa_old=\$$_sa_var"
+    _sa_nl='
+'
+    _sa_del=$_sa_nl
+    while [ $# -ge 2 ]; do
+        _sa_keep=no
+        for _sa_t in $2; do
+            case ":${SETAPP_TOOLS-}:" in *":$_sa_t:"*) _sa_keep=yes ;; esac
+        done
+        [ $_sa_keep = yes ] || _sa_del="$_sa_del$1$_sa_nl"
+        shift 2
+    done
+    if [ "$_sa_kind" = scalar ]; then
+        case $_sa_del in *"$_sa_nl$_sa_old$_sa_nl"*) _setapp_unset "$_sa_var" ;; esac
+        return 0
+    fi
+    _sa_sep=${_sa_kind#list}
+    _sa_sep=${_sa_sep:-:}
+    _sa_new= _sa_seen=$_sa_nl _sa_hit=no _sa_rest=$_sa_old$_sa_sep
+    while [ -n "$_sa_rest" ]; do
+        _sa_i=${_sa_rest%%"$_sa_sep"*}
+        _sa_rest=${_sa_rest#*"$_sa_sep"}
+        [ -n "$_sa_i" ] || continue
+        case $_sa_seen in *"$_sa_nl$_sa_i$_sa_nl"*) continue ;; esac
+        _sa_seen="$_sa_seen$_sa_i$_sa_nl"
+        case $_sa_del in *"$_sa_nl$_sa_i$_sa_nl"*) _sa_hit=yes; continue ;; esac
+        _sa_new="$_sa_new${_sa_new:+$_sa_sep}$_sa_i"
+    done
+    [ $_sa_hit = yes ] || return 0
+    if [ -n "$_sa_new" ]; then
+        _setapp_set "$_sa_var" "$_sa_new"
+    else
+        _setapp_unset "$_sa_var"
+    fi
+}
+# _setapp_untool APP : drop APP's entries from SETAPP_TOOLS
+_setapp_untool() {
+    [ -n "${SETAPP_TOOLS+x}" ] || return 0
+    _sa_new= _sa_rest=$SETAPP_TOOLS:
+    while [ -n "$_sa_rest" ]; do
+        _sa_i=${_sa_rest%%:*}
+        _sa_rest=${_sa_rest#*:}
+        [ -n "$_sa_i" ] || continue
+        case $_sa_i in "$1"|"$1"/*) continue ;; esac
+        _sa_new="$_sa_new${_sa_new:+:}$_sa_i"
+    done
+    if [ -n "$_sa_new" ]; then
+        _setapp_set SETAPP_TOOLS "$_sa_new"
+    else
+        _setapp_unset SETAPP_TOOLS
+    fi
+}
+# with _SETAPP_EMIT=csh the changes are also printed as csh commands
+_setapp_set() {
+    eval "$1=\$2; export $1"
+    [ "${_SETAPP_EMIT-}" != csh ] || printf "setenv %s '%s';\n" "$1" "$2"
+}
+_setapp_unset() {
+    unset "$1"
+    [ "${_SETAPP_EMIT-}" != csh ] || printf 'unsetenv %s;\n' "$1"
+}
+'''
+
+Emit_Csh = '''# generated by setapp --render; run sh snippets, print csh commands
+_SETAPP_EMIT=csh
+. "$(dirname "$0")/setapp_rm.sh"
+for _sa_f in "$@"; do
+    . "$_sa_f" || { echo 'set _setapp_fallback;'; exit 0; }
+done
+'''
+
+Load_Csh = '''# generated by setapp --render
+set _setapp_dot = ~/.my_env
+if ($?SETAPP_DOTFILE) set _setapp_dot = "$SETAPP_DOTFILE"
+foreach _setapp_a ($argv)
+    if ("$_setapp_a" =~ +*) then
+        set _setapp_f = "$SETAPP_RENDER_DIR/$SETAPP_OS/${_setapp_a:s/+//}.front.csh"
+    else
+        set _setapp_f = "$SETAPP_RENDER_DIR/$SETAPP_OS/${_setapp_a}.add.csh"
+    endif
+    unset _setapp_fallback
+    if (-r "$_setapp_f") then
+        source "$_setapp_f"
+    else
+        set _setapp_fallback
+    endif
+    if ($?_setapp_fallback) then
+        rm -f "$_setapp_dot"
+        $setapp_command:q -s csh "$_setapp_a"
+        if (-r "$_setapp_dot") source "$_setapp_dot"
+    endif
+end
+unset _setapp_a _setapp_f _setapp_dot _setapp_fallback
+'''
+
+Unload_Csh = '''# generated by setapp --render
+set _setapp_dot = ~/.my_env
+if ($?SETAPP_DOTFILE) set _setapp_dot = "$SETAPP_DOTFILE"
+foreach _setapp_a ($argv)
+    set _setapp_f = "$SETAPP_RENDER_DIR/$SETAPP_OS/${_setapp_a:h}.rm.csh"
+    if ("$_setapp_a" !~ */*) set _setapp_f = "$SETAPP_RENDER_DIR/$SETAPP_OS/${_setapp_a}.rm.csh"
+    unset _setapp_fallback
+    if (-r "$_setapp_f") then
+        source "$_setapp_f"
+    else
+        set _setapp_fallback
+    endif
+    if ($?_setapp_fallback) then
+        rm -f "$_setapp_dot"
+        $setapp_command:q -s csh -r "$_setapp_a"
+        if (-r "$_setapp_dot") source "$_setapp_dot"
+    endif
+end
+unset _setapp_a _setapp_f _setapp_dot _setapp_fallback
+'''
+
+def sh_quote(value):                                        # {{{
+    return "'" + str(value).replace("'", "'\\''") + "'"
+# }}}
+def write_file(path, text):                                 # {{{
+    """
+    Atomically replace path so a shell sourcing it mid-render
+    never sees a partial file.
+    """
+    tmp = f'{path}.tmp{os.getpid()}'
+    with open(tmp, 'w') as fh:
+        fh.write(text)
+    os.replace(tmp, path)
+# }}}
+def link(target, path):                                     # {{{
+    tmp = f'{path}.tmp{os.getpid()}'
+    os.symlink(target, tmp)
+    os.replace(tmp, path)
+# }}}
+def sharers(index):                                         # {{{
+    """
+    (var, value) -> [(app, app/ver), ...] for every tool on the
+    index's OS that sets it.
+    """
+    who = {}
+    for app in index.data:
+        for tool in (index.versions(app) or {}).values():
+            for var, verb, value in tool.env:
+                who.setdefault( (var, value), [] ).append( (app, tool.app_ver) )
+    return who
+# }}}
+def related_apps(index):                                    # {{{
+    """
+    Applications with a version that has requires, conflicts or
+    bundle on the index's OS.
+    """
+    import setapp_requires
+    return { app for app in index.data
+             for tool in (index.versions(app) or {}).values()
+             if any(setapp_requires.declared(index, tool).values()) }
+# }}}
+def var_kind(var):                                          # {{{
+    """
+    The KIND argument of the setapp_rm.sh helpers for var.
+    """
+    sep = SA.list_separator(var)
+    return 'scalar' if sep is None else 'list' if sep == ':' else 'list' + sep
+# }}}
+def add_lines(tool, front):                                 # {{{
+    """
+    sh code equivalent to "setapp app_ver" ("setapp +app_ver" if
+    front) when the app isn't loaded; fails, changing nothing, when
+    setapp itself has to do it.
+    """
+    entries = [ (var, 'prefix' if front and verb == 'append to' else verb,
+                 str(value)) for var, verb, value in tool.env ]
+    fresh = ''.join(f' {var} {sh_quote(var_kind(var))} "{value}"'
+                    for var, verb, value in entries)
+    lines = [ f'_setapp_fresh {sh_quote(tool.app)}{fresh} || return 1' ]
+    for order in ('append to', 'prefix', 'overwrite'):
+        lines += [ f'_setapp_put {var} {sh_quote(var_kind(var))} '
+                   f'{order.split()[0]} "{value}"'
+                   for var, verb, value in entries if verb == order ]
+    lines.append(f'_setapp_tool {sh_quote(tool.app_ver)}')
+    return lines
+# }}}
+def rm_lines(tool, who):                                    # {{{
+    """
+    sh code equivalent to "setapp -r app" when tool (an app/ver)
+    is loaded.
+    """
+    app = tool.app
+    by_var = {}
+    for var, verb, value in tool.env:
+        if not isinstance(value, str):
+            continue
+        keep = sorted({ tool for other, tool in who[(var, value)]
+                        if other != app })
+        by_var.setdefault(var, []).append( (value, keep) )
+    lines = [ f'case ":${{SETAPP_TOOLS-}}:" in *{sh_quote(":" + tool.app_ver + ":")}*)' ]
+    for var, pairs in by_var.items():
+        args = ' '.join(f'{sh_quote(v)} {sh_quote(" ".join(k))}'
+                        for v, k in pairs)
+        lines.append(f'    _setapp_rm {var} {sh_quote(var_kind(var))} {args}')
+    lines += [ f'    _setapp_untool {sh_quote(app)}', '    ;;', 'esac' ]
+    return lines
+# }}}
+def entry_key(index, tool, who):                            # {{{
+    """
+    Hash of everything the files for tool are generated from.
+    """
+    import hashlib
+    import setapp_requires
+    basis = repr( (RENDER_FORMAT, tool.env,
+                   setapp_requires.declared(index, tool),
+                   [ sorted(who[(var, value)]) for var, verb, value in tool.env ],
+                   [ SA.list_separator(var) for var, verb, value in tool.env ]) )
+    return hashlib.sha1(basis.encode()).hexdigest()
+# }}}
+def top_files(out_dir, command):                            # {{{
+    """
+    setapp.sh, setapp.csh and the helper scripts; command is the
+    setapp command line to run for what has no snippet.
+    """
+    quoted = ' '.join(sh_quote(word) for word in command)
+    sh  = [ '# generated by setapp --render; source from .bashrc/.profile',
+            f'SETAPP_RENDER_DIR={sh_quote(out_dir)}',
+            '_setapp_py() {',
+            '    _sa_dot=${SETAPP_DOTFILE:-$HOME/.my_env}',
+            '    rm -f "$_sa_dot"',
+            f'    {quoted} -s bash "$@" || return 1',
+            '    [ ! -r "$_sa_dot" ] || . "$_sa_dot"',
+            '}',
+            'case $(uname -r) in' ]
+    csh = [ '# generated by setapp --render; source from .cshrc',
+            f'setenv SETAPP_RENDER_DIR {sh_quote(out_dir)}',
+            f'set setapp_command = ( {quoted} )',
+            'switch (`uname -r`)' ]
+    for release, OS in sorted(SA.OS_alias.items()):
+        sh  += [ f'    {sh_quote(release)}) SETAPP_OS={sh_quote(OS)} ;;' ]
+        csh += [ f'    case {release}:', f'        setenv SETAPP_OS {OS}',
+                 '        breaksw' ]
+    sh  += [ 'esac',
+             '. "$SETAPP_RENDER_DIR/setapp_rm.sh"',
+             'setapp_load() {',
+             '    for _sa_a in "$@"; do',
+             '        case $_sa_a in',
+             '            +*) _sa_f=$SETAPP_RENDER_DIR/$SETAPP_OS/${_sa_a#+}.front.sh ;;',
+             '            *)  _sa_f=$SETAPP_RENDER_DIR/$SETAPP_OS/$_sa_a.add.sh ;;',
+             '        esac',
+             '        if [ -r "$_sa_f" ] && . "$_sa_f"; then',
+             '            :',
+             '        else',
+             '            _setapp_py "$_sa_a" || return 1',
+             '        fi',
+             '    done',
+             '}',
+             'setapp_unload() {',
+             '    for _sa_a in "$@"; do',
+             '        _sa_f=$SETAPP_RENDER_DIR/$SETAPP_OS/${_sa_a%%/*}.rm.sh',
+             '        if [ -r "$_sa_f" ] && . "$_sa_f"; then',
+             '            :',
+             '        else',
+             '            _setapp_py -r "$_sa_a" || return 1',
+             '        fi',
+             '    done',
+             '}' ]
+    csh += [ 'endsw',
+             "alias setapp_load   'source $SETAPP_RENDER_DIR/load.csh \\!*'",
+             "alias setapp_unload 'source $SETAPP_RENDER_DIR/unload.csh \\!*'" ]
+    write_file(f'{out_dir}/setapp.sh',    '\n'.join(sh)  + '\n')
+    write_file(f'{out_dir}/setapp.csh',   '\n'.join(csh) + '\n')
+    write_file(f'{out_dir}/setapp_rm.sh', Rm_Helper)
+    write_file(f'{out_dir}/emit_csh.sh',  Emit_Csh)
+    write_file(f'{out_dir}/load.csh',     Load_Csh)
+    write_file(f'{out_dir}/unload.csh',   Unload_Csh)
+# }}}
+def render(data, out_dir, verbose=0, infile=None):          # {{{
+    """
+    Write snippets for every app/version/OS in data, the catalog
+    loaded from infile, to out_dir, regenerating only entries whose
+    definition changed since the last render.  Returns (n_written,
+    n_unchanged, n_removed).
+    """
+    import sys
+    import json
+    out_dir  = os.path.abspath(out_dir)
+    manifest = f'{out_dir}/manifest.json'
+    try:
+        with open(manifest) as fh:
+            old = json.load(fh)
+        if old.get('format') != RENDER_FORMAT:
+            old = {}
+    except (OSError, ValueError):
+        old = {}
+    old_keys = old.get('entries', {})
+    new_keys = {}
+    n_written = n_unchanged = 0
+
+    os.makedirs(out_dir, exist_ok=True)
+    command = [ sys.executable,
+                os.path.join(os.path.dirname(os.path.abspath(SA.__file__)),
+                             'setapp.py') ]
+    if infile:
+        command += [ '-i', os.path.abspath(infile) ]
+    top_files(out_dir, command)
+    for OS in sorted(set(SA.OS_alias.values())):
+        index   = SA.Resolved(data, OS)
+        who     = sharers(index)
+        related = related_apps(index)
+        for app in sorted(data):
+            tools = index.versions(app)
+            if not tools or app in related:
+                continue    # left to setapp itself
+            versions = list(tools)
+            app_dir = f'{out_dir}/{OS}/{app}'
+            app_rm  = f'{out_dir}/{OS}/{app}.rm'
+            os.makedirs(app_dir, exist_ok=True)
+
+            # per-application dispatchers and default links
+            default = data[app]['default']
+            key = repr( (RENDER_FORMAT, versions, default) )
+            new_keys[f'{OS}/{app}'] = key
+            if old_keys.get(f'{OS}/{app}') != key or \
+               not os.path.exists(f'{app_rm}.sh'):
+                write_file(f'{app_rm}.sh',
+                    '[ -z "${SETAPP_LEDGER+x}" ] || return 1\n' + ''.join(
+                    f'. {sh_quote(f"{app_dir}/{v}.rm.sh")}\n'
+                    for v in versions))
+                write_file(f'{app_rm}.csh',
+                    f'eval "`/bin/sh {out_dir}/emit_csh.sh {app_rm}.sh`"\n')
+                for kind in ('add', 'front'):
+                    for shell in ('sh', 'csh'):
+                        L = f'{out_dir}/{OS}/{app}.{kind}.{shell}'
+                        if default in versions:
+                            link(f'{app}/{default}.{kind}.{shell}', L)
+                        elif os.path.lexists(L):
+                            os.unlink(L)
+
+            for ver, tool in tools.items():
+                key = entry_key(index, tool, who)
+                new_keys[f'{OS}/{app}/{ver}'] = key
+                base = f'{app_dir}/{ver}'
+                if old_keys.get(f'{OS}/{app}/{ver}') == key and \
+                   os.path.exists(f'{base}.rm.csh'):
+                    n_unchanged += 1
+                    continue
+                write_file(f'{base}.add.sh',
+                           '\n'.join(add_lines(tool, False)) + '\n')
+                write_file(f'{base}.front.sh',
+                           '\n'.join(add_lines(tool, True)) + '\n')
+                write_file(f'{base}.rm.sh',
+                           '\n'.join(rm_lines(tool, who)) + '\n')
+                for kind in ('add', 'front', 'rm'):
+                    write_file(f'{base}.{kind}.csh', f'eval "`/bin/sh '
+                        f'{out_dir}/emit_csh.sh {base}.{kind}.sh`"\n')
+                n_written += 1
+                if verbose:
+                    print(f'rendered {OS}/{app}/{ver}')
+
+    # entries that left the catalog
+    n_removed = 0
+    for name in set(old_keys) - set(new_keys):
+        if name.count('/') == 2:    # OS/app/ver rather than OS/app
+            n_removed += 1
+        for kind in ('add', 'front', 'rm'):
+            for ext in ('sh', 'csh'):
+                P = f'{out_dir}/{name}.{kind}.{ext}'
+                if os.path.lexists(P):
+                    os.unlink(P)
+        if verbose:
+            print(f'removed {name}')
+
+    write_file(manifest, json.dumps({ 'format'  : RENDER_FORMAT,
+                                      'entries' : new_keys }, indent=1))
+    return n_written, n_unchanged, n_removed
+# }}}
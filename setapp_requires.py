@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+"""
+Dependencies, conflicts and bundles between catalog entries.
+
+A version's OS entry, or else its application, may have
+    requires  : [ gcc, openmpi/>=4.1 ]   loaded before it
+    conflicts : [ python/2.* ]           may not be loaded with it
+    bundle    : [ gcc/12.2, cmake ]      loaded instead of it
+each an app, app/VER or app/SPEC (see VersionIndex), or a list of
+them.  A requirement is met by a version already loaded or already
+planned that matches it, so "requires: [gcc]" accepts whichever gcc
+is loaded; otherwise it loads what "setapp app/SPEC" would.
+
+closure() of an app/version is its requirements and bundle members,
+depth first in the order they are listed, then the tool itself
+(unless it is a bundle): a topological load order that's the same
+every time.  A cycle, or two requirements that no one version of
+an application meets, is an error.  Closures are memoized per OS
+in SETAPP_CACHE_DIR/closure-XXXXXXXX.marshal, next to the compiled
+catalog and stamped like it, so expanding a big bundle on login is
+a lookup once it has been resolved.
+"""
+import sys
+import os
+import setapp_core as SA
+
+MEMO_FORMAT = 1     # bump when the layout of the memo file changes
+
+New_Closures = {}   # OS -> { app/ver : closure } not yet in the memo file
+
+def memo_file(infile):                                      # {{{
+    tag = os.path.basename(SA.cache_file(infile))[8:16]
+    return os.path.join(SA.SETAPP_CACHE_DIR, f'closure-{tag}.marshal')
+# }}}
+def read_memo(infile):                                      # {{{
+    """
+    { OS : { app/ver : closure } } from the memo file if it was
+    written for the catalog as it is now, else {}.
+    """
+    import marshal
+    try:
+        with open(memo_file(infile), 'rb') as fh:
+            memo = marshal.loads(fh.read())
+        if memo.get('format') == MEMO_FORMAT and \
+           memo.get('python') == sys.version_info[:2] and \
+           memo.get('stamp') == SA.catalog_stamp(infile):
+            return memo['closures']
+    except (OSError, EOFError, ValueError, TypeError, AttributeError):
+        pass
+    return {}
+# }}}
+def memo_of(index):                                         # {{{
+    """
+    The closures memoized for index's OS, read from the memo file
+    the first time.
+    """
+    if index._closure is None:
+        index._closure = {}
+        if SA.Cache_Status in ('hit', 'rebuilt'):
+            index._closure = read_memo(SA.Loaded_Infile).get(index.OS, {})
+    return index._closure
+# }}}
+def save_memo(index):                                       # {{{
+    """
+    Add index's new closures to the memo file.
+    """
+    new = New_Closures.pop(index.OS, None)
+    if not new or SA.Cache_Status not in ('hit', 'rebuilt'):
+        return
+    infile   = SA.Loaded_Infile
+    closures = read_memo(infile)
+    closures.setdefault(index.OS, {}).update(new)
+    try:
+        os.makedirs(SA.SETAPP_CACHE_DIR, exist_ok=True)
+        SA.write_cache(memo_file(infile),
+                       { 'format' : MEMO_FORMAT, 'python' : sys.version_info[:2],
+                         'stamp' : SA.catalog_stamp(infile),
+                         'closures' : closures })
+    except (OSError, ValueError):
+        pass
+# }}}
+def declared(index, tool):                                  # {{{
+    """
+    { 'requires' : [...], 'conflicts' : [...], 'bundle' : [...] } for
+    tool, from its OS entry or else its application.
+    """
+    A = index.data[tool.app]
+    found = {}
+    for K in SA.Requirement_Keys:
+        V = tool.entry.get(K, A.get(K, []))
+        found[K] = [ V ] if isinstance(V, str) else list(V)
+    return found
+# }}}
+def satisfies(index, app_ver, spec):                        # {{{
+    """
+    True if app_ver ("gcc/12.2") meets spec ("gcc", "gcc/12.2",
+    "gcc/>=12", ...).
+    """
+    app, sep, want = spec.lstrip('+').partition('/')
+    have = app_ver.partition('/')[2]
+    if app != app_ver.partition('/')[0]:
+        return False
+    if not sep or have == want:
+        return True
+    return SA.is_version_spec(want) and \
+           have in index.version_index(app).select(want)
+# }}}
+def closure(index, app_ver):                                # {{{
+    """
+    (members, conflicts, err) for app_ver, an app/version available
+    on index.OS: members is ((app/ver, spec, required by), ...) in
+    load order, ending with app_ver itself unless it is a bundle,
+    and conflicts ((declared by, spec), ...) of every member.
+    """
+    memo = memo_of(index)
+    try:
+        return memo[app_ver]
+    except KeyError:
+        pass
+    members, conflicts, placed = [], [], {}
+
+    def visit(spec, by, stack):
+        app = spec.lstrip('+').partition('/')[0]
+        if app in placed and satisfies(index, placed[app], spec):
+            return ''
+        app, ver, err = index.lookup(spec)
+        if err:
+            return f'{by} requires {spec}: {err}' if by else err
+        name = f'{app}/{ver}'
+        if name in stack:
+            return 'dependency cycle: ' + \
+                   ' -> '.join(stack[stack.index(name):] + [ name ])
+        if app in placed:
+            return f'{by} requires {spec}, which {placed[app]} (needed ' \
+                   f'first) does not match'
+        D = declared(index, index.tool(app, ver))
+        stack.append(name)
+        for R in D['requires'] + D['bundle']:
+            err = visit(R, name, stack)
+            if err:
+                return err
+        stack.pop()
+        conflicts.extend( (name, C) for C in D['conflicts'] )
+        if not D['bundle']:
+            members.append( (name, spec, by) )
+            placed[app] = name
+        return ''
+
+    err = visit(app_ver, '', [])
+    result = memo[app_ver] = (tuple(members), tuple(conflicts), err)
+    New_Closures.setdefault(index.OS, {})[app_ver] = result
+    return result
+# }}}
+def expand(index, app_ver_list, loaded):                    # {{{
+    """
+    app_ver_list with what each entry requires inserted before it
+    and bundles replaced by their members, leaving out requirements
+    already met by loaded ({ app : app/ver } now in SETAPP_TOOLS) or
+    by entries before them.  A "+" on an entry applies to everything
+    it brings in.  A version asked for by name (app/VER or app/SPEC)
+    is never swapped for one that a later entry requires.  Returns
+    the new list, or None after printing why the request can't be
+    met.
+    """
+    planned, needs, conflicts = [], [], []
+    final = dict(loaded)    # app -> app/ver once the request is done
+    fixed = set()           # apps whose version the request names
+    for item in app_ver_list:
+        front = '+' if item.startswith('+') else ''
+        app, ver, err = index.lookup(item)
+        if err:
+            planned.append(item)     # swap_app() reports it
+            continue
+        if '/' in item:
+            fixed.add(app)
+        members, declared_conflicts, err = closure(index, f'{app}/{ver}')
+        if err:
+            print(err)
+            return None
+        conflicts += declared_conflicts
+        for name, spec, by in members:
+            A = name.partition('/')[0]
+            if by:
+                needs.append( (by, spec) )
+                if A in final and satisfies(index, final[A], spec):
+                    continue
+                if A in fixed:
+                    print(f'{by} requires {spec}, not {final[A]}')
+                    return None
+            planned.append(front + name)
+            final[A] = name
+    for name in loaded.values():
+        if final.get(name.partition('/')[0]) == name:
+            members, declared_conflicts, err = closure(index, name)
+            needs += [ (by, spec) for M, spec, by in members
+                       if by and spec.partition('/')[0] in final ]
+            conflicts += declared_conflicts
+    for by, spec in needs:
+        A = spec.lstrip('+').partition('/')[0]
+        if not satisfies(index, final[A], spec):
+            print(f'{by} requires {spec}, not {final[A]}')
+            return None
+    for by, spec in conflicts:
+        A = spec.lstrip('+').partition('/')[0]
+        if A in final and A != by.partition('/')[0] and \
+           satisfies(index, final[A], spec):
+            print(f'{by} conflicts with {final[A]}')
+            return None
+    save_memo(index)
+    return planned
+# }}}
+def bundle_members(index, app_ver_list):                    # {{{
+    """
+    app_ver_list with each bundle replaced by everything loading it
+    loads, for "setapp -r".
+    """
+    found = []
+    for item in app_ver_list:
+        app, ver, err = index.lookup(item)
+        if err or not declared(index, index.tool(app, ver))['bundle']:
+            found.append(item)
+            continue
+        members, conflicts, err = closure(index, f'{app}/{ver}')
+        found += [ name for name, spec, by in members ] if not err else [ item ]
+    save_memo(index)
+    return found
+# }}}
+def describe(index, tool):                                  # {{{
+    """
+    Lines for --explain about what tool requires and conflicts with.
+    """
+    D = declared(index, tool)
+    lines = [ f'  {K} {", ".join(D[K])}' for K in SA.Requirement_Keys if D[K] ]
+    members, conflicts, err = closure(index, tool.app_ver)
+    if err:
+        lines.append(f'  !! {err}')
+    elif len(members) > 1 or D['bundle']:
+        lines.append(f'  load order {" ".join(M[0] for M in members)}')
+    save_memo(index)
+    return lines
+# }}}
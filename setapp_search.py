@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+"""
+Inverted index of the catalog for setapp --by-cat and --search.
+
+Every app/version/OS the catalog defines gets a posting number,
+an application's postings being consecutive.  Categories and the
+words of each application's name, help and category list map to
+application numbers (standing for all of its postings), the words
+of each version's doc entry to postings.  The index is kept in
+SETAPP_CACHE_DIR/search-XXXXXXXX.marshal and rebuilt only when a
+layer of the catalog is recompiled, so a query reads one file and
+never walks the catalog's ver dictionaries.  --search words match
+index terms exactly or by prefix, found by bisecting the sorted
+terms, or else as substrings, for which the other terms are
+scanned; applications are ranked by how well every word matched.
+"""
+import sys
+import os
+import setapp_core as SA
+
+INDEX_FORMAT = 1    # bump when the layout of the index changes
+
+def index_file(infile):                                     # {{{
+    tag = os.path.basename(SA.cache_file(infile))[8:16]
+    return os.path.join(SA.SETAPP_CACHE_DIR, f'search-{tag}.marshal')
+# }}}
+def words(text):                                            # {{{
+    """
+    "MATLAB/Simulink, 1(310)555" -> ['matlab', 'simulink', '1', '310', '555']
+    """
+    import re
+    return re.findall(r'[^\W_]+', str(text).lower())
+# }}}
+def build(app_data):                                        # {{{
+    """
+    The index payload for app_data,
+        { 'postings' : [ (app, ver, OS), ... ],
+          'apps'     : [ (app, name, first, last), ... ],
+          'category' : { category : (app number, ...) },
+          'terms'    : { word : (app number, ...) },
+          'doc'      : { word : (posting, ...) },
+          'sorted'   : [ word, ... ], ... }
+    Application number N has the postings apps[N][2] to apps[N][3]-1.
+    """
+    postings, apps, category, terms, doc = [], [], {}, {}, {}
+    for N, app in enumerate(sorted(app_data)):
+        A     = app_data[app]
+        first = len(postings)
+        for ver in A['ver']:
+            for OS in A['ver'][ver]:
+                if 'doc' in A['ver'][ver][OS]:
+                    for W in words(A['ver'][ver][OS]['doc']):
+                        doc.setdefault(W, set()).add(len(postings))
+                # interned, marshal writes each version and OS once
+                postings.append( (app, sys.intern(ver), sys.intern(OS)) )
+        apps.append( (app, A.get('name', app), first, len(postings)) )
+        cats = [ str(C) for C in A.get('category', []) ]
+        for C in cats:
+            category.setdefault(C.lower(), set()).add(N)
+        for W in words(' '.join([app, A.get('name', ''),
+                                 A.get('help', ''), *cats])):
+            terms.setdefault(W, set()).add(N)
+    return { 'format'   : INDEX_FORMAT,
+             'postings' : postings,
+             'apps'     : apps,
+             'category' : { C : tuple(sorted(S)) for C, S in category.items() },
+             'terms'    : { W : tuple(sorted(S)) for W, S in terms.items() },
+             'doc'      : { W : tuple(sorted(S)) for W, S in doc.items() },
+             'sorted'   : sorted(set(terms) | set(doc)), }
+# }}}
+def postings_of(payload, N, only=None):                      # {{{
+    """
+    Application number N's postings, or those of them in only.
+    """
+    every = range(payload['apps'][N][2], payload['apps'][N][3])
+    return every if only is None else [ P for P in every if P in only ]
+# }}}
+def load(infile, app_data, verbose=0):                      # {{{
+    """
+    The index for app_data, read from its cache file if that was
+    built from the same compiled catalog, else built and saved.
+    """
+    import marshal
+    import setapp_provides
+    Index = index_file(infile)
+    stamp = setapp_provides.compiled_stamp(infile) \
+            if SA.Cache_Status != 'disabled' else None
+    try:
+        with open(Index, 'rb') as fh:
+            payload = marshal.loads(fh.read())
+        if stamp is not None and \
+           payload.get('format') == INDEX_FORMAT and \
+           payload.get('stamp') == stamp and \
+           payload.get('python') == sys.version_info[:2]:
+            return payload
+    except (OSError, EOFError, ValueError, TypeError, AttributeError):
+        pass
+    if verbose:
+        print(f'building search index {Index}')
+    payload = build(app_data)
+    payload['stamp'] = stamp
+    if stamp is not None:
+        try:
+            os.makedirs(SA.SETAPP_CACHE_DIR, exist_ok=True)
+            SA.write_cache(Index, payload)
+        except (OSError, ValueError) as e:
+            if verbose:
+                print(f'search index not saved: {e}')
+    return payload
+# }}}
+def in_categories(payload, cats):                           # {{{
+    """
+    { app number : None } for the applications in every one of
+    cats (case-insensitive).
+    """
+    found = None
+    for C in cats:
+        S = set(payload['category'].get(C.lower(), ()))
+        found = S if found is None else found & S
+    return dict.fromkeys(sorted(found or ()))
+# }}}
+def matching(payload, query):                               # {{{
+    """
+    { app number : (score, postings) } for the applications every
+    word of query matches; postings is None if a word matched the
+    whole application rather than only some versions' doc entries.
+    A word scores 3 for an exact term, 2 for a prefix of one and 1
+    for a substring.
+    """
+    from bisect import bisect_left, bisect_right
+    terms, doc, ordered = payload['terms'], payload['doc'], payload['sorted']
+    firsts = [ A[2] for A in payload['apps'] ]
+    found  = None
+    for Q in words(query):
+        best = {}   # app number -> [score, postings]
+        lo = bisect_left(ordered, Q)
+        hi = bisect_left(ordered, Q + '\U0010ffff', lo)
+        hits = [ (W, 3 if W == Q else 2) for W in ordered[lo:hi] ] + \
+               [ (W, 1) for part in (ordered[:lo], ordered[hi:])
+                        for W in part if Q in W ]
+        for W, score in hits:
+            for N in terms.get(W, ()):
+                hit = best.setdefault(N, [score, None])
+                hit[0] = max(hit[0], score)
+                hit[1] = None
+            for P in doc.get(W, ()):
+                N   = bisect_right(firsts, P) - 1
+                hit = best.setdefault(N, [score, set()])
+                hit[0] = max(hit[0], score)
+                if hit[1] is not None:
+                    hit[1].add(P)
+        if found is None:
+            found = best
+            continue
+        both = {}
+        for N, (score, only) in best.items():
+            if N not in found:
+                continue
+            had = found[N][1]
+            if only is None:
+                only = had
+            elif had is not None:
+                only = only & had
+                if not only:
+                    continue
+            both[N] = [found[N][0] + score, only]
+        found = both
+    return { N : tuple(hit) for N, hit in (found or {}).items() }
+# }}}
+def print_apps(payload, selected, OS, order=None):          # {{{
+    """
+    One line per application in selected, { app number : postings },
+    with its name and the versions available on OS among postings
+    (all of its versions if None).
+    """
+    for N in (order or sorted(selected)):
+        app, name = payload['apps'][N][:2]
+        vers = []
+        for P in postings_of(payload, N, selected[N]):
+            A, ver, on = payload['postings'][P]
+            if on == OS and ver not in vers:
+                vers.append(ver)
+        where = ', '.join(vers) if vers else f'not available for {OS}'
+        print(f'  {app:14s} {name:24s} {where}')
+    return len(selected)
+# }}}
+def run(args, app_data):                                    # {{{
+    """
+    Handle --by-cat and --search.  Returns the exit status.
+    """
+    payload = load(args.infile, app_data, verbose=args.verbose)
+    cats = [ C for C in (args.apps_by_cat or '').split(',') if C ]
+    if args.search:
+        found = matching(payload, args.search)
+        if cats and cats != ['all']:
+            keep  = in_categories(payload, cats)
+            found = { N : hit for N, hit in found.items() if N in keep }
+        order = sorted(found, key=lambda N: (-found[N][0], N))
+        if not print_apps(payload, { N : found[N][1] for N in found },
+                          SA.This_OS, order):
+            print(f'no application matches "{args.search}"')
+            return 1
+        return 0
+    if cats == ['all']:
+        for C in sorted(payload['category']):
+            print(C)
+            print_apps(payload, dict.fromkeys(payload['category'][C]),
+                       SA.This_OS)
+        return 0
+    print(' & '.join(cats))
+    if not print_apps(payload, in_categories(payload, cats), SA.This_OS):
+        known = ', '.join(sorted(payload['category']))
+        print(f'  no application is in every one of these categories; '
+              f'categories are: {known}')
+        return 1
+    return 0
+# }}}
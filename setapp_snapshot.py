@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+"""
+Named snapshots of the loaded tools (setapp --save NAME, setapp
+--restore NAME).
+
+A snapshot is the SETAPP_TOOLS of the environment it was saved from
+and, for every variable SETAPP_LEDGER says those tools set, the
+variable's values in order, each with the tools that own it, and a
+marker where the values that aren't setapp's (eg /usr/bin in PATH)
+stood.  Restoring it fills the marker with the values of the
+current environment that aren't setapp's, which SETAPP_LEDGER
+tells apart without the catalog, so the usual restore reads two
+small JSON files and writes the dotfile; nothing is looked up.
+
+Snapshots are JSON files under SNAPSHOT_DIR/objects named by a
+digest of their contents.  SNAPSHOT_DIR/names.json maps each NAME
+to the snapshots saved for the last few catalog fingerprints,
+catalog_stamp(), which covers this host's OS.  If the catalog has
+changed since NAME was saved, or the current environment's ledger
+is stale, the catalog is loaded and NAME's tools are resolved again
+(and saved for the new fingerprint).
+"""
+import sys
+import os
+import setapp_core as SA
+
+SNAPSHOT_FORMAT = 1   # bump when the layout of a snapshot changes
+SNAPSHOT_DIR    = os.path.join(os.environ.get('HOME', '/tmp'), '.config',
+                               'setapp', 'snapshots')
+Keep_Stamps     = 4   # catalog fingerprints kept per name
+Base            = None  # marker for the values that aren't setapp's
+
+def names_file():                                           # {{{
+    return os.path.join(SNAPSHOT_DIR, 'names.json')
+# }}}
+def object_file(digest):                                    # {{{
+    return os.path.join(SNAPSHOT_DIR, 'objects', f'{digest}.json')
+# }}}
+def read_json(path, default):                               # {{{
+    import json
+    try:
+        with open(path) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return default
+# }}}
+def write_json(path, data):                                 # {{{
+    import json
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as fh:
+        json.dump(data, fh, indent=1, sort_keys=True)
+        fh.write('\n')
+    os.replace(tmp, path)
+# }}}
+def store(name, stamp, snap):                               # {{{
+    """
+    Save snap as NAME for catalog fingerprint stamp; returns its
+    digest.  Snapshots no name refers to any more are deleted.
+    """
+    import hashlib
+    import json
+    text   = json.dumps(snap, sort_keys=True)
+    digest = hashlib.sha256(text.encode()).hexdigest()[:16]
+    if not os.path.exists(object_file(digest)):
+        write_json(object_file(digest), snap)
+    names = read_json(names_file(), {})
+    names[name] = [ [ stamp, digest ] ] + \
+                  [ E for E in names.get(name, []) if E[0] != stamp ] \
+                  [:Keep_Stamps - 1]
+    write_json(names_file(), names)
+    used = { D for entries in names.values() for S, D in entries }
+    try:
+        for E in os.scandir(os.path.dirname(object_file(digest))):
+            if E.name.endswith('.json') and E.name[:-5] not in used:
+                os.unlink(E.path)
+    except OSError:
+        pass
+    return digest
+# }}}
+def parse_ledger(Env):                                      # {{{
+    """
+    { var : [ owners of each value, ... ] } from Env's SETAPP_LEDGER,
+    owners being '.' separated indices into SETAPP_TOOLS ('' for a
+    value that isn't setapp's), or None unless the ledger describes
+    Env as it is.
+    """
+    tools = [ t for t in ':'.join(Env.get('SETAPP_TOOLS', [])).split(':') if t ]
+    if not tools:
+        return {}
+    fields = Env.get('SETAPP_LEDGER', [''])[0].split(';')
+    if len(fields) < 2 or fields[0] != str(SA.LEDGER_FORMAT) or \
+       fields[1] != SA.ledger_checksum(tools):
+        return None
+    ledger = {}
+    for field in fields[2:]:
+        try:
+            var, crc, items = field.split('=', 2)
+        except ValueError:
+            return None
+        if var not in Env or crc != SA.ledger_checksum(Env[var]):
+            return None
+        items = items.split(',')
+        ledger[var] = items + [ '' ] * (len(Env[var]) - len(items))
+    return ledger
+# }}}
+def owned_values(Env, ledger):                              # {{{
+    """
+    { var : set of the values of var that loaded tools set } from
+    parse_ledger(Env) or, like it, from SA.read_ledger().
+    """
+    owned = {}
+    for var, owners in ledger.items():
+        if isinstance(owners, dict):
+            owned[var] = { V for V, who in owners.items() if who }
+        else:
+            owned[var] = { V for V, who in zip(Env.get(var, []), owners) if who }
+    return owned
+# }}}
+def snapshot_of(Env, OS):                                   # {{{
+    """
+    The snapshot of Env, whose SETAPP_LEDGER must be current:
+        { 'format', 'OS', 'tools' : [ app/ver, ... ],
+          'vars' : { var : [ [ value or Base, owners ], ... ] } }
+    """
+    ledger = parse_ledger(Env)
+    vars_  = {}
+    for var, owners in ledger.items():
+        entries = []
+        for value, who in zip(Env[var], owners):
+            if who:
+                entries.append( [ value, who ] )
+            elif [ Base, '' ] not in entries:
+                entries.append( [ Base, '' ] )
+        vars_[var] = entries
+    return { 'format' : SNAPSHOT_FORMAT, 'OS' : OS,
+             'tools'  : [ t for t in ':'.join(Env['SETAPP_TOOLS']).split(':')
+                          if t ],
+             'vars'   : vars_ }
+# }}}
+def restore_delta(snap, Old_Env, owned):                    # {{{
+    """
+    The delta from Old_Env to the environment snap describes, where
+    owned is owned_values() of Old_Env.
+    """
+    tools = snap['tools']
+    delta, items = {}, {}
+    for var in sorted(set(owned) | set(snap['vars'])):
+        base = [ V for V in Old_Env.get(var, []) if V not in owned.get(var, ()) ]
+        who  = {}
+        new  = SA.env_list(var)
+        for value, owners in snap['vars'].get(var, [ [ Base, '' ] ]):
+            if value is Base:
+                for V in base:
+                    new.append(V)
+            else:
+                new.append(value)
+                who.setdefault(value, owners)
+        final = SA.split_env_var(var, SA.join_env_var(var, new)) if new else []
+        if final != Old_Env.get(var, []):
+            delta[var] = final
+        marks = [ who.get(V, '') for V in final ]
+        while marks and not marks[-1]:
+            marks.pop()
+        if SA.join_env_var(var, final):
+            items[var] = f'{var}={SA.ledger_checksum(final)}={",".join(marks)}'
+    ledger = [ str(SA.LEDGER_FORMAT), SA.ledger_checksum(tools) ] + \
+             [ items[var] for var in sorted(items) ]
+    if ':'.join(tools) != ':'.join(Old_Env.get('SETAPP_TOOLS', [])):
+        delta['SETAPP_TOOLS'] = tools
+    if [ ';'.join(ledger) ] != Old_Env.get('SETAPP_LEDGER'):
+        delta['SETAPP_LEDGER'] = [ ';'.join(ledger) ]
+    if delta and 'SETAPP_STATE' in Old_Env:
+        delta['SETAPP_STATE'] = []    # the next "setapp APP" sets it again
+    return delta
+# }}}
+def catalog_index(args):                                    # {{{
+    app_data = SA.load_app_data(verbose=args.verbose, infile=args.infile,
+                                use_cache=args.use_cache)
+    SA.set_this_os()
+    return SA.Resolved(app_data, SA.This_OS)
+# }}}
+def resolve(index, tools, Old_Env, owned):                  # {{{
+    """
+    The snapshot of the environment "setapp TOOLS" leaves once the
+    tools loaded in Old_Env are removed, or None if they can't all
+    be loaded.
+    """
+    Base_Env = { var : [ V for V in values if V not in owned.get(var, ()) ]
+                 for var, values in Old_Env.items()
+                 if var not in ('SETAPP_TOOLS', 'SETAPP_LEDGER',
+                                'SETAPP_STATE') }
+    Base_Env = { var : values for var, values in Base_Env.items() if values }
+    delta = SA.swap_app(index, tools, Base_Env, {})
+    if delta is None:
+        return None
+    After = dict(Base_Env)
+    for var, values in delta.items():
+        ref = f'${{{var}}}'
+        joined = SA.join_env_var(var, [ SA.join_env_var(var, Base_Env.get(var, []))
+                                        if V == ref else V for V in values ])
+        if values:
+            After[var] = SA.split_env_var(var, joined)
+        else:
+            After.pop(var, None)
+    After['SETAPP_LEDGER'] = SA.ledger_value(index, Base_Env, {}, delta)
+    return snapshot_of(After, index.OS)
+# }}}
+def save(args):                                             # {{{
+    """
+    Handle --save NAME.  Returns the exit status.
+    """
+    Old_Env = SA.get_current_env()
+    if not ':'.join(Old_Env.get('SETAPP_TOOLS', [])).strip(':'):
+        print('no applications are loaded, nothing to save')
+        return 1
+    index = catalog_index(args)
+    if parse_ledger(Old_Env) is None:
+        # rebuild the ledger from the catalog
+        ledger = SA.read_ledger(index, Old_Env)
+        Old_Env['SETAPP_LEDGER'] = SA.ledger_value(index, Old_Env, ledger, {})
+    snap   = snapshot_of(Old_Env, index.OS)
+    digest = store(args.save, SA.catalog_stamp(args.infile), snap)
+    print(f'saved {args.save} ({digest}): {" ".join(snap["tools"])}')
+    return 0
+# }}}
+def restore(args):                                          # {{{
+    """
+    Handle --restore NAME.  Returns the delta to write, or None
+    after printing why there is none.
+    """
+    names   = read_json(names_file(), {})
+    entries = names.get(args.restore)
+    if not entries:
+        known = ', '.join(sorted(names)) or 'none'
+        print(f'no snapshot named {args.restore}; saved snapshots: {known}')
+        return None
+    stamp   = SA.catalog_stamp(args.infile)
+    Old_Env = SA.get_current_env()
+    ledger  = parse_ledger(Old_Env)
+    digest  = dict(map(tuple, entries)).get(stamp)
+    snap    = read_json(object_file(digest), None) if digest else None
+    if snap is not None and snap.get('format') == SNAPSHOT_FORMAT and \
+       ledger is not None:
+        if args.verbose:
+            print(f'restoring {args.restore} ({digest})')
+        return restore_delta(snap, Old_Env, owned_values(Old_Env, ledger))
+
+    index = catalog_index(args)
+    owned = owned_values(Old_Env, SA.read_ledger(index, Old_Env))
+    if snap is None or snap.get('format') != SNAPSHOT_FORMAT:
+        latest = read_json(object_file(entries[0][1]), None)
+        if latest is None:
+            print(f'snapshot {args.restore} is missing from {SNAPSHOT_DIR}')
+            return None
+        print(f'the catalog changed since {args.restore} was saved, '
+              f'resolving {" ".join(latest["tools"])} again')
+        snap = resolve(index, latest['tools'], Old_Env, owned)
+        if snap is None:
+            return None
+        store(args.restore, stamp, snap)
+    return restore_delta(snap, Old_Env, owned)
+# }}}
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+"""
+Summarize the usage log (setapp --stats [--json]).
+
+With SETAPP_USAGE_LOG set every setapp command appends one JSON line
+to the log (see setapp_core.log_usage()).  The log and its rotated
+copies are read oldest first, a line at a time, into counts per
+application, version, OS and shell, and latency histograms per
+command and per day.  A histogram has BUCKETS buckets per doubling
+of the time (about 9% wide), so the percentiles it reports are
+within a bucket of the exact ones whatever the size of the logs.
+"""
+import sys
+import os
+import setapp_core as SA
+
+BUCKETS    = 8     # histogram buckets per doubling of the latency
+Shown_Days = 14    # most recent days in the report
+
+class Histogram:                                            # {{{
+    """
+    Latencies in ms, counted in log-scaled buckets.
+    """
+    __slots__ = ('counts', 'n', 'max')
+    def __init__(self):
+        self.counts = {}
+        self.n      = 0
+        self.max    = 0.0
+
+    def add(self, ms):
+        import math
+        b = max(0, int(BUCKETS*math.log2(max(ms, 0.01)*100)))
+        self.counts[b] = self.counts.get(b, 0) + 1
+        self.n  += 1
+        self.max = max(self.max, ms)
+
+    def percentile(self, q):
+        """
+        The upper edge of the bucket holding the q-th percentile.
+        """
+        seen, want = 0, q/100*self.n
+        for b in sorted(self.counts):
+            seen += self.counts[b]
+            if seen >= want:
+                return min(self.max, 2**((b + 1)/BUCKETS)/100)
+        return self.max
+
+    def summary(self):
+        return { 'runs' : self.n,
+                 'p50'  : round(self.percentile(50), 2),
+                 'p90'  : round(self.percentile(90), 2),
+                 'p99'  : round(self.percentile(99), 2),
+                 'max'  : round(self.max, 2) }
+# }}}
+def log_files(Log):                                         # {{{
+    """
+    The usage log and its rotated copies that exist, oldest first.
+    """
+    files = [ f'{Log}.{i}' for i in range(SA.USAGE_LOG_KEEP, 0, -1) ] + [ Log ]
+    return [ F for F in files if os.path.exists(F) ]
+# }}}
+def records(files):                                         # {{{
+    """
+    Yield the records in files, skipping lines that don't parse
+    (eg one cut short by a full disk).
+    """
+    import json
+    for F in files:
+        with open(F, 'rb') as fh:
+            for line in fh:
+                try:
+                    R = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(R, dict) and isinstance(R.get('ms'), (int, float)):
+                    yield R
+# }}}
+def aggregate(stream):                                      # {{{
+    """
+    One pass over the records:
+        { 'runs', 'first', 'last',
+          'commands' : { cmd : { 'hist', 'failed', 'cache_hits' } },
+          'days'     : { YYYY-MM-DD : Histogram },
+          'apps'     : { app : { 'loads', 'last', 'versions' : { ver : n } } },
+          'os'       : { OS : n }, 'shell' : { shell : n } }
+    """
+    import time
+    stats = { 'runs' : 0, 'first' : None, 'last' : None, 'commands' : {},
+              'days' : {}, 'apps' : {}, 'os' : {}, 'shell' : {} }
+    for R in stream:
+        t = R.get('t', 0)
+        stats['runs'] += 1
+        stats['first'] = t if stats['first'] is None else min(stats['first'], t)
+        stats['last']  = t if stats['last']  is None else max(stats['last'], t)
+        C = stats['commands'].setdefault(R.get('cmd', 'other'),
+                { 'hist' : Histogram(), 'failed' : 0, 'cache_hits' : 0 })
+        C['hist'].add(R['ms'])
+        C['failed']     += R.get('status', 0) != 0
+        C['cache_hits'] += R.get('cache') == 'hit'
+        day = time.strftime('%Y-%m-%d', time.localtime(t))
+        stats['days'].setdefault(day, Histogram()).add(R['ms'])
+        for K in ('os', 'shell'):
+            V = str(R.get(K) or '-')
+            stats[K][V] = stats[K].get(V, 0) + 1
+        if R.get('cmd') not in ('add', 'restore', None):
+            continue
+        for A in R.get('apps') or ():
+            app, sep, ver = str(A).lstrip('+').partition('/')
+            E = stats['apps'].setdefault(app, { 'loads' : 0, 'last' : t,
+                                                'versions' : {} })
+            E['loads'] += 1
+            E['last']   = max(E['last'], t)
+            ver = ver or '-'
+            E['versions'][ver] = E['versions'].get(ver, 0) + 1
+    return stats
+# }}}
+def as_json(stats):                                         # {{{
+    out = dict(stats)
+    out['commands'] = { cmd : { **C['hist'].summary(), 'failed' : C['failed'],
+                                'cache_hits' : C['cache_hits'] }
+                        for cmd, C in stats['commands'].items() }
+    out['days'] = { day : H.summary() for day, H in stats['days'].items() }
+    return out
+# }}}
+def print_report(Log, stats):                               # {{{
+    import time
+    date = lambda t: time.strftime('%Y-%m-%d', time.localtime(t))
+    print(f"usage log {Log}: {stats['runs']} runs, {date(stats['first'])} "
+          f"to {date(stats['last'])}\n")
+    print(f'{"command":14s} {"runs":>7s} {"failed":>7s} {"cache hit":>9s} '
+          f'{"p50 ms":>8s} {"p90 ms":>8s} {"p99 ms":>8s} {"max ms":>8s}')
+    for cmd, C in sorted(stats['commands'].items(),
+                         key=lambda item: -item[1]['hist'].n):
+        S = C['hist'].summary()
+        hits = f"{100*C['cache_hits']/S['runs']:.0f}%"
+        print(f"{cmd:14s} {S['runs']:7d} {C['failed']:7d} {hits:>9s} "
+              f"{S['p50']:8.1f} {S['p90']:8.1f} {S['p99']:8.1f} {S['max']:8.1f}")
+    print(f'\n{"day":14s} {"runs":>7s} {"p50 ms":>8s} {"p90 ms":>8s} '
+          f'{"p99 ms":>8s}')
+    for day in sorted(stats['days'])[-Shown_Days:]:
+        S = stats['days'][day].summary()
+        print(f"{day:14s} {S['runs']:7d} {S['p50']:8.1f} {S['p90']:8.1f} "
+              f"{S['p99']:8.1f}")
+    print(f'\n{"application":14s} {"loads":>7s} {"last used":>10s}  versions')
+    for app, E in sorted(stats['apps'].items(), key=lambda item:
+                         (-item[1]['loads'], item[0])):
+        vers = ', '.join(f'{V} {n}' for V, n in
+                         sorted(E['versions'].items(), key=lambda item: -item[1]))
+        print(f"{app:14s} {E['loads']:7d} {date(E['last']):>10s}  {vers}")
+    for K in ('os', 'shell'):
+        counts = ', '.join(f'{V} {n}' for V, n in
+                           sorted(stats[K].items(), key=lambda item: -item[1]))
+        print(f'\n{"OS" if K == "os" else K}: {counts}', end='')
+    print()
+# }}}
+def run(args):                                              # {{{
+    """
+    Handle --stats.  Returns the exit status.
+    """
+    Log   = SA.usage_log()
+    files = log_files(Log)
+    if not files:
+        print(f'no usage log at {Log}; set SETAPP_USAGE_LOG to record one')
+        return 1
+    stats = aggregate(records(files))
+    if args.json:
+        import json
+        print(json.dumps(as_json(stats), indent=1))
+    elif stats['runs']:
+        print_report(Log, stats)
+    else:
+        print(f'{Log} has no records')
+    return 0
+# }}}
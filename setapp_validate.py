@@ -0,0 +1,389 @@
+#!/usr/bin/env python
+"""
+Catalog validator (setapp --validate).
+
+Every catalog file, or every APP.yaml file of a catalog directory, is
+parsed and checked on its own in a pool of worker processes; files
+larger than CHUNK_LINES are split at their top level keys so that
+one big Setapp_inputs.yaml is spread over the pool too.  Problems are
+reported with the file and line they come from instead of stopping
+at the first bad file as loading does.
+
+The per-file checks are the shape and type checks loading applies
+(setapp_core.app_data_errors) plus warnings for duplicate keys and
+for version keys YAML reads as numbers that don't print back the way
+they were typed (2020.10 -> 2020.1).  Once every file is in, the
+cross-file checks run: OS keys missing from the OS_aliases of all
+files combined, applications defined more than once, and
+applications that, merged over every layer, lack a name, default or
+ver or have a default naming no version
+(setapp_core.merged_app_errors).  Each argument is one layer, eg
+the site catalog and the user's ~/.config/setapp/inputs.yaml; an
+application defined twice within a layer is an error, one a later
+layer redefines is a warning since that's how a user overrides a
+site entry.
+"""
+import sys
+import os
+import setapp_core as SA
+
+CHUNK_LINES = 20000       # split files longer than this at top level keys
+POOL_BYTES  = 256*1024    # check less YAML than this in process
+
+def split_file(File):                                       # {{{
+    """
+    Return the (File, first_line, text) parts of one catalog file.
+    Only plain block mappings are split; anything with document
+    markers or a flow style top level is checked in one piece.
+    """
+    with open(File) as fh:
+        text = fh.read()
+    lines = text.splitlines(keepends=True)
+    if len(lines) <= CHUNK_LINES:
+        return [ (File, 0, text) ]
+    starts = []
+    for i, L in enumerate(lines):
+        c = L[:1]
+        if c in ('', ' ', '\t', '\n', '\r', '#'):
+            continue
+        if c in ('-', '{', '[', '%', '&', '*', '!', '?'):
+            return [ (File, 0, text) ]   # not a plain block mapping
+        starts.append(i)
+    tasks = []
+    first = 0
+    for i in starts[1:]:
+        if i - first >= CHUNK_LINES:
+            tasks.append( (File, first, ''.join(lines[first:i])) )
+            first = i
+    tasks.append( (File, first, ''.join(lines[first:])) )
+    return tasks
+# }}}
+def plain(node, path, lines, dups):                         # {{{
+    """
+    Convert a composed YAML node to dicts, lists and strings, keeping
+    keys and scalars as typed.  lines maps each path to its 0-based
+    line in the chunk; repeated keys are appended to dups.
+    """
+    import yaml
+    lines[path] = node.start_mark.line
+    if isinstance(node, yaml.MappingNode):
+        out = {}
+        for k_node, v_node in node.value:
+            key = k_node.value if isinstance(k_node, yaml.ScalarNode) \
+                  else repr(k_node.value)
+            if key in out and path:
+                dups.append( (path + (key,), k_node.start_mark.line,
+                              lines[path + (key,)]) )
+            out[key] = plain(v_node, path + (key,), lines, dups)
+            lines[path + (key,)] = k_node.start_mark.line
+        return out
+    if isinstance(node, yaml.SequenceNode):
+        return [ plain(v, path + (i,), lines, dups)
+                 for i, v in enumerate(node.value) ]
+    if node.tag == 'tag:yaml.org,2002:null':
+        return None
+    return node.value
+# }}}
+def number_keys(node, first_line, constructor):             # {{{
+    """
+    Yield (line, message) for version keys, and defaults, that YAML
+    reads as numbers which print differently from how they're typed.
+    """
+    import yaml
+    numeric = ('tag:yaml.org,2002:int', 'tag:yaml.org,2002:float')
+    for k_node, v_node in node.value:
+        if not isinstance(v_node, yaml.MappingNode):
+            continue
+        for k2, v2 in v_node.value:
+            if k2.value == 'ver' and isinstance(v2, yaml.MappingNode):
+                scalars = [ k for k, v in v2.value ]
+            elif k2.value == 'default':
+                scalars = [ v2 ]
+            else:
+                continue
+            for s in scalars:
+                if s.tag not in numeric:
+                    continue
+                try:
+                    read = str(constructor.construct_object(s))
+                except Exception:
+                    continue
+                if read != s.value:
+                    yield (first_line + s.start_mark.line + 1,
+                           f'{k_node.value}: version "{s.value}" is read as '
+                           f'the number {read}; quote it')
+# }}}
+def check_text(task):                                       # {{{
+    """
+    Check one file or chunk; runs in a worker process.  Returns the
+    problems found plus what the cross-file checks need.
+    """
+    import yaml
+    File, first_line, text, want_paths = task
+    result = { 'problems' : [], 'apps' : [], 'aliases' : [], 'os_refs' : [],
+               'env' : [], 'list_vars' : {}, 'parts' : {} }
+    problems = result['problems']
+
+    loader = SA.yaml_loader()(text)
+    try:
+        node = loader.get_single_node()
+    except yaml.MarkedYAMLError as e:
+        if first_line and 'undefined alias' in str(e.problem):
+            result['retry'] = True       # an anchor in another chunk
+            return result
+        mark = e.problem_mark or e.context_mark
+        line = first_line + mark.line + 1 if mark else 0
+        problems.append( (File, line, 'error',
+                          f'{e.context + "; " if e.context else ""}{e.problem}') )
+        return result
+    except yaml.YAMLError as e:
+        problems.append( (File, first_line, 'error', str(e)) )
+        return result
+    finally:
+        loader.dispose()
+    if node is None:
+        return result
+    if not isinstance(node, yaml.MappingNode):
+        problems.append( (File, first_line + node.start_mark.line + 1, 'error',
+                          'the top level must be a dictionary of applications') )
+        return result
+
+    lines, dups = {}, []
+    y_data = plain(node, (), lines, dups)
+    for path, line, was in dups:
+        problems.append( (File, first_line + line + 1, 'warning',
+                          f'{"/".join(map(str, path))}: duplicate key, '
+                          f'replaces the one on line {first_line + was + 1}') )
+    for k_node, v_node in node.value:
+        if k_node.value not in SA.Setting_Keys:
+            result['apps'].append( (k_node.value,
+                                    first_line + k_node.start_mark.line + 1) )
+
+    aliases = y_data.pop('OS_aliases', None)
+    if aliases is not None:
+        if not isinstance(aliases, dict):
+            problems.append( (File, first_line + lines[('OS_aliases',)] + 1,
+                              'error', 'OS_aliases must define a dictionary') )
+        else:
+            for release, OS in aliases.items():
+                result['aliases'].append( (release, OS, first_line +
+                                           lines[('OS_aliases', release)] + 1) )
+
+    list_vars = y_data.pop('List_vars', None)
+    if list_vars is not None:
+        bad = False
+        for path, msg in SA.list_vars_errors(list_vars):
+            problems.append( (File, first_line + lines[path] + 1, 'error',
+                              f'{"/".join(map(str, path))}: {msg}') )
+            bad = True
+        if not bad:
+            result['list_vars'] = list_vars
+
+    for path, msg in SA.app_data_errors(y_data):
+        at = path
+        while at not in lines:
+            at = at[:-1]
+        problems.append( (File, first_line + lines[at] + 1, 'error',
+                          f'{"/".join(map(str, path))}: {msg}') )
+
+    # what merged_app_errors() needs once every layer is in
+    for app, app_data in y_data.items():
+        if isinstance(app_data, dict) and \
+           isinstance(app_data.get('ver', {}), dict):
+            part = { k : str(app_data[k]) for k in ('name', 'default')
+                     if k in app_data }
+            if 'ver' in app_data:
+                part['ver'] = { str(V) : {} for V in app_data['ver'] }
+            result['parts'][app] = part
+
+    import yaml.constructor
+    constructor = yaml.constructor.SafeConstructor()
+    for line, msg in number_keys(node, first_line, constructor):
+        problems.append( (File, line, 'warning', msg) )
+
+    for app, app_data in y_data.items():
+        if not isinstance(app_data, dict) or \
+           not isinstance(app_data.get('ver'), dict):
+            continue
+        for version, entries in app_data['ver'].items():
+            if not isinstance(entries, dict):
+                continue
+            for OS in entries:
+                path = (app, 'ver', version, OS)
+                result['os_refs'].append( (OS, first_line + lines[path] + 1,
+                                           '/'.join(path)) )
+                env = entries[OS].get('env') \
+                      if isinstance(entries[OS], dict) else None
+                if not want_paths or not isinstance(env, list):
+                    continue
+                for i, setting in enumerate(env):
+                    if not isinstance(setting, dict):
+                        continue
+                    for var, value in setting.items():
+                        result['env'].append( (OS, var, value,
+                            first_line + lines[path + ('env', i)] + 1,
+                            f'{app}/{version}') )
+    return result
+# }}}
+def check_tasks(tasks, jobs=None):                          # {{{
+    """
+    Run check_text() over tasks, in a process pool when there is
+    enough YAML to pay for one.  Results are in task order.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    size = sum(len(t[2]) for t in tasks)
+    if jobs == 1 or len(tasks) == 1 or size < POOL_BYTES:
+        return [ check_text(t) for t in tasks ]
+    import concurrent.futures
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(check_text, tasks,
+                             chunksize=max(1, len(tasks) // (4*jobs))))
+# }}}
+def validate(layers, jobs=None, check_paths=None):          # {{{
+    """
+    Check the catalog files and directories in layers, in load
+    order.  Returns (problems, n_files, n_apps) where problems is a
+    list of (file, line, severity, message), severity being 'error'
+    or 'warning'.  With check_paths the paths in the env entries
+    for this host's OS are stat'ed too (see setapp_paths); the
+    ones that are missing or slow are errors if check_paths is
+    "fail", warnings otherwise.
+    """
+    problems = []
+    tasks    = []
+    layer_of = {}
+    for n, path in enumerate(layers):
+        if not os.path.exists(path):
+            problems.append( (path, 0, 'error', 'no such file or directory') )
+            continue
+        files = SA.expand_catalog([path])
+        for File in files:
+            layer_of[File] = n
+            try:
+                tasks += [ T + (bool(check_paths),) for T in split_file(File) ]
+            except (OSError, UnicodeDecodeError) as e:
+                problems.append( (File, 0, 'error', str(e)) )
+
+    results = check_tasks(tasks, jobs)
+    retry = { T[0] for T, R in zip(tasks, results) if R.pop('retry', False) }
+    for File in retry:                 # check the whole file instead
+        with open(File) as fh:
+            whole = check_text( (File, 0, fh.read(), bool(check_paths)) )
+        for i, T in enumerate(tasks):
+            if T[0] == File:
+                results[i] = whole
+                whole = { 'problems' : [], 'apps' : [], 'aliases' : [],
+                          'os_refs' : [], 'env' : [], 'list_vars' : {},
+                          'parts' : {} }
+
+    OS_names = set()
+    for R in results:
+        OS_names.update( OS for release, OS, line in R['aliases'] )
+
+    if check_paths:
+        for R in results:
+            SA.use_settings({ 'List_vars' : R['list_vars'] })
+        problems += path_problems(tasks, results, check_paths)
+
+    seen  = {}       # app -> (File, line) of its latest definition
+    parts = {}       # app -> its definitions, in load order
+    for (File, first_line, text, want), R in zip(tasks, results):
+        problems += R['problems']
+        for OS, line, where in R['os_refs']:
+            if OS not in OS_names:
+                problems.append( (File, line, 'error', f'{where}: OS "{OS}" '
+                                  f'is not defined in the OS_aliases map') )
+        for app, line in R['apps']:
+            if app in seen:
+                F0, L0 = seen[app]
+                if F0 == File:
+                    problems.append( (File, line, 'error', f'{app}: defined '
+                                      f'again, first on line {L0}') )
+                elif layer_of[F0] == layer_of[File]:
+                    problems.append( (File, line, 'error', f'{app}: also '
+                                      f'defined in {F0}:{L0}') )
+                else:
+                    problems.append( (File, line, 'warning', f'{app}: '
+                                      f'overrides the definition in {F0}:{L0}') )
+            seen[app] = (File, line)
+            if app in R['parts']:
+                parts.setdefault(app, []).append(R['parts'][app])
+
+    for app, defs in parts.items():
+        File, line = seen[app]
+        for path, msg in SA.merged_app_errors(app,
+                                              SA.merge_layers(app, defs)):
+            problems.append( (File, line, 'error',
+                              f'{"/".join(map(str, path))}: {msg}') )
+
+    order = { File : i for i, File in enumerate(layer_of) }
+    problems.sort(key=lambda p: (order.get(p[0], -1), p[1]))
+    return problems, len(layer_of), len(seen)
+# }}}
+def path_problems(tasks, results, mode):                     # {{{
+    """
+    Problems for the env entry paths, of this host's OS, that
+    setapp_paths.check() finds missing or slow.
+    """
+    import setapp_paths
+    release = os.uname().release
+    host_OS = None
+    for R in results:
+        for rel, OS, line in R['aliases']:
+            if rel == release:
+                host_OS = OS
+    if host_OS is None:
+        return [ ('', 0, 'warning', f'this host, uname -r = {release}, is '
+                  f'not in OS_aliases; paths not checked') ]
+    owners = {}     # path -> [(File, line, app/version, var), ...]
+    for T, R in zip(tasks, results):
+        for OS, var, value, line, app_ver in R['env']:
+            if OS != host_OS:
+                continue
+            verb, clean_var, _ = SA.env_var_action(var)
+            for P in setapp_paths.path_values(clean_var, value):
+                owners.setdefault(P, []).append( (T[0], line, app_ver, var) )
+    status   = setapp_paths.check(list(owners))
+    severity = 'error' if mode == 'fail' else 'warning'
+    problems = []
+    for P, S in status.items():
+        if S == 'ok':
+            continue
+        for File, line, app_ver, var in owners[P]:
+            problems.append( (File, line, severity, f'{app_ver} {var}: {P} '
+                              f'{setapp_paths.describe(S)}') )
+    return problems
+# }}}
+def run(layers, as_json=False, jobs=None,                   # {{{
+        check_paths=None):
+    """
+    Validate layers and print the report, as text lines
+    "FILE:LINE: SEVERITY: MESSAGE" or as JSON.  Returns the exit
+    status: 1 if there were errors, 0 otherwise.
+    """
+    import time
+    t0 = time.perf_counter()
+    problems, n_files, n_apps = validate(layers, jobs, check_paths)
+    seconds  = time.perf_counter() - t0
+    n_errors = sum(1 for p in problems if p[2] == 'error')
+    n_warn   = len(problems) - n_errors
+    if as_json:
+        import json
+        json.dump({ 'files'    : n_files,
+                    'apps'     : n_apps,
+                    'errors'   : n_errors,
+                    'warnings' : n_warn,
+                    'seconds'  : round(seconds, 3),
+                    'problems' : [ { 'file' : F, 'line' : L, 'severity' : S,
+                                     'message' : M }
+                                   for F, L, S, M in problems ] },
+                  sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        for F, L, S, M in problems:
+            print(f'{F}:{L}: {S}: {M}')
+        print(f'{n_files} file{"s"[:n_files != 1]}, {n_apps} '
+              f'applications: {n_errors} errors, {n_warn} '
+              f'warnings ({seconds:.2f} s)')
+    return 1 if n_errors else 0
+# }}}
@@ -0,0 +1,365 @@
+#!/usr/bin/env python
+"""
+Time catalog handling on a synthetic catalog, phase by phase:
+
+  compile   parse and validate the YAML (compile_app_data)
+  load      read the compiled catalog cache (load_app_data, warm)
+  resolve   look up --touch app names in a fresh Resolved index
+  add       add_app() of --touch apps to a PATH of --path-len entries
+  swap      swap_app() of the same apps, as "setapp APP ..." plans it
+  remove    rm_app() of those apps once they're loaded
+  dotfile   write_dotfile() of the add delta
+  render    setapp_render.render() of the whole catalog
+  search    --by-cat of two categories and a two word --search,
+            from the warm search index
+
+plus full "setapp.py" invocations (-g, -e APP, and adding --touch
+apps) in a subprocess.  Each is run --repeat times; the median, 90th
+and 95th percentiles and the minimum are reported with the peak
+memory: traced Python allocations for the phases (one extra untimed
+run) and the child's max RSS for the command lines.
+
+--save FILE stores the results as JSON; --compare FILE checks the
+medians against such a baseline and exits non-zero if any phase got
+slower by more than --tolerance percent.
+"""
+import sys
+import os
+import argparse
+import contextlib
+import io
+import json
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+Test_Dir = os.path.dirname(os.path.abspath(__file__))
+Top_Dir  = os.path.dirname(Test_Dir)
+sys.path.insert(0, Top_Dir)
+import setapp_core as SA
+
+def parse_args():                                           # {{{
+    parser = argparse.ArgumentParser(description=
+    """Benchmark loading, resolving, adding, removing and rendering
+    applications from a synthetic catalog.""")
+
+    parser.add_argument('-a', '--apps', dest='n_apps',
+        action='store', type=int, default=1000,
+        help='Number of applications in the catalog [1000].')
+
+    parser.add_argument('--versions', dest='n_versions',
+        action='store', type=int, default=3,
+        help='Versions per application [3].')
+
+    parser.add_argument('--os', dest='n_os',
+        action='store', type=int, default=2,
+        help='OS aliases; every version is defined for each [2].')
+
+    parser.add_argument('--env', dest='n_env',
+        action='store', type=int, default=5,
+        help='env entries per version [5].')
+
+    parser.add_argument('--path-len', dest='path_len',
+        action='store', type=int, default=20,
+        help='Number of entries in the starting PATH [20].')
+
+    parser.add_argument('-t', '--touch', dest='n_touch',
+        action='store', type=int, default=10,
+        help='Applications each add/remove/swap handles [10].')
+
+    parser.add_argument('--sharded', dest='sharded',
+        action='store_true', default=False,
+        help='Write the catalog as a directory of APP.yaml files.')
+
+    parser.add_argument('-n', '--repeat', dest='repeat',
+        action='store', type=int, default=20,
+        help='Number of timed runs of each phase [20].')
+
+    parser.add_argument('--no-cli', dest='cli',
+        action='store_false', default=True,
+        help='Skip the setapp.py command lines.')
+
+    parser.add_argument('--no-render', dest='render',
+        action='store_false', default=True,
+        help='Skip the render phase.')
+
+    parser.add_argument('--save', dest='save', metavar='FILE',
+        action='store', type=str, default=None,
+        help='Write the results to FILE as JSON.')
+
+    parser.add_argument('--compare', dest='compare', metavar='FILE',
+        action='store', type=str, default=None,
+        help='Compare medians to the results saved in FILE.')
+
+    parser.add_argument('--tolerance', dest='tolerance',
+        action='store', type=float, default=20.0,
+        help='Allowed slowdown versus --compare, in percent [20].')
+
+    return parser.parse_args()
+# }}}
+def config(args):                                           # {{{
+    return { k : getattr(args, k) for k in ('n_apps', 'n_versions', 'n_os',
+             'n_env', 'path_len', 'n_touch', 'sharded') }
+# }}}
+def app_yaml(i, args, OSes):                                # {{{
+    app = f'pkg{i:05d}'
+    versions = [ f'{v + 1}.0' for v in range(args.n_versions) ]
+    lines = [ f'{app} :',
+              f'  name : Package {i}',
+              f'  category : [ bench, group{i % 17} ]',
+              f'  default : "{versions[-1]}"',
+              f'  ver :' ]
+    for v in versions:
+        prefix = f'/opt/{app}/{v}'
+        env = [ f'PATH+ : {prefix}/bin', f'MANPATH : {prefix}/man',
+                f'LD_LIBRARY_PATH : {prefix}/lib',
+                f'LM_LICENSE_FILE : 27000@license{i % 5}' ]
+        env += [ f'{app.upper()}_VAR{k}! : {prefix}/etc/{k}'
+                 for k in range(max(0, args.n_env - len(env))) ]
+        lines.append(f'    "{v}" :')
+        for OS in OSes:
+            lines.append(f'      {OS} :')
+            lines.append(f'        env :')
+            lines += [ f'          - {e}' for e in env[:args.n_env] ]
+    return app, '\n'.join(lines) + '\n'
+# }}}
+def write_catalog(top, args):                               # {{{
+    """
+    Write the synthetic catalog under top; returns its path (a file,
+    or a directory with --sharded).  uname -r maps to Bench_OS_0.
+    """
+    OSes = [ f'Bench_OS_{k}' for k in range(args.n_os) ]
+    aliases = 'OS_aliases :\n' + f'  {os.uname().release} : {OSes[0]}\n' + \
+              ''.join(f'  bench-release-{k} : {OS}\n'
+                      for k, OS in enumerate(OSes[1:]))
+    apps = [ app_yaml(i, args, OSes) for i in range(args.n_apps) ]
+    if not args.sharded:
+        path = os.path.join(top, 'catalog.yaml')
+        with open(path, 'w') as fh:
+            fh.write(aliases + ''.join(text for app, text in apps))
+        return path
+    path = os.path.join(top, 'catalog.d')
+    os.makedirs(path)
+    with open(os.path.join(path, '00-OS_aliases.yaml'), 'w') as fh:
+        fh.write(aliases)
+    for app, text in apps:
+        with open(os.path.join(path, f'{app}.yaml'), 'w') as fh:
+            fh.write(text)
+    return path
+# }}}
+def start_environ(args):                                    # {{{
+    return { 'PATH' : ':'.join(f'/usr/local/tool{k}/bin'
+                               for k in range(args.path_len - 3)) +
+                      ':/usr/local/bin:/usr/bin:/bin',
+             'HOME' : os.environ.get('HOME', '/tmp') }
+# }}}
+def environ_after(environ, delta):                          # {{{
+    new = dict(environ)
+    for var, values in delta.items():
+        if not values:
+            new.pop(var, None)
+            continue
+        ref = f'${{{var}}}'
+        new[var] = ':'.join(environ.get(var, '') if v == ref else v
+                            for v in values)
+    return new
+# }}}
+def summarize(times, peak_kb):                              # {{{
+    q = statistics.quantiles(times, n=20) if len(times) > 1 else times*19
+    return { 'median' : statistics.median(times), 'p90' : q[17],
+             'p95' : q[18], 'min' : min(times), 'peak_kb' : peak_kb,
+             'runs' : len(times) }
+# }}}
+def time_phase(fn, repeat):                                 # {{{
+    """
+    Time fn() repeat times after a warm up run (output discarded)
+    then once more under tracemalloc for its peak allocation.
+    """
+    times = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        fn()                                      # warm up
+    for i in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            t0 = time.perf_counter()
+            fn()
+            times.append(1000*(time.perf_counter() - t0))
+    tracemalloc.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return summarize(times, peak // 1024)
+# }}}
+def time_cli(cmd, env, repeat):                             # {{{
+    """
+    Time a command line; peak is the largest max RSS of its runs.
+    """
+    times, peak = [], 0
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        P = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL)
+        pid, status, usage = os.wait4(P.pid, 0)
+        times.append(1000*(time.perf_counter() - t0))
+        P.returncode = os.waitstatus_to_exitcode(status)
+        if P.returncode:
+            raise subprocess.CalledProcessError(P.returncode, cmd)
+        peak = max(peak, usage.ru_maxrss)
+    return summarize(times, peak)
+# }}}
+def run_cli(args, top, catalog, apps, specs, environ):      # {{{
+    """
+    Time the command lines.  Run before anything is loaded here:
+    a child's max RSS starts out at its parent's size.
+    """
+    results = {}
+    env = { **os.environ, **environ, 'HOME' : top,
+            'XDG_CACHE_HOME' : os.path.join(top, 'cli-cache'),
+            'SETAPP_DOTFILE' : os.path.join(top, 'cli_env') }
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    cmd = [ sys.executable, os.path.join(Top_Dir, 'setapp.py'),
+            '-i', catalog ]
+    subprocess.run(cmd + ['--no-daemon', '-e', apps[0]], env=env,
+                   stdout=subprocess.DEVNULL, check=True)   # warm up
+    results['cli -g'] = time_cli(cmd + ['-g'],
+        { **env, 'SETAPP_TOOLS' : apps[0] + '/1.0' }, args.repeat)
+    results['cli -e'] = time_cli(cmd + ['--no-daemon', '-e', apps[0]],
+                                 env, args.repeat)
+    results['cli add'] = time_cli(cmd + ['--no-daemon'] + specs,
+                                  env, args.repeat)
+    return results
+# }}}
+def run_phases(args, top, catalog, apps, specs, environ):   # {{{
+    results = {}
+    SA.SETAPP_CACHE_DIR = os.path.join(top, 'cache')
+    SA.SETAPP_DOTFILE   = os.path.join(top, 'my_env')
+
+    files = [ catalog ]
+    if not args.sharded:
+        results['compile'] = time_phase(
+            lambda: SA.compile_app_data(files), max(1, args.repeat // 4))
+    with contextlib.redirect_stdout(io.StringIO()):
+        SA.load_app_data(infile=catalog, rebuild=True)
+    results['load'] = time_phase(
+        lambda: SA.load_app_data(infile=catalog), args.repeat)
+    with contextlib.redirect_stdout(io.StringIO()):
+        app_data = SA.load_app_data(infile=catalog)
+        SA.set_this_os()
+
+    Old_Env = SA.get_current_env(environ)
+    index   = SA.Resolved(app_data, SA.This_OS)
+
+    def resolve():
+        I = SA.Resolved(app_data, SA.This_OS)
+        for A in specs:
+            SA.app_exists(I, A)
+    results['resolve'] = time_phase(resolve, args.repeat)
+
+    results['add'] = time_phase(
+        lambda: SA.add_app(index, specs, Old_Env), args.repeat)
+
+    def swap():
+        ledger = SA.read_ledger(index, Old_Env)
+        SA.swap_app(index, specs, Old_Env, ledger)
+    results['swap'] = time_phase(swap, args.repeat)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        ledger = SA.read_ledger(index, Old_Env)
+        delta  = SA.swap_app(index, specs, Old_Env, ledger)
+        delta['SETAPP_LEDGER'] = SA.ledger_value(index, Old_Env,
+                                                 ledger, delta)
+    loaded  = environ_after(environ, delta)
+    New_Env = SA.get_current_env(loaded)
+
+    def remove():
+        SA.rm_app(index, apps, New_Env,
+                  ledger=SA.read_ledger(index, New_Env))
+    results['remove'] = time_phase(remove, args.repeat)
+
+    results['dotfile'] = time_phase(
+        lambda: SA.write_dotfile(delta, 'bash'), args.repeat)
+
+    import setapp_search
+    with contextlib.redirect_stdout(io.StringIO()):
+        setapp_search.load(catalog, app_data)
+    def search():
+        payload = setapp_search.load(catalog, app_data)
+        setapp_search.in_categories(payload, ['bench', 'group3'])
+        setapp_search.matching(payload, 'pack 12')
+    results['search'] = time_phase(search, args.repeat)
+
+    if args.render:
+        import setapp_render
+        out_dir = os.path.join(top, 'render')
+        def render():
+            shutil.rmtree(out_dir, ignore_errors=True)
+            setapp_render.render(app_data, out_dir)
+        results['render'] = time_phase(render, max(1, args.repeat // 4))
+
+    return results
+# }}}
+def report(results, baseline, tolerance):                   # {{{
+    """
+    Print the results table; returns the phases slower than the
+    baseline by more than tolerance percent.
+    """
+    slower = []
+    print(f'{"phase":10s} {"median":>9s} {"p90":>9s} {"p95":>9s} '
+          f'{"min":>9s} {"peak KB":>9s}' +
+          (f' {"baseline":>9s} {"change":>7s}' if baseline else ''))
+    for phase, R in results.items():
+        line = (f'{phase:10s} {R["median"]:9.3f} {R["p90"]:9.3f} '
+                f'{R["p95"]:9.3f} {R["min"]:9.3f} {R["peak_kb"]:9d}')
+        B = (baseline or {}).get(phase)
+        if B:
+            change = 100*(R['median'] - B['median'])/B['median']
+            line  += f' {B["median"]:9.3f} {change:+6.1f}%'
+            # ignore jitter on phases that take a few microseconds
+            if change > tolerance and R['median'] - B['median'] > 0.05:
+                slower.append(phase)
+                line += '  SLOWER'
+        print(line)
+    print('times in ms')
+    return slower
+# }}}
+def main():                                                 # {{{
+    args = parse_args()
+    baseline = None
+    if args.compare:
+        with open(args.compare) as fh:
+            saved = json.load(fh)
+        if saved['config'] != config(args):
+            print(f'warning: {args.compare} was run with {saved["config"]}')
+        baseline = saved['results']
+
+    print(f'{args.n_apps} apps x {args.n_versions} versions x {args.n_os} '
+          f'OSes, {args.n_env} env entries, PATH of {args.path_len}, '
+          f'{args.n_touch} apps per command'
+          f'{", sharded" if args.sharded else ""}')
+    with tempfile.TemporaryDirectory(prefix='setapp-bench-') as top:
+        catalog = write_catalog(top, args)
+        rng   = random.Random(1)
+        apps  = [ f'pkg{i:05d}' for i in
+                  rng.sample(range(args.n_apps), min(args.n_touch, args.n_apps)) ]
+        specs = [ f'{a}/1.0' if k % 2 else a for k, a in enumerate(apps) ]
+        environ = start_environ(args)
+        results = {}
+        if args.cli:
+            results.update(run_cli(args, top, catalog, apps, specs, environ))
+        results.update(run_phases(args, top, catalog, apps, specs, environ))
+
+    slower = report(results, baseline, args.tolerance)
+    if args.save:
+        with open(args.save, 'w') as fh:
+            json.dump({ 'config' : config(args), 'results' : results,
+                        'python' : sys.version.split()[0] }, fh, indent=2)
+            fh.write('\n')
+    if slower:
+        print(f'FAIL slower than {args.compare} by more than '
+              f'{args.tolerance}%: {", ".join(slower)}')
+        sys.exit(1)
+# }}}
+if __name__ == "__main__": main()
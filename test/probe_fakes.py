@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""
+Run setapp --probe against the fake applications in test/apps.
+
+Writes a catalog in a temporary directory whose matlab, hdfview and
+nxnastran versions put the fakes on PATH, each probed with
+--version, plus --copies synthetic applications probing the fake
+nastran to time a large catalog, then runs
+    setapp.py -i CATALOG --probe all
+and exits with its status.  The fake hdfview wants java on PATH, so
+it fails where there is none.
+"""
+import sys
+import os
+import argparse
+import subprocess
+import tempfile
+
+Test_Dir = os.path.dirname(os.path.abspath(__file__))
+Top_Dir  = os.path.dirname(Test_Dir)
+Apps_Dir = os.path.join(Test_Dir, 'apps')
+
+def parse_args():                                           # {{{
+    parser = argparse.ArgumentParser(description=
+    """Probe the fake applications under test/apps.""")
+
+    parser.add_argument('-c', '--copies', dest='copies',
+        action='store', type=int, default=0,
+        help='Extra applications that probe the fake nastran [0].')
+
+    parser.add_argument('--json', dest='json',
+        action='store_true', default=False,
+        help='Ask setapp for the JSON report.')
+
+    parser.add_argument('-k', '--keep', dest='keep',
+        action='store_true', default=False,
+        help='Keep the temporary directory and print its name.')
+
+    return parser.parse_args()
+# }}}
+def catalog(copies):                                        # {{{
+    OS = 'Probe_OS'
+    lines = [ 'OS_aliases :', f'  {os.uname().release} : {OS}', '' ]
+
+    def app(name, default, versions, probe, extra_env=()):
+        lines.extend([ f'{name} :', f'  name : fake {name}',
+                       f'  default : "{default}"',
+                       f'  probe : [ {", ".join(probe)} ]', '  ver :' ])
+        for ver, bin_dir in versions:
+            lines.extend([ f'    "{ver}" :', f'      {OS} :', '        env :',
+                           f'          - PATH+ : {bin_dir}' ] +
+                         [ f'          - {e}' for e in extra_env ])
+        lines.append('')
+
+    app('matlab', '2022a',
+        [ (V, os.path.join(Apps_Dir, 'matlab', V, 'bin'))
+          for V in ('2018a', '2021b', '2022a') ],
+        [ 'matlab --version', 'mex --version', 'mexext --version' ],
+        [ 'LM_LICENSE_FILE : 1875@spaw' ])
+    app('hdfview', 'v3', [ ('v3', os.path.join(Apps_Dir, 'HDFView', 'v3')) ],
+        [ 'hdfview --version' ])
+    nastran = os.path.join(Apps_Dir, 'nxnastran', '2020', 'bin')
+    app('nxnastran', '2020', [ ('2020', nastran) ], [ 'nastran --version' ])
+    for i in range(copies):
+        app(f'pkg{i:05d}', '1.0', [ ('1.0', nastran) ], [ 'nastran --version' ])
+    return '\n'.join(lines)
+# }}}
+def main():                                                 # {{{
+    args = parse_args()
+    top  = tempfile.mkdtemp(prefix='setapp-probe-')
+    path = os.path.join(top, 'catalog.yaml')
+    with open(path, 'w') as fh:
+        fh.write(catalog(args.copies))
+    env = { **os.environ, 'HOME' : top,
+            'XDG_CACHE_HOME' : os.path.join(top, 'cache') }
+    env.pop('SETAPP_PATH', None)
+    cmd = [ sys.executable, os.path.join(Top_Dir, 'setapp.py'),
+            '-i', path, '--probe', 'all' ] + ([ '--json' ] if args.json else [])
+    status = subprocess.run(cmd, env=env).returncode
+    if args.keep:
+        print(f'catalog and cache in {top}')
+    else:
+        import shutil
+        shutil.rmtree(top, ignore_errors=True)
+    sys.exit(status)
+# }}}
+if __name__ == "__main__": main()
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+"""
+End to end checks of setapp.py against small throwaway catalogs.
+Each check runs a sequence of setapp commands in one bash shell,
+sourcing the dotfile after each as a user's setapp alias would,
+then looks at the environment that's left.  Exits non-zero if any
+check fails.
+"""
+import sys
+import os
+import subprocess
+import tempfile
+
+Test_Dir = os.path.dirname(os.path.abspath(__file__))
+Top_Dir  = os.path.dirname(Test_Dir)
+sys.path.insert(0, Top_Dir)
+
+OS = 'Test_OS'
+
+def catalog(home, text):                                    # {{{
+    """
+    Write a catalog for this host's OS, Test_OS; returns its path.
+    """
+    path = f'{home}/catalog.yaml'
+    with open(path, 'w') as fh:
+        fh.write(f'OS_aliases :\n  {os.uname().release} : {OS}\n' + text)
+    return path
+# }}}
+def shell(home, infile, steps, environ=None, render=False): # {{{
+    """
+    Run each step, the arguments of a setapp command, in one bash
+    shell that sources the dotfile after every command.  Returns
+    (the final environment, everything printed).  With render the
+    steps, "APP" or "-r APP", go to setapp_load / setapp_unload from
+    a --render of infile instead.
+    """
+    dot  = f'{home}/dotfile'
+    cmd  = f'{sys.executable} {Top_Dir}/setapp.py -i {infile} --no-daemon'
+    lines = []
+    if render:
+        lines += [ f'{cmd} --render {home}/render > /dev/null',
+                   f'. {home}/render/setapp.sh' ]
+    for step in steps:
+        if render:
+            lines.append(f'setapp_unload {step[3:]}' if step.startswith('-r ')
+                         else f'setapp_load {step}')
+            continue
+        lines += [ f'rm -f {dot}', f'{cmd} {step}',
+                   f'[ ! -r {dot} ] || . {dot}' ]
+    lines.append("printf '\\0'; env -0")
+    env = { 'HOME' : home, 'PATH' : '/usr/bin:/bin', 'SETAPP_DOTFILE' : dot,
+            'XDG_CACHE_HOME' : f'{home}/.cache', **(environ or {}) }
+    P = subprocess.run([ 'bash', '-c', '\n'.join(lines) ], env=env,
+                       stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                       text=True, check=True)
+    printed, sep, dump = P.stdout.partition('\0')
+    env_dump = {}
+    for item in dump.split('\0'):
+        var, sep, value = item.partition('=')
+        if sep:
+            env_dump[var] = value
+    return env_dump, printed
+# }}}
+def check_unset_scalar(home):                               # {{{
+    """
+    Removing a tool that overwrote a scalar (VAR!) leaves no ledger
+    entry for it, so --restore keeps its catalog-free fast path.
+    """
+    infile = catalog(home, '''
+t :
+  name : t
+  default : 1
+  ver :
+    1 :
+      Test_OS :
+        env :
+          - PATH+ : /opt/t/1/bin
+          - T_ARCH! : x86_64
+u :
+  name : u
+  default : 1
+  ver :
+    1 :
+      Test_OS :
+        env :
+          - PATH+ : /opt/u/1/bin
+''')
+    failures = []
+    env, out = shell(home, infile, [ 't u', '-r t' ])
+    if 'T_ARCH=' in env.get('SETAPP_LEDGER', ''):
+        failures.append(f'ledger still covers T_ARCH: {env["SETAPP_LEDGER"]}')
+    env, out = shell(home, infile, [ '--save snap', '-v --restore snap' ],
+                     environ=env)
+    if 'restoring snap' not in out:
+        failures.append('--restore did not take the fast path')
+    if env.get('SETAPP_TOOLS') != 'u/1':
+        failures.append(f'SETAPP_TOOLS is {env.get("SETAPP_TOOLS")}')
+    return failures
+# }}}
+def check_catalog_edit(home):                               # {{{
+    """
+    Adding a loaded tool again after its catalog entry changed puts
+    the new values in, and removing it then takes them out.
+    """
+    entry = '''
+x :
+  name : x
+  default : 1
+  ver :
+    1 :
+      Test_OS :
+        env :
+          - PATH+ : /opt/x/%s/bin
+'''
+    infile = catalog(home, entry % '111')
+    env, out = shell(home, infile, [ 'x' ])
+    catalog(home, entry % '222')
+    env, out = shell(home, infile, [ 'x' ], environ=env)
+    failures = []
+    if '/opt/x/222/bin' not in env['PATH'].split(':'):
+        failures.append(f'adding x again left PATH={env["PATH"]}')
+    env, out = shell(home, infile, [ '-r x' ], environ=env)
+    if '/opt/x/' in env['PATH']:
+        failures.append(f'removing x left PATH={env["PATH"]}')
+    return failures
+# }}}
+def check_render(home):                                     # {{{
+    """
+    setapp_load and setapp_unload leave what setapp itself would: a
+    value that was already there is moved rather than duplicated
+    and survives the unload.
+    """
+    infile = catalog(home, '''
+y :
+  name : y
+  default : 1
+  ver :
+    1 :
+      Test_OS :
+        env :
+          - PATH+ : /opt/y/bin
+          - Y_HOME : /opt/y
+''')
+    failures = []
+    steps    = [ 'y', '-r y', 'y' ]
+    environ  = { 'PATH' : '/usr/bin:/opt/y/bin:/bin' }
+    for n in range(1, len(steps) + 1):
+        python,   out = shell(home, infile, steps[:n], environ)
+        rendered, out = shell(home, infile, steps[:n], environ, render=True)
+        for var in ('PATH', 'Y_HOME', 'SETAPP_TOOLS'):
+            if python.get(var) != rendered.get(var):
+                failures.append(f'after {steps[:n]} {var} is '
+                                f'{rendered.get(var)}, not {python.get(var)}')
+    return failures
+# }}}
+def check_partial_layer(home):                              # {{{
+    """
+    A later layer can add a version without repeating the name and
+    default the site catalog gives, both for loading and --validate.
+    """
+    infile = catalog(home, '''
+z :
+  name : z
+  default : 1
+  ver :
+    1 :
+      Test_OS :
+        env :
+          - PATH+ : /opt/z/1/bin
+''')
+    layer = f'{home}/layer.yaml'
+    with open(layer, 'w') as fh:
+        fh.write('''
+z :
+  ver :
+    2 :
+      Test_OS :
+        env :
+          - PATH+ : /opt/z/2/bin
+''')
+    failures = []
+    env, out = shell(home, infile, [ 'z/2' ], { 'SETAPP_PATH' : layer })
+    if env.get('SETAPP_TOOLS') != 'z/2':
+        failures.append(f'loading z/2 from the layer failed:\n{out}')
+    env, out = shell(home, infile, [ f'--validate {infile} {layer}' ])
+    if ' 0 errors' not in out:
+        failures.append(f'--validate rejects the layer:\n{out}')
+    return failures
+# }}}
+def check_scan_shipped(home):                               # {{{
+    """
+    The shipped catalog can be compiled a section at a time; the
+    *PATH in its comments is no alias.
+    """
+    import setapp_core as SA
+    if SA.scan_catalog(f'{Top_Dir}/Setapp_inputs.yaml') is None:
+        return [ 'scan_catalog() gives up on Setapp_inputs.yaml' ]
+    return []
+# }}}
+Checks = [ check_unset_scalar, check_catalog_edit, check_render,
+           check_partial_layer, check_scan_shipped, ]
+
+def main():                                                 # {{{
+    failures = []
+    for check in Checks:
+        with tempfile.TemporaryDirectory() as home:
+            try:
+                failures += [ f'{check.__name__}: {F}' for F in check(home) ]
+            except subprocess.CalledProcessError as e:
+                failures.append(f'{check.__name__}: {e}\n{e.stdout}')
+    for F in failures:
+        print(f'FAIL {F}')
+    if failures:
+        sys.exit(1)
+    print('OK')
+# }}}
+if __name__ == "__main__": main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""
+Cold start regression check for the hot commands.  Exits non-zero if
+
+  * "setapp.py -g" (warm catalog cache) imports any of the modules
+    that are supposed to be loaded only on demand, or
+  * its median wall time exceeds that of a bare "python -c pass"
+    by more than the budget, or
+  * setapp_core.Quick_Defaults has drifted from the argparse defaults.
+
+The budget is measured on top of the interpreter's own start up
+time so the check means the same thing on fast and slow hosts.
+"""
+import sys
+import os
+import argparse
+import statistics
+import subprocess
+import tempfile
+import time
+
+Test_Dir = os.path.dirname(os.path.abspath(__file__))
+Top_Dir  = os.path.dirname(Test_Dir)
+sys.path.insert(0, Top_Dir)
+import setapp_core
+
+Lazy_Modules = [ 'argparse', 'yaml', 'rich', 'pprint', 'pickle',
+                 'pathlib', 'hashlib', 'tempfile', ]
+
+def parse_args():                                           # {{{
+    parser = argparse.ArgumentParser(description=
+    """Fail if the cold start of "setapp.py -g" goes over budget.""")
+
+    parser.add_argument('-b', '--budget', dest='budget_ms',
+        action='store', type=float, default=50.0,
+        help='Allowed time in milliseconds on top of the '
+             'interpreter start up [50].')
+
+    parser.add_argument('-n', '--repeat', dest='repeat',
+        action='store', type=int, default=15,
+        help='Number of timed runs of each command [15].')
+
+    return parser.parse_args()
+# }}}
+def median_ms(cmd, env, repeat):                            # {{{
+    times = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        subprocess.run(cmd, env=env, stdout=subprocess.DEVNULL, check=True)
+        times.append(1000*(time.perf_counter() - t0))
+    return statistics.median(times)
+# }}}
+def imported_modules(cmd, env):                             # {{{
+    P = subprocess.run([cmd[0], '-X', 'importtime'] + cmd[1:], env=env,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                       text=True, check=True)
+    modules = set()
+    for line in P.stderr.splitlines():
+        # import time:       281 |        281 | setapp_core
+        if line.startswith('import time:') and '|' in line:
+            modules.add(line.split('|')[-1].strip())
+    return modules
+# }}}
+def main():                                                 # {{{
+    args = parse_args()
+    failures = []
+
+    defaults = vars(setapp_core.arg_parser().parse_args([]))
+    if defaults != setapp_core.Quick_Defaults:
+        failures.append(f'Quick_Defaults differ from argparse: '
+                        f'{defaults} != {setapp_core.Quick_Defaults}')
+
+    with tempfile.TemporaryDirectory() as home:
+        os.makedirs(f'{home}/.config/setapp')
+        with open(f'{home}/.config/setapp/inputs.yaml', 'w') as fh:
+            fh.write(f'OS_aliases :\n  {os.uname().release} : Ubuntu_20.04\n')
+        env = { **os.environ, 'HOME' : home,
+                'SETAPP_TOOLS' : 'matlab/2022a' }
+        env.pop('PYTHONDONTWRITEBYTECODE', None)
+        env.pop('XDG_CACHE_HOME', None)
+        cmd = [ sys.executable, f'{Top_Dir}/setapp.py',
+                '-i', f'{Top_Dir}/Setapp_inputs.yaml', '-g' ]
+        # warm up: compiles setapp_core and the catalog cache
+        subprocess.run(cmd, env=env, stdout=subprocess.DEVNULL, check=True)
+
+        loaded = imported_modules(cmd, env)
+        for M in Lazy_Modules:
+            if M in loaded:
+                failures.append(f'setapp.py -g imported {M}')
+
+        bare  = median_ms([sys.executable, '-c', 'pass'], env, args.repeat)
+        total = median_ms(cmd, env, args.repeat)
+    print(f'python -c pass : {bare:7.1f} ms')
+    print(f'setapp.py -g   : {total:7.1f} ms  '
+          f'(+{total - bare:.1f} ms, budget {args.budget_ms:.1f} ms)')
+    if total - bare > args.budget_ms:
+        failures.append(f'setapp.py -g is {total - bare:.1f} ms over '
+                        f'the interpreter, budget is {args.budget_ms} ms')
+
+    for F in failures:
+        print(f'FAIL {F}')
+    if failures:
+        sys.exit(1)
+    print('OK')
+# }}}
+if __name__ == "__main__": main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""
+Compare switching a bundle of tools to new versions with swap_app()
+against the previous rm_app() + add_app() path.
+
+A synthetic catalog of N tools with two versions each (PATH+,
+MANPATH, LD_LIBRARY_PATH and a license entry) is loaded one tool at
+a time, in random order, at the first version; the user then puts
+~/bin in front of PATH.  Every tool is then switched to the second
+version.  For each path the median time, the size of the dotfile
+and whether PATH kept its order are reported.
+"""
+import sys
+import os
+import argparse
+import contextlib
+import io
+import random
+import statistics
+import time
+
+Test_Dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(Test_Dir))
+import setapp_core as SA
+
+OS = 'Bench_OS'
+
+def parse_args():                                           # {{{
+    parser = argparse.ArgumentParser(description=
+    """Time an N tool version switch, in place versus remove + add.""")
+
+    parser.add_argument('-t', '--tools', dest='n_tools',
+        action='store', type=int, default=50,
+        help='Number of tools in the bundle [50].')
+
+    parser.add_argument('-n', '--repeat', dest='repeat',
+        action='store', type=int, default=20,
+        help='Number of timed runs of each path [20].')
+
+    return parser.parse_args()
+# }}}
+def catalog(n_tools):                                       # {{{
+    data = {}
+    for i in range(n_tools):
+        app = f'tool{i:03d}'
+        ver = {}
+        for v in ('1.0', '2.0'):
+            ver[v] = { OS : { 'env' : [
+                { 'PATH+'           : f'/opt/{app}/{v}/bin' },
+                { 'MANPATH'         : f'/opt/{app}/{v}/man' },
+                { 'LD_LIBRARY_PATH' : f'/opt/{app}/{v}/lib' },
+                { 'LM_LICENSE_FILE' : '27000@license' },
+            ] } }
+        data[app] = { 'name' : app, 'default' : '2.0', 'ver' : ver }
+    return data
+# }}}
+def environ_after(environ, delta):                          # {{{
+    new = dict(environ)
+    for var, values in delta.items():
+        if not values:
+            new.pop(var, None)
+            continue
+        ref = f'${{{var}}}'
+        new[var] = ':'.join(environ.get(var, '') if v == ref else v
+                            for v in values)
+    return new
+# }}}
+def rm_add(index, apps, Old_Env):                           # {{{
+    ledger  = SA.read_ledger(index, Old_Env)
+    rm_Env  = SA.rm_app(index, apps, Old_Env, ledger=ledger)
+    add_Env = SA.add_app(index, apps, Old_Env)
+    return SA.merge_delta(rm_Env, add_Env)
+# }}}
+def swap(index, apps, Old_Env):                             # {{{
+    ledger = SA.read_ledger(index, Old_Env)
+    return SA.swap_app(index, apps, Old_Env, ledger)
+# }}}
+def measure(plan, index, apps, environ, repeat):            # {{{
+    times = []
+    for i in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            t0 = time.perf_counter()
+            delta = plan(index, apps, SA.get_current_env(environ))
+            times.append(1000*(time.perf_counter() - t0))
+    return statistics.median(times), delta
+# }}}
+def main():                                                 # {{{
+    args  = parse_args()
+    index = SA.Resolved(catalog(args.n_tools), OS)
+    names = sorted(index.data)
+
+    environ = { 'PATH' : '/usr/local/bin:/usr/bin:/bin' }
+    for app in random.Random(1).sample(names, len(names)):
+        with contextlib.redirect_stdout(io.StringIO()):
+            Old_Env = SA.get_current_env(environ)
+            ledger  = SA.read_ledger(index, Old_Env)
+            delta   = SA.swap_app(index, [f'{app}/1.0'], Old_Env, ledger)
+            delta['SETAPP_LEDGER'] = SA.ledger_value(index, Old_Env,
+                                                     ledger, delta)
+        environ = environ_after(environ, delta)
+    environ['PATH'] = '/home/user/bin:' + environ['PATH']
+
+    apps   = [ f'{a}/2.0' for a in names ]
+    before = [ p.split('/')[2] if p.startswith('/opt/') else p
+               for p in environ['PATH'].split(':') ]
+    print(f'{args.n_tools} tools, {len(before)} PATH entries, switching '
+          f'every tool from 1.0 to 2.0')
+    for label, plan in (('rm + add', rm_add), ('in place', swap)):
+        ms, delta = measure(plan, index, apps, environ, args.repeat)
+        lines = [ SA.shell_line(v, delta[v], 'bash') for v in delta ]
+        after = [ p.split('/')[2] if p.startswith('/opt/') else p
+                  for p in environ_after(environ, delta)['PATH'].split(':') ]
+        print(f'{label:9s}: {ms:7.2f} ms  {len(lines):2d} lines '
+              f'{sum(len(L) + 1 for L in lines):6d} bytes  PATH order '
+              f'{"kept" if after == before else "changed"}')
+# }}}
+if __name__ == "__main__": main()
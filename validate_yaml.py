@@ -1,19 +1,12 @@
 #!/usr/bin/env python3
+"""
+Check catalog files or directories, default Setapp_inputs.yaml.
+Same as "setapp.py --validate [--json] PATH ...".
+"""
 import sys
-import yaml
-import pprint
+import setapp_validate
 
-F = 'Setapp_inputs.yaml'
-pp = pprint.PrettyPrinter(indent=2)
-
-try:
-    D = yaml.safe_load(open(F))
-except yaml.constructor.ConstructorError as e:
-    print(f'Load error: {e}')
-    sys.exit(1)
-except yaml.parser.ParserError as e:
-    print(f'Parse error: {e}')
-    sys.exit(1)
-
-pp.pprint(D)
-print('Format OK')
+args    = sys.argv[1:]
+as_json = '--json' in args
+paths   = [ a for a in args if a != '--json' ] or [ 'Setapp_inputs.yaml' ]
+sys.exit(setapp_validate.run(paths, as_json=as_json))